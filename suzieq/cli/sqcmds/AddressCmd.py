@@ -39,7 +39,10 @@ class AddressCmd(SqCommand):
     @argument("vrf", description="VRF to qualify the address")
     @argument("ipvers", description="type of address, v4, v6 or l2",
               choices=["v4", "v6", "l2"])
-    def show(self, address: str = "", ipvers: str = "", vrf: str = ""):
+    @argument("prefix",
+              description="Prefixes, in quotes, to show addresses within")
+    def show(self, address: str = "", ipvers: str = "", vrf: str = "",
+             prefix: str = ""):
         """
         Show address info
         """
@@ -54,6 +57,7 @@ class AddressCmd(SqCommand):
                                 hostname=self.hostname,
                                 columns=self.columns,
                                 address=address.split(),
+                                prefix=prefix.split(),
                                 ipvers=ipvers,
                                 vrf=vrf,
                                 query_str=self.query_str,
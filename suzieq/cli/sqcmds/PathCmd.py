@@ -65,6 +65,40 @@ class PathCmd(SqCommand):
         if not df.empty:
             return self._gen_output(df, sort=False)
 
+    @command("bulk")
+    @argument("src", description="Source IP addresses, space separated")
+    @argument("dest", description="Destination IP addresses, space separated")
+    @argument("pairs",
+              description="source,destination IP address pairs, space "
+              "separated, instead of all sources to all destinations")
+    @argument("vrf", description="VRF to trace paths in")
+    @argument("workers", description="Number of processes to trace paths in")
+    def bulk(self, src: str = "", dest: str = "", pairs: str = "",
+             vrf: str = '', workers: int = 1):
+        """show paths between many source and target ip addresses"""
+        # Get the default display field names
+        if self.columns is None:
+            return
+
+        now = time.time()
+        if self.columns != ["default"]:
+            self.ctxt.sort_fields = None
+        else:
+            self.ctxt.sort_fields = []
+
+        try:
+            df = self.sqobj.bulk(
+                hostname=self.hostname, namespace=self.namespace,
+                source=src.split(), dest=dest.split(), pairs=pairs.split(),
+                vrf=vrf, workers=workers
+            )
+        except Exception as e:
+            df = pd.DataFrame({'error': ['ERROR: {}'.format(str(e))]})
+
+        self.ctxt.exec_time = "{:5.4f}s".format(time.time() - now)
+        if not df.empty:
+            return self._gen_output(df, sort=False)
+
     @command("summarize")
     @argument("src", description="Source IP address, in quotes")
     @argument("dest", description="Destination IP address, in quotes")
@@ -49,6 +49,18 @@ class SqDB(ABC):
         """
         raise NotImplementedError
 
+    def get_table_token(self, table_name: str) -> tuple:
+        """Return a token that changes whenever the table's data changes
+
+        Anything derived from the table's data can be cached along with the
+        token, and reused as long as the token is unchanged.
+
+        :param table_name: str, Name of the table
+        :returns: the token, None if the DB cannot tell when data changes
+        :rtype: tuple
+        """
+        return None
+
     @abstractmethod
     def coalesce(self, tables: List[str] = None, period: str = '') -> None:
         """Coalesce the database files in specified folder.
@@ -69,3 +81,4 @@ class SqCoalesceStats:
     fileCount: int          # number of files written
     recCount: int           # number of written records
     timestamp: int              # when this record was created
+    wallTime: float = 0         # elapsed time in secs, across all workers
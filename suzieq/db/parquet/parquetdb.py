@@ -1,14 +1,17 @@
 import os
 from time import time
+from uuid import uuid4
 from typing import List
 import logging
 from pathlib import Path
 import pyarrow.dataset as ds
 from itertools import zip_longest
 from datetime import datetime, timedelta, timezone
-from contextlib import suppress
+from contextlib import suppress, nullcontext
 from shutil import rmtree
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
 
 import pandas as pd
 import numpy as np
@@ -18,10 +21,27 @@ import pyarrow.parquet as pq
 from suzieq.db.base_db import SqDB, SqCoalesceStats
 from suzieq.utils import Schema, SchemaForTable
 
-from .pq_coalesce import SqCoalesceState, coalesce_resource_table
+from .pq_coalesce import (SqCoalesceState, coalesce_resource_table,
+                          ARCHIVE_MODES)
+from .pq_manifest import (SqParquetManifest, get_manifest_entries,
+                          get_coalesced_file_window)
+from .pq_latest import SqLatestSnapshot
+from .pq_cache import get_query_cache, get_dir_token
 from .migratedb import get_migrate_fn
 
 
+def _prepare_coalesce(cfg: dict, table_name: str) -> bool:
+    """Prepare the table for coalescing, run in the coalescer's workers"""
+    return SqParquetDB(cfg, None).prepare_coalesce(table_name)
+
+
+def _coalesce_table(cfg: dict, table_name: str, namespace: str, period: str,
+                    poller_periods: set) -> tuple:
+    """Coalesce the table's namespace, run in the coalescer's workers"""
+    return SqParquetDB(cfg, None).coalesce_table(table_name, namespace,
+                                                 period, poller_periods)
+
+
 class SqParquetDB(SqDB):
 
     def __init__(self, cfg: dict, logger: logging.Logger) -> None:
@@ -59,9 +79,41 @@ class SqParquetDB(SqDB):
 
         """
 
+        cache = None
+        if kwargs.get('use_manifest', True) and kwargs.get('use_snapshot',
+                                                           True):
+            cache = get_query_cache(self.cfg)
+        if not cache:
+            return self._read(table_name, data_format, **kwargs)
+
+        # The token must be fetched before the read to ensure we don't
+        # associate the result with data that changed during the read
+        token = self.get_table_token(table_name)
+        key = cache.make_key(os.path.abspath(self.cfg['data-directory']),
+                             table_name, data_format=data_format, **kwargs)
+        df = cache.get(key, token)
+        if df is not None:
+            return df
+
+        df = self._read(table_name, data_format, **kwargs)
+        if df is None:
+            return df
+        cache.put(key, token, df)
+        return df.copy()
+
+    def _read(self, table_name: str, data_format: str,
+              **kwargs) -> pd.DataFrame:
+        """Read the data from parquet files, bypassing the query cache"""
+
         if data_format not in self.supported_data_formats():
             return None
 
+        use_manifest = kwargs.pop('use_manifest', True)
+        use_snapshot = kwargs.pop('use_snapshot', True)
+        # Saved to retry the read without the manifest if required
+        read_args = dict(kwargs)
+        read_args['columns'] = list(kwargs['columns'])
+
         start = kwargs.pop("start_time")
         end = kwargs.pop("end_time")
         view = kwargs.pop("view")
@@ -94,35 +146,56 @@ class SqParquetDB(SqDB):
         sqvers = kwargs.pop('sqvers', None)
         datasets = []
         try:
-            dirs = Path(folder)
-            try:
-                for elem in dirs.iterdir():
-                    # Additional processing around sqvers filtering and data
-                    if 'sqvers=' not in str(elem):
-                        continue
-                    if sqvers and f'sqvers={sqvers}' != elem:
-                        continue
-                    elif need_sqvers:
-                        vers = float(str(elem).split('=')[-1])
-                        if vers > max_vers:
-                            max_vers = vers
-
-                    datasets.append(ds.dataset(elem, format='parquet',
-                                               partitioning='hive'))
-            except FileNotFoundError:
-                pass
-            except Exception as e:
-                raise e
-
-            # Now find the exact set of files we need to go over
-            cp_dataset = self._get_cp_dataset(table_name, need_sqvers, sqvers,
-                                              view, start, end)
-            if cp_dataset:
-                datasets.append(cp_dataset)
-
-            if not datasets:
-                datasets = [ds.dataset(folder, format='parquet',
-                                       partitioning='hive')]
+            snapshot = self._get_read_snapshot(table_name, view, start, end,
+                                               use_snapshot)
+            if snapshot:
+                # The latest state is all we need, read it straight off the
+                # table's snapshot
+                datasets, max_vers = snapshot.get_datasets(sqvers)
+                if not datasets:
+                    return pd.DataFrame(columns=fields)
+            else:
+                manifest = self._get_read_manifest(table_name, False,
+                                                   use_manifest)
+                if manifest:
+                    datasets, max_vers = self._get_manifest_datasets(
+                        manifest, sqvers, start, end,
+                        namespace=kwargs.get('namespace', []),
+                        hostname=kwargs.get('hostname', []))
+                else:
+                    dirs = Path(folder)
+                    try:
+                        for elem in dirs.iterdir():
+                            # Additional processing around sqvers filtering
+                            if 'sqvers=' not in str(elem):
+                                continue
+                            if sqvers and f'sqvers={sqvers}' != elem.name:
+                                continue
+                            elif need_sqvers:
+                                vers = float(str(elem).split('=')[-1])
+                                if vers > max_vers:
+                                    max_vers = vers
+
+                            datasets.append(ds.dataset(elem, format='parquet',
+                                                       partitioning='hive'))
+                    except FileNotFoundError:
+                        pass
+                    except Exception as e:
+                        raise e
+
+                # Now find the exact set of files we need to go over
+                cp_dataset = self._get_cp_dataset(table_name, need_sqvers,
+                                                  sqvers, view, start, end,
+                                                  use_manifest)
+                if cp_dataset:
+                    datasets.append(cp_dataset)
+
+                if not datasets:
+                    if manifest:
+                        # The index says there's nothing matching the request
+                        return pd.DataFrame(columns=fields)
+                    datasets = [ds.dataset(folder, format='parquet',
+                                           partitioning='hive')]
 
             # Build the filters for predicate pushdown
             master_schema = self._build_master_schema(datasets)
@@ -163,6 +236,13 @@ class SqParquetDB(SqDB):
                     all(x in final_df.columns for x in key_fields)):
                 final_df = final_df.set_index(key_fields) \
                                    .query('~index.duplicated(keep="last")')
+        except FileNotFoundError:
+            if use_manifest or use_snapshot:
+                # A file listed in the manifest has been removed underneath
+                # us, typically by the coalescer. Retry by walking the dirs.
+                return self.read(table_name, data_format, use_manifest=False,
+                                 use_snapshot=False, **read_args)
+            return pd.DataFrame(columns=fields)
         except (pa.lib.ArrowInvalid, OSError):
             return pd.DataFrame(columns=fields)
 
@@ -219,17 +299,22 @@ class SqParquetDB(SqDB):
                 table = pa.Table.from_pandas(df, schema=schema,
                                              preserve_index=False)
 
-            if filename_cb:
-                pq.write_to_dataset(table, root_path=folder,
-                                    partition_cols=partition_cols,
-                                    version="2.0", compression="ZSTD",
-                                    partition_filename_cb=filename_cb,
-                                    row_group_size=100000)
-            else:
-                pq.write_to_dataset(table, root_path=folder,
-                                    partition_cols=partition_cols,
-                                    version="2.0", compression="ZSTD",
-                                    row_group_size=100000)
+            if not filename_cb:
+                # Same naming as pyarrow's default, but we need to know the
+                # name to record it in the manifest
+                fname = f'{uuid4().hex}.parquet'
+
+                def filename_cb(keys):
+                    return fname
+
+            entries = get_manifest_entries(table, partition_cols,
+                                           filename_cb, coalesced)
+            pq.write_to_dataset(table, root_path=folder,
+                                partition_cols=partition_cols,
+                                version="2.0", compression="ZSTD",
+                                partition_filename_cb=filename_cb,
+                                row_group_size=100000)
+            self.get_manifest(table_name, coalesced).add_files(entries)
 
         return 0
 
@@ -249,16 +334,156 @@ class SqParquetDB(SqDB):
         :rtype: SqCoalesceStats
         """
 
-        infolder = self.cfg['data-directory']
-        outfolder = self._get_table_directory('', True)  # root folder
-        archive_folder = self.cfg.get('coalescer', {}) \
-                                 .get('archive-directory',
-                                      f'{infolder}/_archived')
-
         if not period:
             period = self.cfg.get(
                 'coalesceer', {'period': '1h'}).get('period', '1h')
+        if not self._get_coalesce_state(period):
+            return
         schemas = Schema(self.cfg.get('schema-directory'))
+
+        # Create list of tables to coalesce.
+        # TODO: Verify that we're only coalescing parquet tables here
+        if tables:
+            tables = [x for x in tables
+                      if schemas.tables() and
+                      (schemas.type_for_table(x) != "derivedRecord")]
+        else:
+            tables = [x for x in schemas.tables()
+                      if schemas.type_for_table(x) != "derivedRecord"]
+        if 'sqPoller' not in tables and not ign_sqpoller:
+            # This is an error. sqPoller keeps track of discontinuities
+            # among other things.
+            self.logger.error(
+                'No sqPoller data, cannot compute discontinuities')
+            return
+        else:
+            # We want sqPoller to be first to compute discontinuities
+            with suppress(ValueError):
+                tables.remove('sqPoller')
+
+        workers = self.cfg.get('coalescer', {}).get('workers', 1) or 1
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=get_context('fork'))
+        else:
+            pool = None
+
+        # We've forced the sqPoller to be always coalesced first, as the
+        # polling periods it yields are needed to coalesce the other tables
+        stats = []
+        poller_periods = set()
+        with pool or nullcontext():
+            if not ign_sqpoller:
+                poller_stats, poller_periods = self._coalesce_tables(
+                    pool, ['sqPoller'], period, poller_periods)
+                stats.extend(poller_stats)
+            table_stats, _ = self._coalesce_tables(pool, tables, period,
+                                                   poller_periods)
+            stats.extend(table_stats)
+
+        return stats
+
+    def _coalesce_tables(self, pool: ProcessPoolExecutor, tables: List[str],
+                         period: str, poller_periods: set) -> tuple:
+        """Coalesce the tables, in parallel if a pool is provided
+
+        The tables are prepared for coalescing, and then every namespace of
+        every table is coalesced as a separate task, streaming its data to
+        bound the memory used. With a pool, the tasks are run in parallel.
+
+        :param pool: ProcessPoolExecutor, the worker pool, None for serial
+        :param tables: List[str], the tables to coalesce
+        :param period: str, the coalescing period
+        :param poller_periods: set, the polling periods computed from sqPoller
+        :returns: the coalescing stats of every table, and the polling
+                  periods found if sqPoller was one of the tables
+        :rtype: tuple
+        """
+        results = self._run_coalesce_tasks(
+            pool, _prepare_coalesce, [(self.cfg, x) for x in tables])
+
+        tasks = []
+        failed = set()
+        for (_, table), result in results:
+            if isinstance(result, Exception):
+                self.logger.error(f'Unable to coalesce table {table}',
+                                  exc_info=result)
+                failed.add(table)
+            elif result:
+                namespaces = self._get_coalesce_namespaces(table) or ['']
+                tasks.extend((self.cfg, table, x, period, poller_periods)
+                             for x in namespaces)
+        results = self._run_coalesce_tasks(pool, _coalesce_table, tasks)
+
+        table_results = defaultdict(list)
+        found_periods = set()
+        for (_, table, namespace, _, _), result in results:
+            if isinstance(result, Exception):
+                where = f'namespace {namespace} of ' if namespace else ''
+                self.logger.error(f'Unable to coalesce {where}table {table}',
+                                  exc_info=result)
+                failed.add(table)
+                continue
+            table_results[table].append(result)
+            if table == 'sqPoller':
+                found_periods.update(result[4])
+
+        stats = []
+        now = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+        for table in tables:
+            rslts = table_results.get(table, [])
+            if not rslts and table not in failed:
+                continue
+            exec_time = sum(x[3]-x[2] for x in rslts)
+            wall_time = (max(x[3] for x in rslts) -
+                         min(x[2] for x in rslts)) if rslts else 0
+            stats.append(SqCoalesceStats(table, period, int(exec_time),
+                                         sum(x[0] for x in rslts),
+                                         sum(x[1] for x in rslts), now,
+                                         int(wall_time)))
+        return stats, found_periods
+
+    def _run_coalesce_tasks(self, pool: ProcessPoolExecutor, fn,
+                            tasks: List[tuple]) -> List[tuple]:
+        """Run fn with the args of every task, returning the args & result
+
+        The result is the exception raised if the task failed.
+        """
+        if not pool:
+            results = []
+            for args in tasks:
+                try:
+                    results.append((args, fn(*args)))
+                except Exception as ex:
+                    results.append((args, ex))
+            return results
+
+        futures = [(args, pool.submit(fn, *args)) for args in tasks]
+        results = []
+        for args, future in futures:
+            try:
+                results.append((args, future.result()))
+            except Exception as ex:
+                results.append((args, ex))
+        return results
+
+    def _get_coalesce_namespaces(self, table_name: str) -> List[str]:
+        """Return the namespaces with raw or coalesced data for the table"""
+        namespaces = set()
+        for coalesced in [False, True]:
+            folder = Path(self._get_table_directory(table_name, coalesced))
+            for nsdir in folder.glob('sqvers=*/namespace=*'):
+                if nsdir.is_dir():
+                    namespaces.add(nsdir.name.split('=', 1)[1])
+        return sorted(namespaces)
+
+    def _get_coalesce_state(self, period: str) -> SqCoalesceState:
+        """Return a coalescer state for the period, None if period is invalid
+
+        :param period: str, the coalescing period such as 1h
+        :returns: the coalescer state with the file prefixes of the period
+        :rtype: SqCoalesceState
+        """
         state = SqCoalesceState(self.logger, period)
 
         state.logger = self.logger
@@ -301,78 +526,101 @@ class SqParquetDB(SqDB):
                               'must be one of m/h/d/w')
         except ValueError:
             logging.error(f'Invalid time, {period}')
-            return
+            return None
 
         state.period = run_int
-        # Create list of tables to coalesce.
-        # TODO: Verify that we're only coalescing parquet tables here
-        if tables:
-            tables = [x for x in tables
-                      if schemas.tables() and
-                      (schemas.type_for_table(x) != "derivedRecord")]
-        else:
-            tables = [x for x in schemas.tables()
-                      if schemas.type_for_table(x) != "derivedRecord"]
-        if 'sqPoller' not in tables and not ign_sqpoller:
-            # This is an error. sqPoller keeps track of discontinuities
-            # among other things.
-            self.logger.error(
-                'No sqPoller data, cannot compute discontinuities')
-            return
-        else:
-            # We want sqPoller to be first to compute discontinuities
-            with suppress(ValueError):
-                tables.remove('sqPoller')
-            if not ign_sqpoller:
-                tables.insert(0, 'sqPoller')
+        return state
 
-        # We've forced the sqPoller to be always the first table to coalesce
-        stats = []
-        for entry in tables:
-            table_outfolder = f'{outfolder}/{entry}'
-            table_infolder = f'{infolder}//{entry}'
-            if archive_folder:
-                table_archive_folder = f'{archive_folder}/{entry}'
-            else:
-                table_archive_folder = None
-            state.current_df = pd.DataFrame()
-            state.dbeng = self
-            state.schema = SchemaForTable(entry, schemas, None)
-            if not os.path.isdir(table_infolder):
-                self.logger.info(
-                    f'No input records to coalesce for {entry}')
-                continue
-            try:
-                if not os.path.isdir(table_outfolder):
-                    os.makedirs(table_outfolder)
-                if (table_archive_folder and
-                        not os.path.isdir(table_archive_folder)):
-                    os.makedirs(table_archive_folder, exist_ok=True)
-                # Migrate the data if needed
-                self.logger.debug(f'Migrating data for {entry}')
-                self.migrate(entry, state.schema)
-                self.logger.debug(f'Migrating data for {entry}')
-                start = time()
-                coalesce_resource_table(table_infolder, table_outfolder,
-                                        table_archive_folder, entry,
-                                        state)
-                end = time()
-                self.logger.info(
-                    f'coalesced {state.wrfile_count} files/{state.wrrec_count} '
-                    f'records of {entry}')
-                stats.append(SqCoalesceStats(entry, period, int(end-start),
-                                             state.wrfile_count,
-                                             state.wrrec_count,
-                                             int(datetime.now(tz=timezone.utc)
-                                                 .timestamp() * 1000)))
-            except Exception:
-                self.logger.exception(f'Unable to coalesce table {entry}')
-                stats.append(SqCoalesceStats(entry, period, int(end-start),
-                                             0, 0,
-                                             int(datetime.now(tz=timezone.utc)
-                                                 .timestamp() * 1000)))
+    def prepare_coalesce(self, table_name: str) -> bool:
+        """Get the table ready to be coalesced
 
-        return stats
+        Creates the output folders, migrates the coalesced data, and builds
+        the manifest and latest state snapshot if needed.
+
+        :param table_name: str, the name of the table
+        :returns: False if the table has no data to coalesce
+        :rtype: bool
+        """
+        infolder = self.cfg['data-directory']
+        table_infolder = f'{infolder}//{table_name}'
+        table_outfolder = self._get_table_directory(table_name, True)
+        table_archive_folder = self._get_archive_directory(table_name)
+
+        if not os.path.isdir(table_infolder):
+            self.logger.info(
+                f'No input records to coalesce for {table_name}')
+            return False
+
+        schema = SchemaForTable(table_name,
+                                Schema(self.cfg.get('schema-directory')),
+                                None)
+        if not os.path.isdir(table_outfolder):
+            os.makedirs(table_outfolder, exist_ok=True)
+        if (table_archive_folder and
+                not os.path.isdir(table_archive_folder)):
+            os.makedirs(table_archive_folder, exist_ok=True)
+        # Migrate the data if needed
+        self.logger.debug(f'Migrating data for {table_name}')
+        self.migrate(table_name, schema)
+        self.update_manifest(table_name)
+        self.update_latest_snapshot(table_name, schema)
+        return True
+
+    def coalesce_table(self, table_name: str, namespace: str, period: str,
+                       poller_periods: set) -> tuple:
+        """Coalesce the table, of just the namespace if one is specified
+
+        :param table_name: str, the name of the table
+        :param namespace: str, the namespace to coalesce, empty for all
+        :param period: str, the coalescing period
+        :param poller_periods: set, the polling periods computed from sqPoller
+        :returns: the number of files & records coalesced, the start and end
+                  time of coalescing and the polling periods if sqPoller
+        :rtype: tuple
+        """
+        state = self._get_coalesce_state(period)
+        state.current_df = pd.DataFrame()
+        state.dbeng = self
+        state.namespace = namespace
+        state.poller_periods = set(poller_periods)
+        state.schema = SchemaForTable(table_name,
+                                      Schema(self.cfg.get('schema-directory')),
+                                      None)
+
+        archive_mode = self.cfg.get('coalescer', {}) \
+                               .get('archive-mode', 'tar')
+        if archive_mode not in ARCHIVE_MODES:
+            self.logger.error(f'Invalid archive-mode {archive_mode}, must be '
+                              f'one of {", ".join(ARCHIVE_MODES)}. Using tar')
+            archive_mode = 'tar'
+        state.archive_mode = archive_mode
+
+        start = time()
+        # Archiving is done in the background while the table is coalesced
+        with ThreadPoolExecutor(max_workers=1) as archiver:
+            state.archiver = archiver
+            coalesce_resource_table(
+                f'{self.cfg["data-directory"]}//{table_name}',
+                self._get_table_directory(table_name, True),
+                self._get_archive_directory(table_name),
+                table_name, state)
+        end = time()
+        where = f'namespace {namespace} of ' if namespace else ''
+        self.logger.info(
+            f'coalesced {state.wrfile_count} files/{state.wrrec_count} '
+            f'records of {where}{table_name}')
+        return (state.wrfile_count, state.wrrec_count, start, end,
+                state.poller_periods)
+
+    def _get_archive_directory(self, table_name: str) -> str:
+        """Return the folder to archive the table's coalesced files in"""
+        infolder = self.cfg['data-directory']
+        archive_folder = self.cfg.get('coalescer', {}) \
+                                 .get('archive-directory',
+                                      f'{infolder}/_archived')
+        if archive_folder:
+            return f'{archive_folder}/{table_name}'
+        return None
 
     def migrate(self, table_name: str, schema: SchemaForTable) -> None:
         """Migrates the data for the table specified to latest version
@@ -434,8 +682,193 @@ class SqParquetDB(SqDB):
 
                     rmtree(f'{self._get_table_directory(table_name, True)}/sqvers={sqvers}',
                            ignore_errors=True)
+                    # Files have moved around, the manifest needs a rescan
+                    self.get_manifest(table_name, True).invalidate()
+                    self.get_latest_snapshot(table_name).invalidate()
         return
 
+    def get_latest_snapshot(self, table_name: str) -> SqLatestSnapshot:
+        """Return the latest state snapshot for the table specified
+
+        :param table_name: str, the name of the table
+        :returns: the latest state snapshot object of the table
+        :rtype: SqLatestSnapshot
+        """
+        return SqLatestSnapshot(
+            self._get_table_directory(table_name, False), self.logger)
+
+    def update_latest_snapshot(self, table_name: str,
+                               schema: SchemaForTable) -> None:
+        """Build the table's latest state snapshot, or fold in its deltas
+
+        The poller keeps the snapshot up to date once its built, appending
+        the records it writes as deltas. This is invoked by the coalescer to
+        fold those deltas into the snapshot, and to build the snapshot of
+        tables written before the snapshot existed, or whose snapshot has been
+        invalidated.
+
+        :param table_name: str, the name of the table
+        :param schema: SchemaForTable, the schema of the table
+        """
+        if schema.type != "record":
+            return
+
+        snapshot = self.get_latest_snapshot(table_name)
+        arrow_schema = schema.get_arrow_schema()
+        if snapshot.is_complete():
+            snapshot.compact(schema.key_fields(), arrow_schema)
+            return
+
+        df = self.read(table_name, 'pandas', start_time='', end_time='',
+                       view='latest', columns=arrow_schema.names,
+                       key_fields=schema.key_fields(), use_snapshot=False)
+        if not df.empty:
+            schema_def = dict(zip(arrow_schema.names, arrow_schema.types))
+            defvals = self._get_default_vals()
+            for field in schema_def:
+                if field not in df.columns:
+                    df[field] = defvals.get(schema_def[field], '')
+            df['sqvers'] = schema.version
+            snapshot.merge(pa.Table.from_pandas(df, schema=arrow_schema,
+                                                preserve_index=False),
+                           schema.key_fields(), arrow_schema)
+            snapshot.compact(schema.key_fields(), arrow_schema)
+
+        snapshot.set_complete()
+        self.logger.info(f'Built latest state snapshot of {table_name} with '
+                         f'{df.shape[0]} records')
+
+    def _get_read_snapshot(self, table_name: str, view: str,
+                           start_time: float, end_time: float,
+                           use_snapshot: bool = True) -> SqLatestSnapshot:
+        """Return the snapshot if it can answer the read, else None"""
+        if not use_snapshot or view != 'latest' or start_time or end_time:
+            return None
+
+        snapshot = self.get_latest_snapshot(table_name)
+        if snapshot.is_complete():
+            return snapshot
+
+        return None
+
+    def get_manifest(self, table_name: str,
+                     coalesced: bool) -> SqParquetManifest:
+        """Return the file manifest for the table specified
+
+        :param table_name: str, the name of the table
+        :param coalesced: bool, True if you want the coalesced dir's manifest
+        :returns: the manifest object for the table's directory
+        :rtype: SqParquetManifest
+        """
+        return SqParquetManifest(
+            self._get_table_directory(table_name, coalesced), self.logger)
+
+    def update_manifest(self, table_name: str) -> None:
+        """Rebuild the table's manifests if they're not complete
+
+        This is invoked by the coalescer before coalescing a table, to ensure
+        stores that predate the manifest or whose manifest was invalidated
+        are indexed again.
+
+        :param table_name: str, the name of the table
+        """
+        for coalesced in [False, True]:
+            manifest = self.get_manifest(table_name, coalesced)
+            if not os.path.isdir(manifest.folder) or manifest.is_complete():
+                continue
+            start = time()
+            count = manifest.rebuild(coalesced)
+            self.logger.info(f'Indexed {count} files of {table_name} in '
+                             f'{manifest.folder} in {time()-start:.2f}s')
+
+    def get_table_token(self, table_name: str) -> tuple:
+        """Return the token identifying the table's data for the query cache
+
+        The token is built from the generation of the manifests of the
+        table's raw and coalesced directories. If a manifest isn't complete,
+        and so may not track all changes, the directory's mtime is used.
+        The latest state snapshot is updated after the manifest, and so its
+        generation is part of the token as well.
+
+        :param table_name: str, the name of the table
+        :returns: the token for the table's current data
+        :rtype: tuple
+        """
+        token = []
+        for coalesced in [False, True]:
+            manifest = self.get_manifest(table_name, coalesced)
+            if not os.path.isdir(manifest.folder):
+                token.append(None)
+            elif manifest.is_complete():
+                token.append(('generation', manifest.generation))
+            else:
+                token.append(('mtime',) + get_dir_token(manifest.folder))
+        snapshot = self.get_latest_snapshot(table_name)
+        token.append(('snapshot', snapshot.is_complete(),
+                      snapshot.generation))
+        return tuple(token)
+
+    def _get_read_manifest(self, table_name: str, coalesced: bool,
+                           use_manifest: bool = True) -> SqParquetManifest:
+        """Return the manifest to use for reads, None to walk the dirs"""
+        if not use_manifest:
+            return None
+
+        manifest = self.get_manifest(table_name, coalesced)
+        if manifest.is_complete():
+            return manifest
+
+        return None
+
+    def _get_manifest_filter(self, vals) -> List[str]:
+        """Return the list of values usable to prune files via manifest
+
+        Only positive matches can be used to prune, everything else is left
+        to the predicate pushdown.
+        """
+        if not vals:
+            return []
+        if not isinstance(vals, list):
+            vals = [vals]
+        if not all(isinstance(x, str) and not x.startswith('!')
+                   for x in vals):
+            return []
+        return vals
+
+    def _get_manifest_datasets(self, manifest: SqParquetManifest,
+                               sqvers: str, start_time: float,
+                               end_time: float, **kwargs) -> tuple:
+        """Return the datasets for the uncoalesced files via the manifest
+
+        :param manifest: SqParquetManifest, the manifest to use
+        :param sqvers: str, if we're looking only for files of a specific vers
+        :param start_time: float, the starting time window of data needed
+        :param end_time: float, the ending time window of data needed
+        :param kwargs: dict, the namespace and hostname filters, if any
+        :returns: list of datasets, one per sqvers, and max sqvers
+        :rtype: tuple
+        """
+        max_vers = 0
+        datasets = []
+
+        vers_list = [x for x in manifest.get_sqvers()
+                     if not sqvers or x == sqvers]
+        if vers_list:
+            max_vers = max(float(x) for x in vers_list)
+
+        files = manifest.get_files(
+            sqvers=sqvers,
+            namespace=self._get_manifest_filter(kwargs.get('namespace')),
+            hostname=self._get_manifest_filter(kwargs.get('hostname')),
+            start_time=start_time, end_time=end_time)
+
+        for vers, vers_df in files.groupby('sqvers'):
+            datasets.append(ds.dataset(
+                vers_df.path.tolist(), format='parquet', partitioning='hive',
+                partition_base_dir=f'{manifest.folder}/sqvers={vers}'))
+
+        return datasets, max_vers
+
     def _get_avail_sqvers(self, table_name: str, coalesced: bool) -> List[str]:
         """Get list of DB versions for a given table.
 
@@ -462,7 +895,8 @@ class SqParquetDB(SqDB):
 
     def _get_cp_dataset(self, table_name: str, need_sqvers: bool,
                         sqvers: str, view: str, start_time: float,
-                        end_time: float) -> ds.dataset:
+                        end_time: float,
+                        use_manifest: bool = True) -> ds.dataset:
         """Get the list of files to read in coalesced dir
 
         This iterates over the coalesced files that need to be read and comes
@@ -475,7 +909,8 @@ class SqParquetDB(SqDB):
         :param sqvers: str, if we're looking only for files of a specific vers
         :param view: str, whether to return the latest only OR all
         :param start_time: float, the starting time window of data needed
-        : param end_time: float, the ending time window of data needed
+        :param end_time: float, the ending time window of data needed
+        :param use_manifest: bool, False to ignore the manifest if present
         :returns: pyarrow dataset for the files to be read
         :rtype: pyarrow.dataset.dataset
 
@@ -502,26 +937,33 @@ class SqParquetDB(SqDB):
         if not dirs.exists() or not dirs.is_dir():
             return
 
-        for elem in dirs.iterdir():
+        manifest = self._get_read_manifest(table_name, True, use_manifest)
+        if manifest:
+            mdf = manifest.get_files(sqvers=sqvers)
+            vers_files = {f'sqvers={x}': y.path.tolist()
+                          for x, y in mdf.groupby('sqvers')}
+        else:
+            vers_files = {}
+            for elem in dirs.iterdir():
+                if 'sqvers=' not in str(elem):
+                    continue
+                if sqvers and f'sqvers={sqvers}' != elem.name:
+                    continue
+                vers_files[elem.name] = ds.dataset(
+                    elem, format='parquet', partitioning='hive').files
+
+        for elem, vfiles in vers_files.items():
             # Additional processing around sqvers filtering and data
-            if 'sqvers=' not in str(elem):
-                continue
-            if sqvers and f'sqvers={sqvers}' != elem.name:
-                continue
-            elif need_sqvers:
+            if need_sqvers:
                 vers = float(str(elem).split('=')[-1])
                 if vers > max_vers:
                     max_vers = vers
 
-            dataset = ds.dataset(elem, format='parquet', partitioning='hive')
-            total_files = len(dataset.files)
-
-            # 100 is an arbitrary number, trying to reduce file I/O
             if all_files:
-                files = dataset.files
+                files = vfiles
             else:
                 lists = defaultdict(list)
-                for f in dataset.files:
+                for f in vfiles:
                     nsp = os.path.dirname(f).split('namespace=')[-1]
                     lists[nsp].append(f)
 
@@ -534,9 +976,7 @@ class SqParquetDB(SqDB):
 
                     start_selected = False
                     for i, file in enumerate(lists[ele]):
-                        thistime = os.path.basename(file).split('.')[0] \
-                                                         .split('-')[-2:]
-                        thistime = [int(x)*1000 for x in thistime]  # to msec
+                        thistime = get_coalesced_file_window(file)
                         if (not start_time) or start_selected or (
                                 thistime[0] <= start_time <= thistime[1]):
                             if not end_time:
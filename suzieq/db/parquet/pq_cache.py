@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Defaults for the analyzer's query-cache-entries & query-cache-bytes knobs
+QUERY_CACHE_ENTRIES = 64
+QUERY_CACHE_BYTES = 256*1024*1024
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def get_dir_token(folder: str) -> tuple:
+    """Return a token that changes whenever files are added or removed
+
+    Adding, removing or renaming a file updates the mtime of the directory
+    containing it. So the newest mtime of all the directories under the
+    folder, along with their count, identifies the state of the folder.
+
+    :param folder: str, the folder to compute the token for
+    :returns: the newest mtime in nsecs and count of directories
+    :rtype: tuple
+    """
+    newest = 0
+    count = 0
+    dirs = [folder]
+    while dirs:
+        curdir = dirs.pop()
+        try:
+            newest = max(newest, os.stat(curdir).st_mtime_ns)
+            with os.scandir(curdir) as entries:
+                dirs.extend(x.path for x in entries if x.is_dir())
+        except FileNotFoundError:
+            continue
+        count += 1
+    return (newest, count)
+
+
+class SqQueryCache(object):
+    '''LRU cache of the results of reads from the database
+
+    The results are cached by the table and all the parameters of the read.
+    Every entry also saves the token, such as the manifest generation,
+    identifying the state of the table when it was read. An entry is only
+    returned if the table's token hasn't changed since, else its discarded.
+    The key includes the database read, as a process can read many.
+    The cache is per process, and so shared by all the objects reading the
+    database in that process.
+    '''
+
+    def __init__(self, max_entries: int = QUERY_CACHE_ENTRIES,
+                 max_bytes: int = QUERY_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(store: str, table_name: str, **kwargs) -> str:
+        """Return the cache key for a read of the table with the params
+
+        :param store: str, identifies the database read, such as its folder,
+                      as the tokens of tables in different DBs can be equal
+        :param table_name: str, the table read
+        :param kwargs: the params of the read
+        :returns: the cache key
+        :rtype: str
+        """
+        return repr((store, table_name, sorted(kwargs.items())))
+
+    def get(self, key: str, token: tuple) -> pd.DataFrame:
+        """Return a copy of the cached result, None if not found or stale
+
+        :param key: str, the key as returned by make_key
+        :param token: tuple, the current token of the table read
+        :returns: the cached dataframe or None
+        :rtype: pd.DataFrame
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry and entry[0] != token:
+                self._remove(key)
+                self.invalidations += 1
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Callers are free to modify what's returned
+            return entry[1].copy()
+
+    def put(self, key: str, token: tuple, df: pd.DataFrame) -> None:
+        """Cache the result of a read, the caller must not modify the df
+
+        :param key: str, the key as returned by make_key
+        :param token: tuple, the token of the table when the read began
+        :param df: pd.DataFrame, the result of the read
+        """
+        nbytes = int(df.memory_usage(index=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (token, df, nbytes)
+            self._nbytes += nbytes
+            while (len(self._entries) > self.max_entries or
+                   self._nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all the entries"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> dict:
+        """Return the counters of the cache"""
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._nbytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'evictions': self.evictions}
+
+    def _remove(self, key: str) -> None:
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+
+def get_query_cache(cfg: dict) -> SqQueryCache:
+    """Return the query cache of this process, None if disabled
+
+    The cache is sized by the query-cache-entries and query-cache-bytes
+    knobs of the analyzer section of the config the first time its used.
+    Setting query-cache-entries to 0 disables the cache.
+
+    :param cfg: dict, the Suzieq config
+    :returns: the query cache or None
+    :rtype: SqQueryCache
+    """
+    global _query_cache
+
+    if _query_cache is None:
+        analyzer_cfg = cfg.get('analyzer', {}) or {}
+        max_entries = analyzer_cfg.get('query-cache-entries',
+                                       QUERY_CACHE_ENTRIES)
+        max_bytes = analyzer_cfg.get('query-cache-bytes', QUERY_CACHE_BYTES)
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = SqQueryCache(max_entries, max_bytes)
+
+    if not _query_cache.max_entries:
+        return None
+    return _query_cache
@@ -1,15 +1,29 @@
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 import pyarrow.dataset as ds    # put this later due to some numpy dependency
 from datetime import datetime, timedelta, timezone
 import logging
 from typing import List
 import tarfile
+import shutil
+from uuid import uuid4
 from itertools import repeat
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 
 from suzieq.utils import humanize_timestamp, SchemaForTable
 from .migratedb import get_migrate_fn
+from .pq_manifest import (SqParquetManifest, get_parquet_file_timestamps,
+                          get_coalesced_file_window)
+
+# Number of threads reading parquet file footers in parallel
+FILE_SCAN_WORKERS = 8
+# Max rows read & written at a time when coalescing a namespace
+STREAM_BATCH_ROWS = 100000
+ARCHIVE_MODES = ['tar', 'tar.bz2', 'parquet', 'move']
 
 
 class SqCoalesceState(object):
@@ -27,6 +41,12 @@ class SqCoalesceState(object):
         self.wrfile_count = 0
         self.wrrec_count = 0
         self.poller_periods = set()
+        self.namespace = ''     # coalesce only this namespace if set
+        # The coalesced file with the last known state of the namespace
+        self.last_file = None
+        self.archive_mode = 'tar'
+        # Executor archiving the coalesced files in the background, if any
+        self.archiver = None
         self.block_start = self.block_end = 0
 
     def pq_file_name(self, *args):
@@ -42,24 +62,129 @@ class SqCoalesceState(object):
 
 
 def archive_coalesced_files(filelist: List[str], outfolder: str,
-                            state: SqCoalesceState, dodel: bool) -> None:
-    """Tars and removes the already coalesced files
+                            state: SqCoalesceState, dodel: bool,
+                            in_basedir: str = None) -> None:
+    """Archives and removes the already coalesced files
+
+    The files are archived as specified by the state's archive mode:
+        tar: uncompressed tarball, the files are already compressed
+        tar.bz2: bzip2 compressed tarball
+        parquet: a single parquet file with the data of all the files
+        move: moved into a tree of the block's date under the outfolder
+
+    If the state has an archiver, the archiving is done in the background by
+    it. The files are then moved right away under a hidden staging folder of
+    the in_basedir, and are removed once archived. If the archiving fails,
+    the files are left in the staging folder.
 
     :param filelist: List{str], list of files to be tarred and archived
     :param outfolder: str, folder name where the archive is to be stored
     :param state: SqCoalesceState, state of coalesceer
     :param dodel: bool, True if the coalesced files must be deleted
+    :param in_basedir: str, base directory of the files, needed to stage
+                       the files for the archiver
     :returns: Nothing
     """
-    if filelist and outfolder:
-        with tarfile.open(f'{outfolder}/_archive-{state.prefix}-'
-                          f'{state.block_start}-{state.block_end}.tar.bz2',
-                          'w:bz2') as f:
+    if not filelist:
+        return
+
+    if outfolder:
+        # Namespaces coalesced in parallel archive the same time block
+        nspart = f'{state.namespace}-' if state.namespace else ''
+        if state.archive_mode == 'move':
+            archive_name = f'{outfolder}/' + \
+                datetime.fromtimestamp(state.block_start, timezone.utc) \
+                        .strftime('%Y-%m-%d')
+        else:
+            archive_name = (f'{outfolder}/_archive-{state.prefix}-{nspart}'
+                            f'{state.block_start}-{state.block_end}')
+
+        if dodel and state.archiver and in_basedir:
+            staging_dir = f'{in_basedir}/_archiving/{uuid4().hex}'
             for file in filelist:
-                f.add(file)
-    if dodel:
+                staged = f'{staging_dir}/{os.path.relpath(file, in_basedir)}'
+                os.makedirs(os.path.dirname(staged), exist_ok=True)
+                os.replace(file, staged)
+            state.archiver.submit(_archive_files, staging_dir, filelist,
+                                  archive_name, state.archive_mode,
+                                  state.logger, in_basedir=in_basedir)
+        else:
+            _archive_files(in_basedir, filelist, archive_name,
+                           state.archive_mode, state.logger, remove=dodel)
+    elif dodel:
         [os.remove(x) for x in filelist]
 
+    if dodel:
+        state.dbeng.get_manifest(state.table_name, False) \
+                   .remove_files(filelist)
+
+
+def _archive_files(basedir: str, filelist: List[str], archive_name: str,
+                   mode: str, logger: logging.Logger, remove: bool = True,
+                   in_basedir: str = None) -> None:
+    """Archive the files, run by the archiver if there's one
+
+    :param basedir: str, the folder with the files, the partition base dir
+    :param filelist: List[str], the original path of the files
+    :param archive_name: str, the archive's path without the suffix, or the
+                         folder to move the files to
+    :param mode: str, the archive mode
+    :param logger: logging.Logger, the logger to log errors to
+    :param remove: bool, True if the files must be removed once archived
+    :param in_basedir: str, the original folder of the files if they've
+                       been staged under basedir, which is removed when done
+    """
+    if basedir:
+        relpaths = [os.path.relpath(x, in_basedir or basedir)
+                    for x in filelist]
+        files = [f'{basedir}/{x}' for x in relpaths]
+    else:
+        relpaths = [os.path.basename(x) for x in filelist]
+        files = filelist
+
+    try:
+        if mode == 'move':
+            for file, relpath in zip(files, relpaths):
+                dest = f'{archive_name}/{relpath}'
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                if remove:
+                    shutil.move(file, dest)
+                else:
+                    shutil.copy2(file, dest)
+        elif mode == 'parquet':
+            # The files can be of different versions of the table's schema
+            schema = pa.unify_schemas(
+                [ds.dataset(source=files, partitioning='hive',
+                            partition_base_dir=basedir,
+                            format='parquet').schema] +
+                [pq.read_schema(x) for x in files])
+            dataset = ds.dataset(source=files, schema=schema,
+                                 partitioning='hive',
+                                 partition_base_dir=basedir,
+                                 format='parquet')
+            with pq.ParquetWriter(f'{archive_name}.parquet', schema,
+                                  version='2.0',
+                                  compression='ZSTD') as writer:
+                for batch in dataset.to_batches(
+                        batch_size=STREAM_BATCH_ROWS, use_threads=False):
+                    writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            tarmode, suffix = ('w:bz2', 'tar.bz2') if mode == 'tar.bz2' \
+                else ('w', 'tar')
+            with tarfile.open(f'{archive_name}.{suffix}', tarmode) as f:
+                for file, origfile in zip(files, filelist):
+                    f.add(file, arcname=origfile)
+    except Exception:
+        where = basedir if in_basedir else 'place'
+        logger.exception(f'Unable to archive coalesced files, leaving them '
+                         f'in {where}')
+        return
+
+    if remove and mode != 'move':
+        [os.remove(x) for x in files]
+    if in_basedir:
+        shutil.rmtree(basedir, ignore_errors=True)
+
 
 def write_files(table: str, filelist: List[str], in_basedir: str,
                 outfolder: str, partition_cols: List[str],
@@ -78,6 +203,11 @@ def write_files(table: str, filelist: List[str], in_basedir: str,
     :param block_end: dateime, ending time window of this coalescing block
     :returns: Nothing
     """
+    if state.namespace:
+        write_namespace_files(table, filelist, in_basedir, outfolder, state,
+                              block_start, block_end)
+        return
+
     if not filelist and not state.schema.type == "record":
         return
 
@@ -124,27 +254,229 @@ def write_files(table: str, filelist: List[str], in_basedir: str,
                                   .query('~index.duplicated(keep="last")')
 
 
+class CoalescedFileWriter(object):
+    '''Writes the coalesced file of a namespace a chunk at a time
+
+    The file is written under a hidden name and renamed when its complete,
+    so readers never see a partially written file. No file is created if
+    no rows are written.
+    '''
+
+    def __init__(self, outfolder: str, state: SqCoalesceState):
+        # The partition columns are encoded in the path, not in the file
+        self.schema = pa.schema(
+            [x for x in state.schema.get_arrow_schema()
+             if x.name not in ['sqvers', 'namespace']])
+        self.path = (f'sqvers={state.schema.version}/'
+                     f'namespace={state.namespace}/{state.pq_file_name()}')
+        self.filename = f'{outfolder}/{self.path}'
+        self.num_rows = 0
+        self._tmpname = (f'{os.path.dirname(self.filename)}/'
+                         f'.{os.path.basename(self.filename)}')
+        self._writer = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Append the rows of the dataframe to the file"""
+        if df.empty:
+            return
+        table = pa.Table.from_pandas(df[self.schema.names],
+                                     schema=self.schema,
+                                     preserve_index=False)
+        if not self._writer:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self._writer = pq.ParquetWriter(self._tmpname, self.schema,
+                                            version='2.0',
+                                            compression='ZSTD')
+        self._writer.write_table(table, row_group_size=STREAM_BATCH_ROWS)
+        self.num_rows += df.shape[0]
+
+    def close(self) -> bool:
+        """Complete the file, returning True if a file was written"""
+        if not self._writer:
+            return False
+        self._writer.close()
+        os.replace(self._tmpname, self.filename)
+        return True
+
+    def abort(self) -> None:
+        """Discard what's been written"""
+        if self._writer:
+            self._writer.close()
+            with suppress(FileNotFoundError):
+                os.remove(self._tmpname)
+
+
+def get_key_hash(df: pd.DataFrame, keys: List[str]) -> np.ndarray:
+    """Return a 64-bit hash of the key fields of every row of the dataframe
+
+    :param df: pd.DataFrame, the dataframe with the key fields
+    :param keys: List[str], the key fields
+    :returns: array with the hash of each row
+    :rtype: np.ndarray
+    """
+    return pd.util.hash_pandas_object(df[keys], index=False).to_numpy()
+
+
+def _iter_chunks(dataset: ds.Dataset, columns: List[str] = None):
+    """Yield the dataset as dataframes of a bounded number of rows
+
+    The chunks are yielded in the same order every time the dataset is read.
+    """
+    for batch in dataset.to_batches(columns=columns,
+                                    batch_size=STREAM_BATCH_ROWS,
+                                    use_threads=False):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _prepare_chunk(df: pd.DataFrame, state: SqCoalesceState,
+                   defvals: dict) -> pd.DataFrame:
+    """Migrate the chunk to the current schema, ready to be written"""
+    df = migrate_df(state.table_name, df, state.schema)
+    missing = {x.name: defvals.get(x.type, '')
+               for x in state.schema.get_arrow_schema()
+               if x.name not in df.columns}
+    return df.assign(sqvers=state.schema.version, **missing)
+
+
+def _iter_last_state(outfolder: str, state: SqCoalesceState, defvals: dict,
+                     skip_keys: np.ndarray):
+    """Yield the last known record of every key of the namespace
+
+    The last known state of a namespace is the latest record of every key
+    in the namespace's last coalesced file. The file is read twice, once to
+    find the position of every key's latest record using just the key
+    fields, and again to yield those records a chunk at a time.
+
+    :param outfolder: str, the coalesced folder of the table
+    :param state: SqCoalesceState, coalescer state with the last file
+    :param defvals: dict, default value of every arrow type
+    :param skip_keys: np.ndarray, hash of the keys to skip
+    """
+    dataset = ds.dataset(source=[state.last_file], partitioning='hive',
+                         partition_base_dir=outfolder, format='parquet')
+    keycols = [x for x in state.keys + ['timestamp']
+               if x in dataset.schema.names]
+    hashes = []
+    timestamps = []
+    for df in _iter_chunks(dataset, keycols):
+        hashes.append(get_key_hash(df, state.keys))
+        timestamps.append(df.timestamp.to_numpy())
+    if not hashes:
+        return
+
+    hashes = np.concatenate(hashes)
+    timestamps = np.concatenate(timestamps)
+    # Sort by key and then time, the last row of each key is its latest
+    order = np.lexsort((np.arange(len(hashes)), timestamps, hashes))
+    sorted_hashes = hashes[order]
+    is_latest = np.append(sorted_hashes[1:] != sorted_hashes[:-1], True)
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[order[is_latest]] = True
+    keep &= ~np.isin(hashes, skip_keys)
+
+    offset = 0
+    for df in _iter_chunks(dataset):
+        mask = keep[offset:offset+df.shape[0]]
+        offset += df.shape[0]
+        if mask.any():
+            yield _prepare_chunk(df[mask], state, defvals)
+
+
+def write_namespace_files(table: str, filelist: List[str], in_basedir: str,
+                          outfolder: str, state: SqCoalesceState,
+                          block_start, block_end) -> None:
+    """Write the data of a namespace's files out as a single coalesced block
+
+    Unlike write_files, the data is streamed a chunk at a time from the files
+    to the coalesced file, bounding the memory used independent of the size
+    of the namespace. For record tables, the last known state of the keys
+    not in the files is read back from the namespace's last coalesced file
+    instead of being held in memory, and only the hash of the keys seen in
+    this block is kept.
+
+    :param table: str, Name of the table for which we're writing the files
+    :param filelist: List[str], list of files to write the data to
+    :param in_basedir: str, base directory of the read files,
+                       to get partition date
+    :param outfolder: str, the outgoing folder to write the data to
+    :param state: SqCoalesceState, coalescer state, with the namespace
+    :param block_start: dateime, starting time window of this coalescing block
+    :param block_end: dateime, ending time window of this coalescing block
+    :returns: Nothing
+    """
+    is_record = state.schema.type == "record"
+    if not filelist and not (is_record and state.last_file):
+        return
+
+    state.block_start = int(block_start.timestamp())
+    state.block_end = int(block_end.timestamp())
+    defvals = state.dbeng._get_default_vals()
+    writer = CoalescedFileWriter(outfolder, state)
+    block_keys = [np.array([], dtype=np.uint64)]
+    try:
+        if filelist:
+            dataset = ds.dataset(source=filelist, partitioning='hive',
+                                 partition_base_dir=in_basedir,
+                                 format='parquet')
+            for df in _iter_chunks(dataset):
+                state.wrrec_count += df.shape[0]
+                df = _prepare_chunk(df, state, defvals)
+                if is_record:
+                    block_keys.append(get_key_hash(df, state.keys))
+                writer.write(df)
+
+        if is_record and state.last_file:
+            for df in _iter_last_state(outfolder, state, defvals,
+                                       np.concatenate(block_keys)):
+                writer.write(df)
+    except Exception:
+        writer.abort()
+        raise
+
+    if not writer.close():
+        return
+
+    start_time, end_time = get_coalesced_file_window(writer.path)
+    state.dbeng.get_manifest(state.table_name, True).add_files([{
+        'path': writer.path, 'sqvers': state.schema.version,
+        'namespace': state.namespace, 'start_time': start_time,
+        'end_time': end_time, 'num_rows': writer.num_rows}])
+    if is_record:
+        # This file now has the last known state of the namespace
+        state.last_file = writer.filename
+
+
 def find_broken_files(parent_dir: str) -> List[str]:
     """Find any files in the parent_dir that pyarrow can't read
+    Only the footer of every file is read, with many files examined in
+    parallel.
+
     :parame parent_dir: str, the parent directory to investigate
     :returns: list of broken files
     :rtype: list of strings
     """
 
     all_files = []
-    broken_files = []
     ro, pa = os.path.split(parent_dir)
     for root, dirs, files in os.walk(parent_dir):
         if not '_archived' in root and not '.sq-coalescer.pid' in files and len(files) > 0:
             path = root.replace(ro, '')
-            all_files.extend(list(map(lambda x: f"{path}/{x}", files)))
-    for file in all_files:
+            # Skip hidden and internal files such as the manifest
+            all_files.extend([f"{path}/{x}" for x in files
+                              if not x.startswith(('.', '_'))])
+
+    def is_broken(file: str) -> bool:
         try:
-            pq.ParquetFile(f"{ro}/{file}")
-        except pq.lib.ArrowInvalid as e:
-            broken_files.append(file)
+            pq.read_metadata(f"{ro}/{file}")
+        except pq.lib.ArrowInvalid:
+            return True
+        return False
 
-    return broken_files
+    with ThreadPoolExecutor(max_workers=FILE_SCAN_WORKERS) as pool:
+        return [x for x, broken in zip(all_files,
+                                       pool.map(is_broken, all_files))
+                if broken]
 
 
 def move_broken_files(parent_dir: str, state: SqCoalesceState, out_dir: str = '_broken', ) -> None:
@@ -165,17 +497,31 @@ def move_broken_files(parent_dir: str, state: SqCoalesceState, out_dir: str = '_
         dst = f"{ro}/{out_dir}/{file}"
 
         if not os.path.exists(os.path.dirname(dst)):
-            os.makedirs(os.path.dirname(dst))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
         state.logger.debug(f"moving broken file {src} to {dst}")
-        os.replace(src, dst)
+        # Another worker coalescing the table may've moved it already
+        with suppress(FileNotFoundError):
+            os.replace(src, dst)
+
+    if broken_files and state.dbeng:
+        state.dbeng.get_manifest(state.table_name, False) \
+                   .remove_files([f"{ro}/{x}" for x in broken_files])
 
 
-def get_file_timestamps(filelist: List[str]) -> pd.DataFrame:
-    """Read the files and construct a dataframe of files and timestamp of
-       record in them.
+def get_file_timestamps(filelist: List[str],
+                        manifest: SqParquetManifest = None) -> pd.DataFrame:
+    """Construct a dataframe of files and the timestamp of the first record
+       in them.
+
+    The timestamps are taken from the table's manifest if its complete, as the
+    writer records the time window of every file it writes. The timestamps of
+    the files not in the manifest are derived from the row group statistics
+    in their footers, with many files examined in parallel. So the cost is
+    proportional to the number of files and not the amount of data in them.
 
     :param filelist: list, of full path name files, typically from pyarrow's
                      dataset.files
+    :param manifest: SqParquetManifest, the manifest of the files' table
     :returns: dataframe of filename with the time it represents, sorted
     :rtype: pandas.DataFrame
 
@@ -183,29 +529,34 @@ def get_file_timestamps(filelist: List[str]) -> pd.DataFrame:
     if not filelist:
         return pd.DataFrame(columns=['file', 'timestamp'])
 
-    # We can't rely on the system istat time to find the times involved
-    # So read the data for each block and check. We tried using threading
-    # and it didn't dramatically alter the results. Given that we might've
-    # too many threads running with the poller and everything, we skipped
-    # doing it.
-    fname_list = []
-    fts_list = []
-    for file in filelist:
+    known = {}
+    if manifest and manifest.is_complete():
+        mdf = manifest.get_files()
+        known = dict(zip(mdf.path, mdf.start_time))
+
+    def get_timestamp(file: str) -> int:
+        start_time = known.get(os.path.abspath(file), None)
+        if start_time is not None:
+            return start_time
         try:
-            ts = pd.read_parquet(file, columns=['timestamp'])
-            fts_list.append(ts.timestamp.min())
-            fname_list.append(file)
-        except OSError:
+            start_time, _, num_rows = get_parquet_file_timestamps(file)
+        except (OSError, ValueError, pq.lib.ArrowInvalid):
             # skip this file because it can't be read, is probably 0 bytes
             logging.debug(f"not reading timestamp for {file}")
+            return None
+        return start_time if num_rows else None
+
+    with ThreadPoolExecutor(max_workers=FILE_SCAN_WORKERS) as pool:
+        fts_list = list(pool.map(get_timestamp, filelist))
 
     # Construct file dataframe as its simpler to deal with
-    if fname_list:
-        fdf = pd.DataFrame({'file': fname_list, 'timestamp': fts_list})
+    fdf = pd.DataFrame({'file': filelist, 'timestamp': fts_list}) \
+            .dropna()
+    if not fdf.empty:
         fdf['timestamp'] = humanize_timestamp(fdf.timestamp, 'UTC')
         return fdf.sort_values(by=['timestamp'])
 
-    return pd.DataFrame(['file', 'timestamp'])
+    return pd.DataFrame(columns=['file', 'timestamp'])
 
 
 def migrate_df(table_name: str, df: pd.DataFrame,
@@ -229,11 +580,55 @@ def migrate_df(table_name: str, df: pd.DataFrame,
     return df
 
 
+def get_table_files(folder: str, state: SqCoalesceState,
+                    ign_pfx: List[str] = None) -> List[str]:
+    """Return the parquet files of the table folder
+
+    Only the namespace's folders are examined if the state has a namespace.
+
+    :param folder: str, the table's folder
+    :param state: SqCoalesceState, coalescer state
+    :param ign_pfx: List[str], prefixes of the files and folders to ignore
+    :returns: list of files
+    :rtype: List[str]
+    """
+    ign_pfx = ign_pfx or ['.', '_']
+    if not state.namespace:
+        return ds.dataset(folder, partitioning='hive', format='parquet',
+                          ignore_prefixes=ign_pfx).files
+
+    files = []
+    with os.scandir(folder) as entries:
+        nsdirs = sorted(f'{x.path}/namespace={state.namespace}'
+                        for x in entries
+                        if x.is_dir() and x.name.startswith('sqvers='))
+    for nsdir in nsdirs:
+        if os.path.isdir(nsdir):
+            files.extend(ds.dataset(nsdir, format='parquet',
+                                    ignore_prefixes=ign_pfx).files)
+    return files
+
+
+def get_last_update_files(outfolder: str, state: SqCoalesceState) -> dict:
+    """Return the last coalesced file of every namespace of the table
+
+    :param outfolder: str, folder from where to gather the files
+    :param state: SqCoalesceState, coalesceer state
+    :returns: dictionary of namespace to the latest coalesced file
+    :rtype: dict
+    """
+    files = sorted([x for x, y in zip(get_table_files(outfolder, state),
+                                      repeat(state.prefix))
+                    if os.path.basename(x).startswith(y)])
+
+    return {x.split('namespace=')[1].split('/')[0]: x for x in files}
+
+
 def get_last_update_df(table_name: str, outfolder: str,
                        state: SqCoalesceState) -> pd.DataFrame:
     """Return a dataframe with the last known values for all keys
     The dataframe is sorted by timestamp and the index set to the keys. Works
-    across namespaces.
+    across namespaces, unless the state is restricted to a single namespace.
 
     This is used when the coalesceer starts up and doesn't have any state
     about a table.
@@ -245,16 +640,10 @@ def get_last_update_df(table_name: str, outfolder: str,
     :rtype: pandas.DataFrame
 
     """
-    dataset = ds.dataset(outfolder, partitioning='hive', format='parquet')
-    files = sorted([x for x, y in zip(dataset.files, repeat(state.prefix))
-                    if os.path.basename(x).startswith(y)])
-
-    if not files:
+    latest_files = list(get_last_update_files(outfolder, state).values())
+    if not latest_files:
         return pd.DataFrame()
-    latest_filedict = {x.split('namespace=')[1].split('/')[0]: x
-                       for x in files}
 
-    latest_files = list(latest_filedict.values())
     current_df = ds.dataset(source=latest_files, partitioning='hive',
                             format='parquet') \
         .to_table() \
@@ -308,21 +697,24 @@ def coalesce_resource_table(infolder: str, outfolder: str, archive_folder: str,
 
     if state.schema.type == "record":
         state.keys = schema.key_fields()
-        if state.current_df.empty:
+        if state.namespace:
+            # The state is streamed from the last coalesced file as needed
+            state.last_file = get_last_update_files(outfolder, state) \
+                .get(state.namespace, None)
+        elif state.current_df.empty:
             state.current_df = get_last_update_df(table, outfolder, state)
 
     # Ignore reading the compressed files
     try:
-        dataset = ds.dataset(infolder, partitioning='hive', format='parquet',
-                             ignore_prefixes=state.ign_pfx)
+        files = get_table_files(infolder, state, state.ign_pfx)
     except OSError as e:
         move_broken_files(infolder, state=state)
-        dataset = ds.dataset(infolder, partitioning='hive', format='parquet',
-                             ignore_prefixes=state.ign_pfx)
+        files = get_table_files(infolder, state, state.ign_pfx)
 
-    state.logger.info(f'Examining {len(dataset.files)} {table} files '
+    state.logger.info(f'Examining {len(files)} {table} files '
                       f'for coalescing')
-    fdf = get_file_timestamps(dataset.files)
+    manifest = state.dbeng.get_manifest(table, False) if state.dbeng else None
+    fdf = get_file_timestamps(files, manifest)
     if fdf.empty:
         if (table == 'sqPoller') or (not state.poller_periods):
             return
@@ -386,7 +778,8 @@ def coalesce_resource_table(infolder: str, outfolder: str, archive_folder: str,
             state.poller_periods.add(block_start)
         # Archive the saved files
         if readblock:
-            archive_coalesced_files(readblock, archive_folder, state, dodel)
+            archive_coalesced_files(readblock, archive_folder, state, dodel,
+                                    infolder)
 
         # We have to find the timeslot where this record fits
         block_start = block_end
@@ -422,7 +815,8 @@ def coalesce_resource_table(infolder: str, outfolder: str, archive_folder: str,
         wrfile_count += len(readblock)
         if wr_polling_period:
             state.poller_periods.add(block_start)
-        archive_coalesced_files(readblock, archive_folder, state, dodel)
+        archive_coalesced_files(readblock, archive_folder, state, dodel,
+                                infolder)
 
     state.wrfile_count = wrfile_count
     return
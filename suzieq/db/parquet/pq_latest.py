@@ -0,0 +1,256 @@
+import os
+import time
+import fcntl
+import logging
+from uuid import uuid4
+from typing import List
+from collections import defaultdict
+from pathlib import Path
+from contextlib import contextmanager, suppress
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+
+
+LATEST_DIR = '_latest'          # _ prefix keeps pyarrow from reading it
+LATEST_FILE = 'latest.parquet'
+GENERATION_FILE = '.generation'
+DELTA_PREFIX = 'delta-'
+# Deltas of a node beyond which they're folded into its snapshot on a write
+MAX_DELTA_FILES = 64
+
+
+def _conform_table(table: pa.Table, schema: pa.lib.Schema) -> pa.Table:
+    """Return the columns of the table in the schema, in its order"""
+    return pa.Table.from_arrays([table.column(x) for x in schema.names],
+                                schema=schema)
+
+
+def _latest_by_key(table: pa.Table, keys: List[str]) -> pa.Table:
+    """Keep only the last record by timestamp of every key
+
+    Records with the same timestamp are kept in the order of the table, as
+    the sort is stable.
+    """
+    if not table.num_rows:
+        return table
+
+    order = pc.sort_indices(
+        pa.concat_arrays(table.column('timestamp').chunks)).to_pylist()
+    keycols = [table.column(x).to_pylist() for x in keys]
+    seen = set()
+    rows = []
+    for i in reversed(order):
+        key = tuple(tuple(x) if isinstance(x, list) else x
+                    for x in (col[i] for col in keycols))
+        if key not in seen:
+            seen.add(key)
+            rows.append(i)
+
+    rows.reverse()
+    return table.take(pa.array(rows, type=pa.int64()))
+
+
+class SqLatestSnapshot(object):
+    '''Materialized latest state of a table
+
+    For every key of a table, the snapshot holds the most recent record seen,
+    including the records marked inactive. It is stored as one parquet file
+    per namespace/hostname under the _latest directory of the table. The
+    poller writer appends every set of records it writes as a delta file next
+    to the node's file, which the coalescer periodically folds into the file.
+    Readers dedup the file and its deltas by key, keeping the latest record.
+    The coalescer builds the snapshot for tables that don't have one yet,
+    after which its marked complete and used by readers to answer queries for
+    the latest state without scanning the table's history.
+    '''
+
+    def __init__(self, table_folder: str, logger: logging.Logger = None):
+        self.folder = f'{os.path.abspath(table_folder)}/{LATEST_DIR}'
+        self.logger = logger or logging.getLogger(__name__)
+
+    @contextmanager
+    def _locked(self):
+        """Serialize updates to the snapshot across the poller & coalescer"""
+        os.makedirs(self.folder, exist_ok=True)
+        fd = os.open(f'{self.folder}/.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def is_complete(self) -> bool:
+        """True if the snapshot reflects all the data of the table"""
+        return os.path.exists(f'{self.folder}/.complete')
+
+    def set_complete(self) -> None:
+        """Mark the snapshot as usable by the readers"""
+        os.makedirs(self.folder, exist_ok=True)
+        Path(f'{self.folder}/.complete').touch()
+
+    def invalidate(self) -> None:
+        """Mark the snapshot as unusable until rebuilt by the coalescer"""
+        if self.is_complete():
+            os.remove(f'{self.folder}/.complete')
+
+    @property
+    def generation(self) -> int:
+        """Counter incremented every time records are merged"""
+        try:
+            with open(f'{self.folder}/{GENERATION_FILE}') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self) -> None:
+        """Increment the generation, the snapshot must be locked"""
+        tmpfile = f'{self.folder}/{GENERATION_FILE}.tmp'
+        with open(tmpfile, 'w') as f:
+            f.write(str(self.generation + 1))
+        os.replace(tmpfile, f'{self.folder}/{GENERATION_FILE}')
+
+    def _get_host_folder(self, sqvers: str, namespace: str,
+                         hostname: str) -> str:
+        """Return the folder holding the snapshot of a node"""
+        return (f'{self.folder}/sqvers={sqvers}/namespace={namespace}/'
+                f'hostname={hostname}')
+
+    @staticmethod
+    def _get_delta_files(folder: str) -> List[str]:
+        """Return the delta files of a node's snapshot, oldest first"""
+        try:
+            return sorted(f'{folder}/{x}' for x in os.listdir(folder)
+                          if x.startswith(DELTA_PREFIX))
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _write_file(table: pa.Table, filename: str) -> None:
+        """Write the table, renaming it so readers never see partial files"""
+        folder, name = os.path.split(filename)
+        tmpfile = f'{folder}/.{name}.tmp'
+        pq.write_table(table, tmpfile, version="2.0",
+                       compression="ZSTD", row_group_size=100000)
+        os.replace(tmpfile, filename)
+
+    def merge(self, table: pa.Table, key_fields: List[str],
+              schema: pa.lib.Schema) -> None:
+        """Merge the records provided into the snapshot
+
+        The records of every node are appended as a new delta file next to
+        the node's snapshot, without reading the snapshot. The deltas are
+        folded into the snapshot by compact(), which the coalescer runs, or
+        here once a node has accumulated too many of them. The table must
+        contain the sqvers, namespace and hostname columns along with all the
+        columns of the schema.
+
+        :param table: pa.Table, the records to merge
+        :param key_fields: List[str], the key fields of the table
+        :param schema: pa.lib.Schema, the arrow schema of the table
+        """
+        if not table.num_rows:
+            return
+
+        partition_cols = ['sqvers', 'namespace', 'hostname']
+        file_schema = pa.schema([x for x in schema
+                                 if x.name not in partition_cols])
+        # Named by time first for the deltas to sort in the order written
+        fname = f'{DELTA_PREFIX}{time.time_ns()}-{uuid4().hex}.parquet'
+
+        # Only the partition columns are converted to find each node's rows
+        node_rows = defaultdict(list)
+        for i, node in enumerate(zip(*[table.column(x).to_pylist()
+                                       for x in partition_cols])):
+            node_rows[node].append(i)
+
+        folders = []
+        for (vers, nsp, host), rows in node_rows.items():
+            folder = self._get_host_folder(vers, nsp, host)
+            os.makedirs(folder, exist_ok=True)
+            if len(rows) == table.num_rows:
+                node_table = table
+            else:
+                node_table = table.take(pa.array(rows, type=pa.int64()))
+            self._write_file(_conform_table(node_table, file_schema),
+                             f'{folder}/{fname}')
+            folders.append(folder)
+
+        with self._locked():
+            for folder in folders:
+                if len(self._get_delta_files(folder)) > MAX_DELTA_FILES:
+                    self._compact_folder(folder, key_fields, file_schema)
+            self._bump_generation()
+
+    def compact(self, key_fields: List[str], schema: pa.lib.Schema) -> None:
+        """Fold the delta files of every node into its snapshot file
+
+        :param key_fields: List[str], the key fields of the table
+        :param schema: pa.lib.Schema, the arrow schema of the table
+        """
+        partition_cols = ['sqvers', 'namespace', 'hostname']
+        file_schema = pa.schema([x for x in schema
+                                 if x.name not in partition_cols])
+        with self._locked():
+            compacted = 0
+            for folder in Path(self.folder).glob(
+                    'sqvers=*/namespace=*/hostname=*'):
+                compacted += self._compact_folder(str(folder), key_fields,
+                                                  file_schema)
+            if compacted:
+                self._bump_generation()
+
+    def _compact_folder(self, folder: str, key_fields: List[str],
+                        file_schema: pa.lib.Schema) -> int:
+        """Fold a node's delta files into its snapshot, the snapshot must be
+        locked. Returns the number of delta files folded in.
+        """
+        deltas = self._get_delta_files(folder)
+        if not deltas:
+            return 0
+
+        partition_cols = ['sqvers', 'namespace', 'hostname']
+        keys = [x for x in key_fields if x not in partition_cols]
+        filename = f'{folder}/{LATEST_FILE}'
+        tables = []
+        for file in [filename] + deltas:
+            try:
+                tables.append(_conform_table(pq.read_table(file),
+                                             file_schema))
+            except FileNotFoundError:
+                continue
+            except (OSError, pa.lib.ArrowInvalid, KeyError):
+                self.logger.warning(f'Discarding unreadable snapshot {file}')
+
+        if tables:
+            self._write_file(_latest_by_key(pa.concat_tables(tables), keys),
+                             filename)
+        # Readers seeing both the new snapshot & a delta dedup them by key,
+        # so the deltas are only removed after the snapshot is replaced
+        for file in deltas:
+            with suppress(FileNotFoundError):
+                os.remove(file)
+        return len(deltas)
+
+    def get_datasets(self, sqvers: str = '') -> tuple:
+        """Return the datasets to read the snapshot, one per sqvers
+
+        :param sqvers: str, return only the data of this version if specified
+        :returns: list of datasets and the max sqvers found
+        :rtype: tuple
+        """
+        datasets = []
+        max_vers = 0
+        for elem in Path(self.folder).glob('sqvers=*'):
+            if sqvers and f'sqvers={sqvers}' != elem.name:
+                continue
+            vers = float(elem.name.split('=')[-1])
+            if vers > max_vers:
+                max_vers = vers
+            datasets.append(ds.dataset(elem, format='parquet',
+                                       partitioning='hive'))
+
+        return datasets, max_vers
@@ -0,0 +1,339 @@
+import os
+import sqlite3
+import logging
+from typing import Callable, List
+from pathlib import Path
+from contextlib import closing
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+MANIFEST_FILE = '_sqmanifest.db'   # _ prefix keeps pyarrow from reading it
+
+
+def get_partition_vals(path: str) -> dict:
+    """Return the hive partition values encoded in the path of a file
+
+    :param path: str, path of the file, absolute or relative to the table
+    :returns: dictionary of partition column to value
+    :rtype: dict
+    """
+    vals = {}
+    for elem in Path(path).parent.parts:
+        if '=' in elem:
+            key, val = elem.split('=', 1)
+            vals[key] = val
+    return vals
+
+
+def is_coalesced_file(filename: str) -> bool:
+    """True if the file has been written out by the coalescer"""
+    return os.path.basename(filename).startswith('sqc-')
+
+
+def get_coalesced_file_window(filename: str) -> List[int]:
+    """Return the time window covered by a coalesced file in msecs
+
+    Coalesced files are named sqc-<unit>-<block start>-<block end>.parquet
+    with the block times in secs.
+
+    :param filename: str, name of the coalesced file
+    :returns: block start and end times in msecs
+    :rtype: List[int]
+    """
+    thistime = os.path.basename(filename).split('.')[0].split('-')[-2:]
+    return [int(x)*1000 for x in thistime]  # to msec
+
+
+def get_parquet_file_timestamps(filename: str) -> List[int]:
+    """Return the min/max timestamp and row count of a parquet file
+
+    The min/max values are derived from the row group statistics in the
+    footer. We only read the timestamp column if the stats are missing.
+
+    :param filename: str, the full path of the file to examine
+    :returns: min timestamp, max timestamp and number of rows
+    :rtype: List[int]
+    """
+    meta = pq.ParquetFile(filename).metadata
+    if not meta.num_rows:
+        return [0, 0, 0]
+
+    mints = []
+    maxts = []
+    schema = meta.schema.to_arrow_schema()
+    if 'timestamp' in schema.names:
+        colidx = schema.get_field_index('timestamp')
+        for i in range(meta.num_row_groups):
+            stats = meta.row_group(i).column(colidx).statistics
+            if not (stats and stats.has_min_max):
+                break
+            mints.append(stats.min)
+            maxts.append(stats.max)
+        else:
+            return [min(mints), max(maxts), meta.num_rows]
+
+    ts = pd.read_parquet(filename, columns=['timestamp']).timestamp
+    return [int(ts.min()), int(ts.max()), meta.num_rows]
+
+
+def get_manifest_entries(table: pa.Table, partition_cols: List[str],
+                         filename_cb: Callable,
+                         coalesced: bool = False) -> List[dict]:
+    """Compute the manifest entries for a table about to be written
+
+    pyarrow's write_to_dataset writes one file per unique value of the
+    partition columns. This routine computes the same split to produce the
+    manifest entry for each file that'll be written.
+
+    :param table: pa.Table, the data being written
+    :param partition_cols: List[str], the partition columns used for the write
+    :param filename_cb: Callable, the partition_filename_cb used for the write
+    :param coalesced: bool, True if this is a coalesced file
+    :returns: list of manifest entries, one per file written
+    :rtype: List[dict]
+    """
+    entries = []
+    cols = partition_cols + ['timestamp']
+    df = pa.Table.from_arrays([table.column(x) for x in cols], names=cols) \
+        .to_pandas()
+    if df.empty:
+        return entries
+
+    for keys, grp in df.groupby(partition_cols):
+        if not isinstance(keys, tuple):
+            keys = (keys,)
+        subdir = '/'.join([f'{name}={val}'
+                           for name, val in zip(partition_cols, keys)])
+        path = f'{subdir}/{filename_cb(keys)}'
+        if coalesced and is_coalesced_file(path):
+            start_time, end_time = get_coalesced_file_window(path)
+        else:
+            start_time = int(grp.timestamp.min())
+            end_time = int(grp.timestamp.max())
+        entry = dict(zip(partition_cols, [str(x) for x in keys]))
+        entry.update({'path': path, 'start_time': start_time,
+                      'end_time': end_time, 'num_rows': grp.shape[0]})
+        entries.append(entry)
+
+    return entries
+
+
+class SqParquetManifest(object):
+    '''Index of the parquet files of a table directory
+
+    The manifest records for every file of a table directory its partition
+    values, the time window it covers and the number of rows. Readers use it
+    to select the files to read without walking the directory tree. The
+    poller writer and the coalescer keep it up to date as they add and remove
+    files. The manifest is only used for reads once its marked complete, which
+    is done after a full scan of the directory via rebuild.
+    '''
+
+    def __init__(self, folder: str, logger: logging.Logger = None):
+        self.folder = os.path.abspath(folder)
+        self.filename = f'{self.folder}/{MANIFEST_FILE}'
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _connect(self, create: bool = False) -> sqlite3.Connection:
+        if not create and not os.path.exists(self.filename):
+            return None
+        if create and not os.path.isdir(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+
+        conn = sqlite3.connect(self.filename, timeout=30)
+        if create:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, sqvers TEXT, '
+                         'namespace TEXT, hostname TEXT, '
+                         'start_time INTEGER, end_time INTEGER, '
+                         'num_rows INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_by_ns ON files '
+                         '(sqvers, namespace, start_time)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                         'key TEXT PRIMARY KEY, value INTEGER)')
+        return conn
+
+    def _get_meta(self, key: str) -> int:
+        try:
+            conn = self._connect()
+            if not conn:
+                return 0
+            with closing(conn):
+                row = conn.execute('SELECT value FROM meta WHERE key = ?',
+                                   (key,)).fetchone()
+        except sqlite3.Error:
+            return 0
+        return row[0] if row else 0
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: int):
+        conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                     (key, value))
+
+    def _bump_generation(self, conn: sqlite3.Connection):
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+        conn.execute("UPDATE meta SET value = value + 1 "
+                     "WHERE key = 'generation'")
+
+    def is_complete(self) -> bool:
+        """True if the manifest covers all the files in the folder"""
+        return bool(self._get_meta('complete'))
+
+    @property
+    def generation(self) -> int:
+        """Counter incremented every time the set of files changes"""
+        return self._get_meta('generation')
+
+    def add_files(self, entries: List[dict]) -> None:
+        """Add (or update) the entries for newly written files
+
+        :param entries: List[dict], as returned by get_manifest_entries
+        """
+        if not entries:
+            return
+        rows = [(x['path'], x.get('sqvers', ''), x.get('namespace', ''),
+                 x.get('hostname', ''), x['start_time'], x['end_time'],
+                 x['num_rows']) for x in entries]
+        try:
+            with closing(self._connect(create=True)) as conn:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO files VALUES '
+                                     '(?, ?, ?, ?, ?, ?, ?)', rows)
+                    self._bump_generation(conn)
+        except sqlite3.Error:
+            self.logger.exception(f'Unable to update manifest {self.filename}')
+            self.invalidate()
+
+    def remove_files(self, files: List[str]) -> None:
+        """Remove the entries for the files specified
+
+        :param files: List[str], list of file paths as seen by the caller
+        """
+        if not files or not os.path.exists(self.filename):
+            return
+        rows = [(os.path.relpath(os.path.abspath(x), self.folder),)
+                for x in files]
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    conn.executemany('DELETE FROM files WHERE path = ?', rows)
+                    self._bump_generation(conn)
+        except sqlite3.Error:
+            self.logger.exception(f'Unable to update manifest {self.filename}')
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """Mark the manifest as incomplete, forcing readers to walk the dir"""
+        try:
+            conn = self._connect()
+            if not conn:
+                return
+            with closing(conn):
+                with conn:
+                    self._set_meta(conn, 'complete', 0)
+                    self._bump_generation(conn)
+        except sqlite3.Error:
+            # Can't leave a manifest around we can neither update nor trust
+            with_suffixes = [self.filename, f'{self.filename}-wal',
+                             f'{self.filename}-shm']
+            for fname in with_suffixes:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+    def rebuild(self, coalesced: bool) -> int:
+        """Scan the folder and rebuild the manifest from scratch
+
+        Entries for files added by the writer while the scan is in progress
+        are preserved since the scan only inserts or replaces entries.
+
+        :param coalesced: bool, True if the folder holds coalesced files
+        :returns: number of files in the manifest
+        :rtype: int
+        """
+        entries = []
+        for sqvers_dir in Path(self.folder).glob('sqvers=*'):
+            for file in sqvers_dir.glob('**/*.parquet'):
+                relpath = str(file.relative_to(self.folder))
+                if any(x.startswith(('.', '_')) for x in
+                       Path(relpath).parts):
+                    continue
+                try:
+                    if coalesced and is_coalesced_file(relpath):
+                        start_time, end_time = get_coalesced_file_window(
+                            relpath)
+                        num_rows = pq.ParquetFile(str(file)).metadata.num_rows
+                    else:
+                        start_time, end_time, num_rows = \
+                            get_parquet_file_timestamps(str(file))
+                except (OSError, ValueError, pa.lib.ArrowInvalid):
+                    self.logger.debug(f'Not indexing unreadable file {file}')
+                    continue
+                entry = get_partition_vals(relpath)
+                entry.update({'path': relpath, 'start_time': start_time,
+                              'end_time': end_time, 'num_rows': num_rows})
+                entries.append(entry)
+
+        with closing(self._connect(create=True)) as conn:
+            with conn:
+                on_disk = set(x[0] for x in
+                              conn.execute('SELECT path FROM files'))
+                stale = on_disk.difference([x['path'] for x in entries])
+                conn.executemany('DELETE FROM files WHERE path = ?',
+                                 [(x,) for x in stale
+                                  if not os.path.exists(
+                                      f'{self.folder}/{x}')])
+            self.add_files(entries)
+            with conn:
+                self._set_meta(conn, 'complete', 1)
+                self._bump_generation(conn)
+                count = conn.execute('SELECT COUNT(*) FROM files').fetchone()
+
+        return count[0]
+
+    def get_sqvers(self) -> List[str]:
+        """Return the list of sqvers for which there are files"""
+        with closing(self._connect()) as conn:
+            return [x[0] for x in
+                    conn.execute('SELECT DISTINCT sqvers FROM files')]
+
+    def get_files(self, sqvers: str = '', namespace: List[str] = None,
+                  hostname: List[str] = None, start_time: int = 0,
+                  end_time: int = 0) -> pd.DataFrame:
+        """Return the files matching the partition and time constraints
+
+        A file is returned if the time window it covers overlaps the time
+        window requested.
+
+        :param sqvers: str, return only files of this version if specified
+        :param namespace: List[str], list of namespaces to restrict the files
+        :param hostname: List[str], list of hostnames to restrict the files
+        :param start_time: int, start of the time window in msecs, 0 if none
+        :param end_time: int, end of the time window in msecs, 0 if none
+        :returns: dataframe with the manifest entries, the path is absolute
+        :rtype: pd.DataFrame
+        """
+        query = 'SELECT * FROM files WHERE 1'
+        params = []
+        if sqvers:
+            query += ' AND sqvers = ?'
+            params.append(sqvers)
+        for fld, vals in [('namespace', namespace), ('hostname', hostname)]:
+            if vals:
+                query += f' AND {fld} IN ({",".join("?"*len(vals))})'
+                params.extend(vals)
+        if start_time:
+            query += ' AND end_time >= ?'
+            params.append(int(start_time))
+        if end_time:
+            query += ' AND start_time <= ?'
+            params.append(int(end_time))
+
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+
+        if not df.empty:
+            df['path'] = self.folder + '/' + df.path
+        return df
@@ -0,0 +1,183 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from .lpm_index import addrs_to_ints, prefix_masks
+from suzieq.utils import convert_macaddr_format_to_colon
+
+
+def _split_addrs(addrs: List[str]) -> tuple:
+    """Split the addresses into the address ints and the prefix length
+
+    :param addrs: List[str], the addresses with an optional prefix length
+    :returns: the high & low words, IP version and prefix length, -1 if
+              the prefix length isn't specified
+    :rtype: tuple
+    """
+    addrs = pd.Series(addrs, dtype=object).astype(str).str.split('/', n=1)
+    hi, lo, vers = addrs_to_ints(addrs.str[0])
+    plen = pd.to_numeric(addrs.str[1], errors='coerce') \
+        .fillna(-1).astype(int).to_numpy()
+    return hi, lo, vers, plen
+
+
+def _empty_match() -> pd.DataFrame:
+    return pd.DataFrame({'addrIdx': np.array([], dtype=int),
+                         'row': np.array([], dtype=int),
+                         'entry': np.array([], dtype=object)})
+
+
+class AddrIndex(object):
+    '''Index of the IP and MAC addresses of a set of interfaces
+
+    The index is built once from an interfaces or address dataframe and can
+    then be used to find the interfaces with any number of addresses, or
+    with an address within any number of prefixes, in one go. Every IP
+    address of an interface is an entry in the index, held as a 128-bit
+    integer split across two uint64 arrays as in the LpmIndex. A lookup is
+    a hash join of the addresses with the entries, and a prefix lookup is
+    one such join per prefix length of the prefixes looked up.
+    '''
+
+    def __init__(self, df: pd.DataFrame,
+                 addr_cols: List[str] = ['ipAddressList', 'ip6AddressList']):
+        """Build the index from the interfaces provided
+
+        :param df: pd.DataFrame, the interfaces with the IP addresses in the
+                   addr_cols, as lists or one per row, and the MAC address
+                   in the macaddr column
+        :param addr_cols: List[str], the columns with the IP addresses
+        """
+        self.df = df
+        entries = [df[x].reset_index(drop=True).explode()
+                   for x in addr_cols if x in df.columns]
+        if entries:
+            entries = pd.concat(entries).dropna()
+            entries = entries[entries.astype(str) != '']
+        else:
+            entries = pd.Series([], dtype=object)
+
+        hi, lo, vers, plen = _split_addrs(entries.tolist())
+        self._entries = pd.DataFrame({
+            'hi': hi, 'lo': lo, 'vers': vers, 'plen': plen,
+            'row': entries.index.to_numpy(dtype=int),
+            'entry': entries.to_numpy(dtype=object)})[vers != 0]
+
+        if 'macaddr' in df.columns:
+            self._macs = pd.DataFrame({'entry': df.macaddr.to_numpy(),
+                                       'row': np.arange(len(df))}).dropna()
+        else:
+            self._macs = pd.DataFrame({'entry': [], 'row': []})
+
+    def lookup(self, addresses: List[str]) -> pd.DataFrame:
+        """Return the position of the interfaces with the addresses
+
+        An IP address without a prefix length matches the address with any
+        prefix length, else the prefix length must match as well. Anything
+        that isn't an IP address is looked up as a MAC address.
+
+        :param addresses: List[str], the addresses to look up
+        :returns: dataframe with the position of the address in the list
+                  (addrIdx), of the interface in the dataframe (row) and
+                  the address of the interface that matched (entry)
+        :rtype: pd.DataFrame
+        """
+        hi, lo, vers, plen = _split_addrs(addresses)
+        matches = [_empty_match()]
+
+        isip = vers != 0
+        if isip.any() and not self._entries.empty:
+            query = pd.DataFrame({'hi': hi[isip], 'lo': lo[isip],
+                                  'vers': vers[isip], 'qplen': plen[isip],
+                                  'addrIdx': np.flatnonzero(isip)})
+            match = query.merge(self._entries, on=['vers', 'hi', 'lo'])
+            match = match[(match.qplen < 0) | (match.qplen == match.plen)]
+            matches.append(match[['addrIdx', 'row', 'entry']])
+
+        if (~isip).any() and not self._macs.empty:
+            macs = [convert_macaddr_format_to_colon(x)
+                    for x in np.asarray(addresses, dtype=object)[~isip]]
+            query = pd.DataFrame({'entry': macs,
+                                  'addrIdx': np.flatnonzero(~isip)})
+            match = query.merge(self._macs, on='entry')
+            matches.append(match[['addrIdx', 'row', 'entry']])
+
+        return self._sort_matches(matches)
+
+    def lookup_within(self, prefixes: List[str]) -> pd.DataFrame:
+        """Return the position of the interfaces with an address in prefixes
+
+        :param prefixes: List[str], the prefixes, an address without a
+                         prefix length is treated as a host prefix
+        :returns: dataframe with the position of the prefix in the list
+                  (addrIdx), of the interface in the dataframe (row) and
+                  the address of the interface that matched (entry)
+        :rtype: pd.DataFrame
+        """
+        hi, lo, vers, plen = _split_addrs(prefixes)
+        maxlen = np.where(vers == 4, 32, 128)
+        plen = np.where(plen < 0, maxlen, plen)
+        query = pd.DataFrame({'hi': hi, 'lo': lo, 'vers': vers,
+                              'plen': plen,
+                              'addrIdx': np.arange(len(plen))})
+        query = query[(vers != 0) & (plen <= maxlen)]
+        matches = [_empty_match()]
+        if self._entries.empty:
+            return matches[0]
+
+        for (ipvers, prefixlen), grp in query.groupby(['vers', 'plen']):
+            mask_hi, mask_lo = prefix_masks(prefixlen, ipvers)
+            entries = self._entries[self._entries.vers == ipvers]
+            entries = pd.DataFrame({'hi': entries.hi.to_numpy() & mask_hi,
+                                    'lo': entries.lo.to_numpy() & mask_lo,
+                                    'row': entries.row.to_numpy(),
+                                    'entry': entries.entry.to_numpy()})
+            grp = pd.DataFrame({'hi': grp.hi.to_numpy() & mask_hi,
+                                'lo': grp.lo.to_numpy() & mask_lo,
+                                'addrIdx': grp.addrIdx.to_numpy()})
+            match = grp.merge(entries, on=['hi', 'lo'])
+            matches.append(match[['addrIdx', 'row', 'entry']])
+
+        return self._sort_matches(matches)
+
+    def find(self, addresses: List[str],
+             addr_col: str = 'address') -> pd.DataFrame:
+        """Return the interfaces with the addresses
+
+        :param addresses: List[str], the addresses to look up
+        :param addr_col: str, the column to add with the address looked up,
+                         no column is added if empty
+        :returns: the matching interfaces from the dataframe
+        :rtype: pd.DataFrame
+        """
+        return self._get_rows(self.lookup(addresses), addresses, addr_col)
+
+    def find_within(self, prefixes: List[str],
+                    addr_col: str = 'prefix') -> pd.DataFrame:
+        """Return the interfaces with an address within the prefixes
+
+        :param prefixes: List[str], the prefixes to look up
+        :param addr_col: str, the column to add with the prefix looked up,
+                         no column is added if empty
+        :returns: the matching interfaces from the dataframe
+        :rtype: pd.DataFrame
+        """
+        return self._get_rows(self.lookup_within(prefixes), prefixes,
+                              addr_col)
+
+    def _get_rows(self, match: pd.DataFrame, addresses: List[str],
+                  addr_col: str) -> pd.DataFrame:
+        rslt = self.df.iloc[match.row.to_numpy()]
+        if addr_col:
+            rslt = rslt.assign(
+                **{addr_col: np.asarray(addresses,
+                                        dtype=object)[match.addrIdx
+                                                      .to_numpy()]})
+        return rslt
+
+    @staticmethod
+    def _sort_matches(matches: List[pd.DataFrame]) -> pd.DataFrame:
+        return pd.concat(matches) \
+                 .sort_values(by=['addrIdx', 'row'], kind='mergesort') \
+                 .reset_index(drop=True)
@@ -1,8 +1,10 @@
+import numpy as np
 import pandas as pd
 from ipaddress import ip_interface
 
 from .engineobj import SqPandasEngine
-from suzieq.utils import build_query_str, convert_macaddr_format_to_colon
+from .addr_index import AddrIndex
+from suzieq.utils import build_query_str
 
 
 class AddressObj(SqPandasEngine):
@@ -23,9 +25,11 @@ class AddressObj(SqPandasEngine):
         return rslt
 
     def get(self, **kwargs) -> pd.DataFrame:
-        """Retrieve the dataframe that matches a given IPv4/v6/MAC address"""
+        """Retrieve the dataframe that matches a given IPv4/v6/MAC address
+        or has an IPv4/v6 address within a given prefix"""
 
         addr = kwargs.pop("address", [])
+        prefix = kwargs.pop("prefix", [])
         columns = kwargs.get("columns", [])
         ipvers = kwargs.pop("ipvers", "")
         user_query = kwargs.pop('query_str', '')
@@ -37,11 +41,9 @@ class AddressObj(SqPandasEngine):
         addnl_fields = ['master']
         drop_cols = []
 
-        v4addr = []
-        v6addr = []
-        macaddr = []
         try:
-            addr_types = self.addr_type(addr)
+            addr_types = self.addr_type(addr) + \
+                [x for x in self.addr_type(prefix) if x]
         except ValueError:
             return pd.DataFrame({'error': ['Invalid address specified']})
 
@@ -59,21 +61,6 @@ class AddressObj(SqPandasEngine):
                 addnl_fields.append('macaddr')
                 drop_cols.append('macaddr')
 
-        for i, a in enumerate(addr):
-            if addr_types[i] == 0:
-                # convert the macaddr format to internal format
-                if '.' in a:
-                    a = convert_macaddr_format_to_colon(a)
-                macaddr.append(a.lower())
-            elif addr_types[i] == 4:
-                if '/' not in a:
-                    a += '/'
-                v4addr.append(a)
-            elif addr_types[i] == 6:
-                if '/' not in a:
-                    a += '/'
-                v6addr.append(a)
-
         if vrf == "default":
             master = ''
         else:
@@ -87,35 +74,41 @@ class AddressObj(SqPandasEngine):
         if vrf == "default":
             df = df.query('master==""')
 
-        if 4 in addr_types:
-            df = df.explode('ipAddressList').fillna({'ipAddressList': ''})
-        if 6 in addr_types:
-            df = df.explode('ip6AddressList').fillna({'ip6AddressList': ''})
-
         query_str = ''
-        prefix = ''
-        # IMPORTANT: Don't mess with this order of query. Some bug in pandas
-        # prevents it from working if macaddr isn't first and your query
-        # contains both a macaddr and an IP address.
-        if macaddr:
-            query_str += f'{prefix} macaddr.isin({macaddr}) '
-            prefix = 'or'
-        if v4addr:
-            for a in v4addr:
-                query_str += f'{prefix} ipAddressList.str.startswith("{a}") '
-                prefix = 'or'
-        if v6addr:
-            for a in v6addr:
-                query_str += f'{prefix} ip6AddressList.str.startswith("{a}") '
-                prefix = 'or'
-
-        if not query_str:
-            if ipvers == "v4":
-                query_str = 'ipAddressList.str.len() != 0'
-            elif ipvers == "v6":
-                query_str = 'ip6AddressList.str.len() != 0'
-            elif ipvers == "l2":
-                query_str == 'macaddr.str.len() != 0'
+        if addr or prefix:
+            # Look up all the addresses in one go via the index instead of
+            # a scan of the table per address, retaining only the
+            # interfaces with any of the addresses
+            df = df.reset_index(drop=True)
+            index = AddrIndex(df)
+            match = pd.concat([index.lookup(addr),
+                               index.lookup_within(prefix)])
+            df = df.iloc[np.unique(match.row.to_numpy())]
+
+            match_cols = ['macaddr']
+            if 4 in addr_types:
+                df = df.explode('ipAddressList') \
+                       .fillna({'ipAddressList': ''})
+                match_cols.append('ipAddressList')
+            if 6 in addr_types:
+                df = df.explode('ip6AddressList') \
+                       .fillna({'ip6AddressList': ''})
+                match_cols.append('ip6AddressList')
+
+            # Of the addresses of an interface, retain only the ones matched
+            matched = pd.MultiIndex.from_arrays([match.row, match.entry])
+            mask = np.zeros(len(df), dtype=bool)
+            for col in match_cols:
+                if col in df.columns:
+                    mask |= pd.MultiIndex.from_arrays([df.index, df[col]]) \
+                                         .isin(matched)
+            df = df[mask]
+        elif ipvers == "v4":
+            query_str = 'ipAddressList.str.len() != 0'
+        elif ipvers == "v6":
+            query_str = 'ip6AddressList.str.len() != 0'
+        elif ipvers == "l2":
+            query_str == 'macaddr.str.len() != 0'
 
         if query_str:
             df = df.query(query_str)
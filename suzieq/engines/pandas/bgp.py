@@ -3,7 +3,7 @@ from suzieq.sqobjects.address import AddressObj
 import pandas as pd
 import numpy as np
 
-from .engineobj import SqPandasEngine
+from .engineobj import SqPandasEngine, SqAssertChecks
 from suzieq.utils import build_query_str, SchemaForTable, humanize_timestamp
 
 
@@ -209,48 +209,32 @@ class BgpObj(SqPandasEngine):
         # interested only in session info here
         df = df.drop_duplicates(
             subset=['namespace', 'hostname', 'vrf', 'peer'])
-        df['assertReason'] = [[] for _ in range(len(df))]
+        checks = SqAssertChecks(df)
 
-        df['assertReason'] += df.apply(lambda x: ["asn mismatch"]
-                                       if x['state'] != "Established" and
-                                       (x['peerHostname'] and
-                                        ((x["asn"] != x["peerAsn_y"]) or
-                                         (x['asn_y'] != x['peerAsn'])))
-                                       else [], axis=1)
+        not_estd = (df.state != 'Established').to_numpy()
+        if {'asn_y', 'peerAsn_y'}.issubset(df.columns):
+            has_peer = (df.peerHostname.notna() &
+                        (df.peerHostname.astype(str) != '')).to_numpy()
+            checks.add(not_estd & has_peer &
+                       ((df.asn.to_numpy() != df.peerAsn_y.to_numpy()) |
+                        (df.asn_y.to_numpy() != df.peerAsn.to_numpy())),
+                       'asn mismatch')
 
         # Get list of peer IP addresses for peer not in Established state
         # Returning to performing checks even if we didn't get LLDP/Intf info
-        df['assertReason'] += df.apply(
-            lambda x: [f"{x['reason']}:{x['notificnReason']}"]
-            if ((x['state'] != 'Established') and
-                (x['reason'] and x['reason'] != 'None' and
-                 x['reason'] != "No error"))
-            else [],
-            axis=1)
-
-        df['assertReason'] += df.apply(
-            lambda x: ['Matching BGP Peer not found']
-            if x['state'] == 'NotEstd' and not x['assertReason']
-            else [],  axis=1)
-
-        df['assertReason'] += df.apply(
-            lambda x: ['Not all Afi/Safis enabled']
-            if x['afisAdvOnly'].any() or x['afisRcvOnly'].any() else [],
-            axis=1)
-
-        df['assert'] = df.apply(lambda x: 'pass'
-                                if not len(x.assertReason) else 'fail',
-                                axis=1)
-
-        result = df[['namespace', 'hostname', 'vrf', 'peer', 'asn',
-                     'peerAsn', 'state', 'peerHostname', 'assert',
-                     'assertReason', 'timestamp']] \
-            .explode(column="assertReason") \
-            .fillna({'assertReason': '-'})
-
-        if status == "fail":
-            return result.query('assertReason != "-"')
-        elif status == "pass":
-            return result.query('assertReason == "-"')
-
-        return result
+        reason = df.reason.astype(str)
+        checks.add(not_estd & df.reason.notna().to_numpy() &
+                   ~reason.isin(['', 'None', 'No error']).to_numpy(),
+                   reason + ':' + df.notificnReason.astype(str))
+
+        checks.add((df.state == 'NotEstd').to_numpy() & checks.passed,
+                   'Matching BGP Peer not found')
+
+        checks.add(checks.any_in_list(df.afisAdvOnly) |
+                   checks.any_in_list(df.afisRcvOnly),
+                   'Not all Afi/Safis enabled')
+
+        return checks.get_result(['namespace', 'hostname', 'vrf', 'peer',
+                                  'asn', 'peerAsn', 'state', 'peerHostname',
+                                  'assert', 'assertReason', 'timestamp'],
+                                 status)
@@ -8,6 +8,127 @@ import dateparser
 from datetime import datetime
 
 
+class SqAssertChecks(object):
+    '''Vectorized checks of an assert
+
+    Every check is a boolean mask over the rows of the dataframe asserted,
+    True for the rows failing the check, along with the reason reported for
+    those rows. The checks failed by a row are recorded as a bitmap with
+    one bit per check. The reasons are only turned into strings when the
+    assert's result is built, and only for the rows that are output. The
+    reason can be a series of the same length as the dataframe, for reasons
+    that depend on the row's data, or a list of reasons per row.
+    '''
+
+    MAX_CHECKS = 64
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._reasons = []
+        self._failed = np.zeros(len(df), dtype=np.uint64)
+
+    def add(self, mask, reason) -> None:
+        """Add a check, failing the rows in the mask with the reason given
+
+        :param mask: array-like of bool, True for the rows failing the check
+        :param reason: str or pd.Series, the reason for all rows, or per row
+        """
+        if len(self._reasons) >= self.MAX_CHECKS:
+            raise ValueError(f'Cannot have more than {self.MAX_CHECKS} '
+                             'checks in an assert')
+        mask = np.asarray(mask, dtype=bool)
+        self._failed[mask] |= np.uint64(1 << len(self._reasons))
+        if isinstance(reason, pd.Series):
+            reason = reason.to_numpy(dtype=object)
+        self._reasons.append(reason)
+
+    def add_list(self, rows, reasons) -> None:
+        """Add a check that can fail a row with any number of reasons
+
+        :param rows: array-like of int, the position of the failed row for
+                     every reason, a row is repeated for multiple reasons
+        :param reasons: array-like of str, the reasons in the order to report
+        """
+        rows = np.asarray(rows, dtype=int)
+        mask = np.zeros(len(self.df), dtype=bool)
+        mask[rows] = True
+        self.add(mask, (rows, np.asarray(reasons, dtype=object)))
+
+    @property
+    def passed(self) -> np.ndarray:
+        """Mask of the rows that haven't failed any check so far"""
+        return self._failed == 0
+
+    @staticmethod
+    def any_in_list(values: pd.Series) -> np.ndarray:
+        """Return a mask of the rows with a list with any non-empty entry"""
+        exploded = values.reset_index(drop=True).explode().dropna()
+        nonempty = exploded[exploded.astype(str) != '']
+        mask = np.zeros(len(values), dtype=bool)
+        mask[nonempty.index.unique().to_numpy()] = True
+        return mask
+
+    def get_result(self, columns: list, status: str = 'all',
+                   explode: bool = True) -> pd.DataFrame:
+        """Return the result of the assert with the checks applied
+
+        :param columns: list, the columns to return, including the assert
+                        and assertReason columns added
+        :param status: str, one of all, pass or fail, the rows to return
+        :param explode: bool, True to return a row per reason with '-' as
+                        the reason for rows that passed, else a list of the
+                        reasons per row
+        :returns: the assert result
+        :rtype: pd.DataFrame
+        """
+        failed = self._failed != 0
+        rows = [np.array([], dtype=int)]
+        checks = [np.array([], dtype=int)]
+        reasons = [np.array([], dtype=object)]
+        if status != 'fail':
+            rows.append(np.flatnonzero(~failed))
+            checks.append(np.zeros(len(rows[-1]), dtype=int))
+            reasons.append(np.full(len(rows[-1]), '-', dtype=object))
+        if status != 'pass':
+            for i, reason in enumerate(self._reasons):
+                if isinstance(reason, tuple):
+                    idx, reason = reason
+                    rows.append(idx)
+                    reasons.append(reason)
+                    checks.append(np.full(len(idx), i))
+                    continue
+                idx = np.flatnonzero(self._failed & np.uint64(1 << i))
+                rows.append(idx)
+                checks.append(np.full(len(idx), i))
+                if isinstance(reason, str):
+                    reasons.append(np.full(len(idx), reason, dtype=object))
+                else:
+                    reasons.append(reason[idx])
+
+        rows = np.concatenate(rows)
+        reasons = np.concatenate(reasons)
+        # Keep the reasons of a row together and in the order of the checks,
+        # the sort is stable retaining the order of a check's reasons
+        order = np.lexsort((np.concatenate(checks), rows))
+        rows = rows[order]
+        reasons = reasons[order]
+
+        if not explode:
+            reasons = pd.Series(reasons[failed[rows]]) \
+                        .groupby(rows[failed[rows]]).agg(list).to_dict()
+            rows = np.unique(rows)
+            reasons = pd.Series([reasons.get(x, []) for x in rows],
+                                dtype=object).to_numpy()
+
+        datacols = [x for x in columns
+                    if x not in ['assert', 'assertReason']]
+        result = self.df[datacols].iloc[rows]
+        result = result.assign(**{
+            'assert': np.where(failed[rows], 'fail', 'pass'),
+            'assertReason': reasons})
+        return result[columns]
+
+
 class SqPandasEngine(SqEngineObj):
     def __init__(self, baseobj):
         self.ctxt = baseobj.ctxt
@@ -1,8 +1,8 @@
 import numpy as np
 import pandas as pd
-import ipaddress
 
-from .engineobj import SqPandasEngine
+from .engineobj import SqPandasEngine, SqAssertChecks
+from .lpm_index import LpmIndex
 from suzieq.sqobjects.macs import MacsObj
 from suzieq.sqobjects.interfaces import IfObj
 from suzieq.sqobjects.routes import RoutesObj
@@ -174,80 +174,59 @@ class EvpnvniObj(SqPandasEngine):
                 df['assert'] = 'fail'
             return df
 
-        df["assertReason"] = [[] for _ in range(len(df))]
-
-        # Gather the unique set of VTEPs per VNI
-        vteps_df = df.explode(column='remoteVtepList') \
-            .dropna(how='any') \
-            .groupby(by=['vni', 'type'])['remoteVtepList'] \
-            .aggregate(lambda x: x.unique().tolist()) \
-            .reset_index() \
-            .dropna(how='any') \
-            .rename(columns={'remoteVtepList': 'allVteps'})
+        devices = df["hostname"].unique().tolist()
+        ifdf = IfObj(context=self.ctxt) \
+            .get(namespace=kwargs.get("namespace", ""), hostname=devices,
+                 type='vxlan')
 
-        if not vteps_df.empty:
-            her_df = df.merge(vteps_df)
-        else:
-            her_df = pd.DataFrame()
+        df = df.merge(ifdf[['namespace', 'hostname', 'ifname', 'master',
+                            'vlan']],
+                      on=['namespace', 'hostname', 'ifname'], how='left')
+        checks = SqAssertChecks(df)
 
-        if (not her_df.empty and
-                (her_df.remoteVtepList.str.len() != 0).any()):
-            # Check if every VTEP we know is reachable
-            rdf = RoutesObj(context=self.ctxt).get(
-                namespace=kwargs.get('namespace'), vrf='default')
-            if not rdf.empty:
-                rdf['prefixlen'] = rdf['prefix'].str.split('/') \
-                                                    .str[1].astype('int')
-            self._routes_df = rdf
+        # Every remote VTEP of a VNI, with the position of the VNI's row
+        vtep_df = df[['namespace', 'hostname', 'vni', 'type',
+                      'remoteVtepList']] \
+            .assign(pos=np.arange(len(df))) \
+            .explode('remoteVtepList') \
+            .rename(columns={'remoteVtepList': 'vtep'}) \
+            .dropna(subset=['vtep'])
 
-            her_df["assertReason"] += her_df.apply(
-                self._is_vtep_reachable, axis=1)
+        # Check if every VTEP we know is reachable
+        unreach_df = self._get_unreachable_vteps(
+            vtep_df, kwargs.get('namespace', ''))
+        checks.add_list(unreach_df.pos, unreach_df.reason)
 
         mcast_df = df.query('mcastGroup != "0.0.0.0"')
         if not mcast_df.empty:
             # Ensure that all VNIs have at most one multicast group associated
             # per namespace
-
             mismatched_vni_df = mcast_df \
                 .groupby(by=['namespace', 'vni'])['mcastGroup'] \
-                .unique() \
+                .nunique() \
                 .reset_index() \
-                .dropna() \
-                .query('mcastGroup.str.len() != 1')
+                .query('mcastGroup > 1')
 
             if not mismatched_vni_df.empty:
-                df['assertReason'] += df.apply(
-                    lambda x, err_df: ['VNI has multiple mcast group']
-                    if (x['namespace'] in err_df['namespace'] and
-                        x['vni'] in err_df['vni']) else [], axis=1,
-                    args=(mismatched_vni_df, ))
-        elif not her_df.empty:
+                checks.add(
+                    pd.MultiIndex.from_frame(df[['namespace', 'vni']])
+                    .isin(pd.MultiIndex.from_frame(
+                        mismatched_vni_df[['namespace', 'vni']])),
+                    'VNI has multiple mcast group')
+        elif not vtep_df.empty:
             # Every VTEP has info about every other VTEP for a given VNI
-            her_df["assertReason"] += her_df.apply(
-                self._all_vteps_present, axis=1)
+            checks.add(self._get_missing_vteps(df, vtep_df),
+                       'some remote VTEPs missing')
 
         # State is up
-        df["assertReason"] += df.apply(
-            lambda x: ['interface is down']
-            if x['type'] == "L2" and x['state'] != "up"
-            else [], axis=1)
-
-        devices = df["hostname"].unique().tolist()
-        ifdf = IfObj(context=self.ctxt) \
-            .get(namespace=kwargs.get("namespace", ""), hostname=devices,
-                 type='vxlan')
-
-        df = df.merge(ifdf[['namespace', 'hostname', 'ifname', 'master',
-                            'vlan']],
-                      on=['namespace', 'hostname', 'ifname'], how='left')
+        is_l2 = (df.type == "L2").to_numpy()
+        checks.add(is_l2 & (df.state != "up").to_numpy(), 'interface is down')
 
         # vxlan interfaces, if defined, for every VNI is part of bridge
         # We ensure this is true artificially for NXOS, ignored for JunOS.
-        df["assertReason"] += df.apply(
-            lambda x: ['vni not in bridge']
-            if (x['type'] == "L2" and x['ifname'] != '-'
-                and x['master'] != "bridge") else [],
-            axis=1)
+        checks.add(is_l2 & (df.ifname != '-').to_numpy() &
+                   (df.master != "bridge").to_numpy(),
+                   'vni not in bridge')
 
         # mac_df = MacsObj(context=self.ctxt) \
         #     .get(namespace=kwargs.get("namespace", ""),
@@ -257,58 +236,80 @@ class EvpnvniObj(SqPandasEngine):
         # df['assertReason'] += df.apply(self._is_her_good,
         #                                args=(mac_df, ), axis=1)
 
-        # Fill out the assert column
-        df['assert'] = df.apply(lambda x: 'pass'
-                                if not len(x.assertReason) else 'fail',
-                                axis=1)
-
-        if status == 'fail':
-            df = df.query('assertReason.str.len() != 0')
-        elif status == "pass":
-            df = df.query('assertReason.str.len() == 0')
-
-        return df[['namespace', 'hostname', 'vni', 'type',
-                   'assertReason', 'assert', 'timestamp']] \
-            .explode(column='assertReason') \
-            .fillna({'assertReason': '-'})
-
-    def _all_vteps_present(self, row):
-        if row['secVtepIp'] == '0.0.0.0':
-            myvteps = set([row['priVtepIp']])
+        return checks.get_result(['namespace', 'hostname', 'vni', 'type',
+                                  'assertReason', 'assert', 'timestamp'],
+                                 status)
+
+    def _get_missing_vteps(self, df: pd.DataFrame,
+                           vtep_df: pd.DataFrame) -> np.ndarray:
+        """Return the mask of the VNI rows whose VTEP is missing at a peer
+
+        All the remote VTEPs of a VNI in a namespace, minus the ones remote
+        to a VTEP, must include the VTEP itself.
+
+        :param df: pd.DataFrame, the VNIs being asserted
+        :param vtep_df: pd.DataFrame, the remote VTEPs of the VNIs
+        :returns: the mask of the rows failing the check
+        :rtype: np.ndarray
+        """
+        keys = ['namespace', 'vni', 'type']
+        all_df = vtep_df[keys + ['vtep']].drop_duplicates()
+
+        sec = (df.secVtepIp != '0.0.0.0').to_numpy()
+        vni_df = df[keys].assign(pos=np.arange(len(df)))
+        myvteps = pd.concat([vni_df.assign(vtep=df.priVtepIp.to_numpy()),
+                             vni_df[sec].assign(
+                                 vtep=df.secVtepIp.to_numpy()[sec])])
+        known = myvteps.merge(all_df, on=keys + ['vtep']) \
+            .merge(vtep_df[['pos', 'vtep']].drop_duplicates(),
+                   on=['pos', 'vtep'], how='left', indicator=True) \
+            .query('_merge == "left_only"')
+
+        has_vteps = pd.MultiIndex.from_frame(df[keys]).isin(
+            pd.MultiIndex.from_frame(all_df[keys].drop_duplicates()))
+        no_remote = ((df.type == "L3") &
+                     (df.remoteVtepList.str.len() == 1) &
+                     (df.remoteVtepList.str[0] == "-")).to_numpy()
+        return (has_vteps & ~no_remote &
+                ~np.isin(np.arange(len(df)), known.pos.unique()))
+
+    def _get_unreachable_vteps(self, vtep_df: pd.DataFrame,
+                               namespace) -> pd.DataFrame:
+        """Return the remote VTEPs not reachable or reachable via default
+
+        All the VTEPs are looked up in one batch in the default VRF routing
+        table of the device they're a remote VTEP of. This used to be a
+        route lookup per VTEP per VNI, which was the bulk of the assert time.
+
+        :param vtep_df: pd.DataFrame, the remote VTEPs of the VNIs
+        :param namespace: the namespaces asserted
+        :returns: the row position of the VNI & reason of the failed VTEPs
+        :rtype: pd.DataFrame
+        """
+        vtep_df = vtep_df.query('vtep != "-"')
+        if vtep_df.empty:
+            return pd.DataFrame(columns=['pos', 'reason'])
+
+        rdf = RoutesObj(context=self.ctxt).get(
+            namespace=namespace, vrf='default',
+            columns=['namespace', 'hostname', 'vrf', 'prefix'])
+        if not rdf.empty:
+            match_df = LpmIndex(rdf).lpm(vtep_df.vtep.unique(),
+                                         addr_col='vtep')
         else:
-            myvteps = set([row['secVtepIp'], row['priVtepIp']])
-
-        isitme = set(row['allVteps']).difference(set(row['remoteVtepList']))
-        if (isitme.intersection(myvteps) or
-                (row['type'] == "L3" and row['remoteVtepList'] == ["-"])):
-            return []
-
-        return (['some remote VTEPs missing'])
-
-    def _is_vtep_reachable(self, row):
-        reason = []
-        defrt = ipaddress.IPv4Network("0.0.0.0/0")
-        for vtep in row['remoteVtepList'].tolist():
-            if vtep == '-':
-                continue
-
-            # Have to hardcode lpm query here sadly to avoid reading of the
-            # data repeatedly. The time for asserting the state of 500 VNIs
-            # came down from 194s to 4s with the below piece of code instead
-            # of invoking route's lpm to accomplish the task.
-            cached_df = self._routes_df \
-                            .query(f'namespace=="{row.namespace}" and hostname=="{row.hostname}"')
-            route = RoutesObj(context=self.ctxt).lpm(vrf='default',
-                                                     address=vtep,
-                                                     cached_df=cached_df)
-
-            if route.empty:
-                reason += [f"{vtep} not reachable"]
-                continue
-            if route.prefix.tolist() == [defrt]:
-                reason += [f"{vtep} reachable via default"]
-
-        return reason
+            match_df = pd.DataFrame(columns=['namespace', 'hostname', 'vtep',
+                                             'prefix'])
+
+        vtep_df = vtep_df.merge(
+            match_df[['namespace', 'hostname', 'vtep', 'prefix']],
+            on=['namespace', 'hostname', 'vtep'], how='left')
+        vtep_df = vtep_df[vtep_df.prefix.isna() |
+                          (vtep_df.prefix == '0.0.0.0/0')]
+        return pd.DataFrame({
+            'pos': vtep_df.pos.to_numpy(),
+            'reason': np.where(vtep_df.prefix.isna(),
+                               vtep_df.vtep + ' not reachable',
+                               vtep_df.vtep + ' reachable via default')})
 
     def _is_her_good(self, row, mac_df):
         reason = []
@@ -1,10 +1,11 @@
 from ipaddress import ip_network
+import numpy as np
 import pandas as pd
 
 from suzieq.exceptions import NoLLdpError
 from suzieq.sqobjects.lldp import LldpObj
 from suzieq.sqobjects.vlan import VlanObj
-from .engineobj import SqPandasEngine
+from .engineobj import SqPandasEngine, SqAssertChecks
 
 
 class InterfacesObj(SqPandasEngine):
@@ -227,56 +228,77 @@ class InterfacesObj(SqPandasEngine):
 
             return if_df
 
-        combined_df['assertReason'] = combined_df.apply(
-            lambda x: []
-            if (x['adminState'] == 'down' or
-                (x['adminState'] == "up" and x['state'] == "up"))
-            else ['Interface down'], axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: [] if x['mtu'] == x['mtuPeer'] else ['MTU mismatch'],
-            axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: [] if x['vlan'] == x['vlanPeer'] else ['PVID mismatch'],
-            axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: [] if x['speed'] == x['speedPeer']
-            else ['Speed mismatch'],
-            axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: []
-            if ((x['type'] == x['typePeer']) or
-                (x['type'] == 'vlan' and x['typePeer'] == 'subinterface') or
-                (x['type'].startswith('ether') and
-                 x['typePeer'].startswith('ether')))
-            else ['type mismatch'],
-            axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: []
-            if ((len(x['ipAddressList']) == len(x['ipAddressListPeer'])) and
-                ((len(x['ipAddressList']) == 0) or
-                 (x['ipAddressList'][0].split('/')[1] == '32') or
-                 (ip_network(x['ipAddressList'][0], strict=False) ==
-                  ip_network(x['ipAddressListPeer'][0], strict=False))))
-            else ['IP address mismatch'], axis=1)
-
-        combined_df['assertReason'] += combined_df.apply(
-            lambda x: []
-            if set(x['vlanList']) == set(x['vlanListPeer'])
-            else ['VLAN set mismatch'], axis=1)
-
-        combined_df['assert'] = combined_df.apply(
-            lambda x: 'fail' if len(x.assertReason) else 'pass', axis=1)
-
-        if status == "fail":
-            combined_df = combined_df.query('assertReason.str.len() != 0')
-        elif status == "pass":
-            combined_df = combined_df.query('assertReason.str.len() == 0')
-
-        return combined_df[['namespace', 'hostname', 'ifname', 'state',
-                            'peerHostname', 'peerIfname', 'assert',
-                            'assertReason']]
+        checks = SqAssertChecks(combined_df)
+        checks.add(~((combined_df.adminState == 'down') |
+                     ((combined_df.adminState == 'up') &
+                      (combined_df.state == 'up'))).to_numpy(),
+                   'Interface down')
+
+        for fld, reason in [('mtu', 'MTU mismatch'),
+                            ('vlan', 'PVID mismatch'),
+                            ('speed', 'Speed mismatch')]:
+            checks.add(combined_df[fld].to_numpy() !=
+                       combined_df[f'{fld}Peer'].to_numpy(), reason)
+
+        iftype = combined_df.type.astype(str)
+        peer_iftype = combined_df.typePeer.astype(str)
+        checks.add(~((iftype == peer_iftype) |
+                     ((iftype == 'vlan') & (peer_iftype == 'subinterface')) |
+                     (iftype.str.startswith('ether') &
+                      peer_iftype.str.startswith('ether'))).to_numpy(),
+                   'type mismatch')
+
+        checks.add(self._get_ip_mismatch(combined_df), 'IP address mismatch')
+
+        if 'vlanList' in combined_df.columns:
+            checks.add(self._get_vlan_set_mismatch(combined_df),
+                       'VLAN set mismatch')
+
+        return checks.get_result(['namespace', 'hostname', 'ifname', 'state',
+                                  'peerHostname', 'peerIfname', 'assert',
+                                  'assertReason'], status, explode=False)
+
+    def _get_ip_mismatch(self, df: pd.DataFrame) -> np.ndarray:
+        """Mask of the interfaces whose IP subnet doesn't match the peer's
+
+        Only the first address of the interfaces is compared, and /32
+        addresses, used in unnumbered links, always match.
+        """
+        iplen = df.ipAddressList.str.len().to_numpy()
+        peer_iplen = df.ipAddressListPeer.str.len().to_numpy()
+        addr = df.ipAddressList.str[0].fillna('').astype(str)
+        peer_addr = df.ipAddressListPeer.str[0].fillna('').astype(str)
+
+        # There are far fewer addresses than interfaces
+        subnets = {}
+        for ipaddr in pd.unique(np.concatenate([addr.to_numpy(),
+                                                peer_addr.to_numpy()])):
+            try:
+                subnets[ipaddr] = str(ip_network(ipaddr, strict=False))
+            except ValueError:
+                subnets[ipaddr] = ipaddr
+
+        return ~((iplen == peer_iplen) &
+                 ((iplen == 0) |
+                  (addr.str.split('/').str[1] == '32').to_numpy() |
+                  (addr.map(subnets).to_numpy() ==
+                   peer_addr.map(subnets).to_numpy())))
+
+    def _get_vlan_set_mismatch(self, df: pd.DataFrame) -> np.ndarray:
+        """Mask of the interfaces whose set of VLANs differs from the peer's"""
+        rows = np.arange(len(df))
+        vlans = pd.DataFrame({'row': rows, 'vlan': df.vlanList.to_numpy()}) \
+                  .explode('vlan') \
+                  .dropna() \
+                  .drop_duplicates()
+        peer_vlans = pd.DataFrame({'row': rows,
+                                   'vlan': df.vlanListPeer.to_numpy()}) \
+                       .explode('vlan') \
+                       .dropna() \
+                       .drop_duplicates()
+        diff = vlans.merge(peer_vlans, how='outer', indicator=True) \
+                    .query('_merge != "both"')
+
+        mask = np.zeros(len(df), dtype=bool)
+        mask[diff.row.unique().astype(int)] = True
+        return mask
@@ -0,0 +1,166 @@
+from typing import List
+from ipaddress import ip_address
+
+import numpy as np
+import pandas as pd
+
+MASK64 = (1 << 64) - 1
+
+
+def addrs_to_ints(addrs: pd.Series) -> tuple:
+    """Convert IP addresses into integers split into two uint64 arrays
+
+    The conversion is done once per unique address as routes and addresses
+    repeat across devices. IPv4 addresses fit entirely in the low word.
+
+    :param addrs: pd.Series, the IP addresses as strings, without prefixlen
+    :returns: arrays of the high & low words, IP version, 0 if invalid
+    :rtype: tuple
+    """
+    codes, uniques = pd.factorize(addrs)
+    if not len(uniques):
+        return (np.zeros(len(codes), dtype=np.uint64),
+                np.zeros(len(codes), dtype=np.uint64),
+                np.zeros(len(codes), dtype=np.int8))
+
+    hi = np.zeros(len(uniques), dtype=np.uint64)
+    lo = np.zeros(len(uniques), dtype=np.uint64)
+    vers = np.zeros(len(uniques), dtype=np.int8)
+    for i, addr in enumerate(uniques):
+        try:
+            ipaddr = ip_address(addr)
+        except ValueError:
+            continue
+        intaddr = int(ipaddr)
+        hi[i] = intaddr >> 64
+        lo[i] = intaddr & MASK64
+        vers[i] = ipaddr.version
+
+    # Missing values have a code of -1, which'd pick the last unique entry
+    invalid = codes < 0
+    codes[invalid] = 0
+    vers = vers[codes]
+    vers[invalid] = 0
+    return hi[codes], lo[codes], vers
+
+
+def prefix_masks(prefixlen: int, ipvers: int) -> tuple:
+    """Return the netmask of the prefix length as the high & low words"""
+    width = 32 if ipvers == 4 else 128
+    mask = ((1 << width) - 1) ^ ((1 << (width - int(prefixlen))) - 1)
+    return np.uint64(mask >> 64), np.uint64(mask & MASK64)
+
+
+class LpmIndex(object):
+    '''Longest prefix match index over a set of routing tables
+
+    The index is built once from a routes dataframe and can then be used to
+    look up the longest prefix match for any number of addresses, of either
+    address family, in every routing table, identified by the namespace,
+    hostname and vrf, contained in the dataframe. Addresses are handled as
+    128-bit integers split across two uint64 arrays. The routes are grouped
+    by prefix length, and the lookup for every prefix length is a single
+    hash join of the masked addresses with the routes of that length.
+    '''
+
+    def __init__(self, df: pd.DataFrame,
+                 table_cols: List[str] = ['namespace', 'hostname', 'vrf']):
+        """Build the index from the routes provided
+
+        :param df: pd.DataFrame, the routes with at least the prefix column
+        :param table_cols: List[str], the columns identifying a route table
+        """
+        self.df = df
+        self.table_cols = [x for x in table_cols if x in df.columns]
+        # Routes of each address family grouped by prefix length, longest
+        # first. Each entry is the prefix length, its masks and the routes.
+        self._plen_routes = {4: [], 6: []}
+
+        if df.empty:
+            return
+
+        pfx = df.prefix.str.split('/', n=1)
+        valid = (pfx.str.len() == 2).to_numpy()
+        hi, lo, vers = addrs_to_ints(pfx.str[0])
+        plen = pd.to_numeric(pfx.str[1], errors='coerce') \
+            .fillna(-1).astype(int).to_numpy()
+        valid &= (vers != 0) & (plen >= 0) & \
+            (plen <= np.where(vers == 4, 32, 128))
+
+        if self.table_cols:
+            tables = df.groupby(self.table_cols, sort=False).ngroup() \
+                       .to_numpy()
+        else:
+            tables = np.zeros(len(df), dtype=int)
+
+        routes = pd.DataFrame({'hi': hi, 'lo': lo, 'vers': vers,
+                               'plen': plen, 'table': tables,
+                               'row': np.arange(len(df))})[valid]
+
+        for (ipvers, prefixlen), grp in routes.groupby(['vers', 'plen']):
+            mask_hi, mask_lo = prefix_masks(prefixlen, ipvers)
+            grp = pd.DataFrame({'hi': grp.hi.to_numpy() & mask_hi,
+                                'lo': grp.lo.to_numpy() & mask_lo,
+                                'table': grp.table.to_numpy(),
+                                'row': grp.row.to_numpy()})
+            self._plen_routes[ipvers].append(
+                (prefixlen, mask_hi, mask_lo, grp))
+
+        for ipvers in self._plen_routes:
+            self._plen_routes[ipvers].sort(key=lambda x: x[0], reverse=True)
+
+    def lookup(self, addresses: List[str]) -> pd.DataFrame:
+        """Return the position of the longest matching route per table
+
+        :param addresses: List[str], the addresses to look up
+        :returns: dataframe with the position of the address in the list
+                  (addrIdx) and of the route in the routes dataframe (row),
+                  one per address & route table with a matching route.
+        :rtype: pd.DataFrame
+        """
+        hi, lo, vers = addrs_to_ints(pd.Series(addresses, dtype=object))
+        matches = []
+        for ipvers, plen_routes in self._plen_routes.items():
+            qidx = np.flatnonzero(vers == ipvers)
+            if not qidx.size:
+                continue
+            qhi = hi[qidx]
+            qlo = lo[qidx]
+            for prefixlen, mask_hi, mask_lo, routes in plen_routes:
+                query = pd.DataFrame({'hi': qhi & mask_hi,
+                                      'lo': qlo & mask_lo,
+                                      'addrIdx': qidx})
+                match = query.merge(routes, on=['hi', 'lo'])
+                if not match.empty:
+                    match['plen'] = prefixlen
+                    matches.append(match[['addrIdx', 'table', 'row',
+                                          'plen']])
+
+        if not matches:
+            return pd.DataFrame({'addrIdx': [], 'row': []}, dtype=int)
+
+        # Matches were gathered longest prefix first
+        return pd.concat(matches) \
+                 .drop_duplicates(subset=['addrIdx', 'table'], keep='first') \
+                 .sort_values(by=['addrIdx', 'plen'], ascending=[True, False],
+                              kind='mergesort')[['addrIdx', 'row']] \
+                 .reset_index(drop=True)
+
+    def lpm(self, addresses: List[str],
+            addr_col: str = 'address') -> pd.DataFrame:
+        """Return the longest matching route per table for every address
+
+        :param addresses: List[str], the addresses to look up
+        :param addr_col: str, the column to add with the address looked up,
+                         no column is added if empty
+        :returns: the matching routes from the routes dataframe
+        :rtype: pd.DataFrame
+        """
+        match = self.lookup(addresses)
+        rslt = self.df.iloc[match.row.to_numpy()]
+        if addr_col:
+            rslt = rslt.assign(
+                **{addr_col: np.asarray(addresses,
+                                        dtype=object)[match.addrIdx
+                                                      .to_numpy()]})
+        return rslt
@@ -1,20 +1,42 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from ipaddress import ip_network, ip_address
 from collections import OrderedDict
 from itertools import repeat
 from functools import lru_cache
-from collections import defaultdict
 from copy import copy
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 
-from suzieq.sqobjects import interfaces, routes, arpnd, macs, mlag
 from suzieq.exceptions import EmptyDataframeError, PathLoopError
 from .engineobj import SqPandasEngine
-from suzieq.utils import expand_nxos_ifname, MAX_MTU
+from .path_graph import get_path_graph
+from suzieq.utils import MAX_MTU
 
 # TODO: What timestamp to use (arpND, mac, interface, route..)
 
+# Pairs traced by a pool process at a time
+PATH_PAIRS_PER_CHUNK = 256
+
+# The engine object and graph the pool processes trace the pairs with
+_pool_trace = None
+
+
+def _init_trace_process(pathobj: 'PathObj', graph) -> None:
+    """Save the engine object and graph inherited by the pool process"""
+    global _pool_trace
+    _pool_trace = (pathobj, graph)
+
+
+def _trace_pairs_in_pool(pairs: List[Tuple[str, str]],
+                         vrf: str) -> pd.DataFrame:
+    """Trace the paths between the pairs in a trace pool process"""
+    pathobj, graph = _pool_trace
+    return pathobj._trace_pairs(pairs, vrf, graph)
+
 
 class PathObj(SqPandasEngine):
 
@@ -22,52 +44,32 @@ class PathObj(SqPandasEngine):
     def table_name():
         return 'path'
 
-    def _init_dfs(self, namespace, source, dest):
+    def _init_dfs(self, namespace, source, dest, graph=None):
         """Initialize the dataframes used in this path hunt"""
 
         self.source = source
         self.dest = dest
-        self._underlay_dfs = {}  # lpm entries for each vtep IP
-
-        try:
-            self._if_df = interfaces.IfObj(context=self.ctxt) \
-                                    .get(namespace=namespace, state='up',
-                                         addnl_fields=['macaddr']) \
-                                    .explode('ipAddressList') \
-                                    .fillna({'ipAddressList': ''}) \
-                                    .explode('ip6AddressList') \
-                                    .fillna({'ip6AddressList': ''}) \
-                                    .reset_index(drop=True)
-            if self._if_df.empty:
-                raise EmptyDataframeError
-        except (EmptyDataframeError, KeyError):
+        # The nexthops cached depend on the source
+        PathObj._get_nh_with_peer.cache_clear()
+
+        # The tables of the namespace are shared by all the traces
+        self._graph = graph or get_path_graph(self.ctxt, self._dbeng,
+                                              namespace)
+        self._if_df = self._graph.if_df
+        if self._if_df.empty:
             raise EmptyDataframeError(
                 f"No interface information found for {namespace}")
 
         # Need this in determining L2 peer
-        mlag_df = mlag.MlagObj(context=self.ctxt).get(namespace=namespace)
-        mlag_peers = defaultdict(str)
-        mlag_peerlink = defaultdict(str)
-        if not mlag_df.empty:
-            peerlist = [x.tolist()
-                        for x in mlag_df.groupby(by=['systemId'])['hostname']
-                        .unique().tolist()]
-            for peers in peerlist:
-                if len(peers) > 1:
-                    mlag_peers[peers[0]] = peers[1]
-                    mlag_peers[peers[1]] = peers[0]
-            for row in mlag_df.itertuples():
-                mlag_peerlink[row.hostname] = expand_nxos_ifname(row.peerLink)
-        self._mlag_peers = mlag_peers
-        self._mlag_peerlink = mlag_peerlink
+        self._mlag_peers = self._graph.mlag_peers
+        self._mlag_peerlink = self._graph.mlag_peerlink
 
         try:
             # access-internal is an internal Junos route we want to
             # ignore
-            self._rdf = routes.RoutesObj(context=self.ctxt) \
-                              .lpm(namespace=namespace, address=dest) \
-                              .query('protocol != "access-internal"') \
-                              .reset_index(drop=True)
+            self._rdf = self._graph.lpm(dest) \
+                                   .query('protocol != "access-internal"') \
+                                   .reset_index(drop=True)
             if self._rdf.empty:
                 raise EmptyDataframeError
         except (KeyError, EmptyDataframeError):
@@ -75,10 +77,9 @@ class PathObj(SqPandasEngine):
                                       format(dest))
 
         try:
-            self._rpf_df = routes.RoutesObj(context=self.ctxt) \
-                                 .lpm(namespace=namespace, address=source) \
-                                 .query('protocol != "access-internal"') \
-                                 .reset_index(drop=True)
+            self._rpf_df = self._graph.lpm(source) \
+                                      .query('protocol != "access-internal"') \
+                                      .reset_index(drop=True)
             if self._rpf_df.empty:
                 raise EmptyDataframeError
         except (KeyError, EmptyDataframeError):
@@ -86,31 +87,13 @@ class PathObj(SqPandasEngine):
                                       format(source))
 
         # We ignore the lack of ARPND for now
-        self._arpnd_df = arpnd.ArpndObj(
-            context=self.ctxt).get(namespace=namespace)
+        self._arpnd_df = self._graph.arpnd_df
         if self._arpnd_df.empty:
             raise EmptyDataframeError(
                 f"No ARPND information found for {dest}")
 
-        # Enhance the ARPND table with the VRF field
-        self._arpnd_df = self._arpnd_df.merge(
-            self._if_df[['namespace', 'hostname', 'ifname', 'master']],
-            left_on=['namespace', 'hostname', 'oif'],
-            right_on=['namespace', 'hostname', 'ifname'], how='left') \
-            .drop(columns=['ifname']) \
-            .rename(columns={'master': 'vrf'}) \
-            .replace({'vrf': {'': 'default'}}) \
-            .query('state != "failed"') \
-            .reset_index(drop=True)
-
-        self._macsobj = macs.MacsObj(context=self.ctxt, namespace=namespace)
-
-        if ':' in source:
-            self._src_df = self._if_df[self._if_df.ip6AddressList.astype(str)
-                                       .str.contains(source + "/")]
-        else:
-            self._src_df = self._if_df[self._if_df.ipAddressList.astype(str)
-                                       .str.contains(source + "/")]
+        self._addr_index = self._graph.addr_index
+        self._src_df = self._get_addr_if_df(source)
 
         if self._src_df.empty:
             # TODO: No host with this src addr. Is addr a local ARP entry?
@@ -125,12 +108,7 @@ class PathObj(SqPandasEngine):
             if 'loopback' in self._src_df.type.unique().tolist():
                 self._src_df = self._src_df.query('type == "loopback"')
 
-        if ':' in dest:
-            self._dest_df = self._if_df[self._if_df.ip6AddressList.astype(str)
-                                        .str.contains(dest + "/")]
-        else:
-            self._dest_df = self._if_df[self._if_df.ipAddressList.astype(str)
-                                        .str.contains(dest + "/")]
+        self._dest_df = self._get_addr_if_df(dest)
 
         srcnet = self._src_df.ipAddressList.tolist()[0]
         if ip_address(dest) in ip_network(srcnet, strict=False):
@@ -155,9 +133,53 @@ class PathObj(SqPandasEngine):
         self.src_device = self._src_df["hostname"].unique()
 
         # Start with the source host and find its route to the destination
-        if self._rdf.query(f"hostname.isin({self.src_device.tolist()})").empty:
+        if not self._rdf.hostname.isin(self.src_device).any():
             raise EmptyDataframeError(f"No routes found for {self.src_device}")
 
+    def _get_addr_if_df(self, addr: str) -> pd.DataFrame:
+        """Return the interfaces with the given IP address"""
+        match = self._addr_index.lookup([addr])
+        return self._if_df.iloc[match.row.to_numpy()]
+
+    def _get_addr_ifs(self, hostname: str, addr: str,
+                      ipvers: int = 4) -> pd.DataFrame:
+        """Return the interfaces of the device with an address starting so"""
+        ifs = self._get_ifs(hostname)
+        if ipvers == 6:
+            return ifs[ifs.ip6AddressList.str.startswith(addr)]
+        return ifs[ifs.ipAddressList.str.startswith(addr)]
+
+    def _get_ipv4_ifs(self, addr: str) -> pd.DataFrame:
+        """Return the interfaces with the IPv4 address, via the index"""
+        ifs = self._get_addr_if_df(addr)
+        return ifs[ifs.ipAddressList.str.startswith(f'{addr}/')]
+
+    def _get_ifs(self, hostname: str, ifname: str = None) -> pd.DataFrame:
+        """Return the interfaces of the device, or the given interface"""
+        if ifname is None:
+            return self._graph.get_rows('interfaces', ['hostname'], hostname)
+        return self._graph.get_rows('interfaces', ['hostname', 'ifname'],
+                                    (hostname, ifname))
+
+    def _get_arpnd(self, hostname: str, addr: str) -> pd.DataFrame:
+        """Return the ARP/ND entries of the address on the device"""
+        return self._graph.get_rows('arpnd', ['hostname', 'ipAddress'],
+                                    (hostname, addr))
+
+    def _get_route(self, device: str, vrf: str,
+                   rpf: bool = False) -> pd.DataFrame:
+        """Return the route to the dest, or the source if rpf, on the device
+
+        :param device: str, the device whose route table to look up
+        :param vrf: str, the VRF of the route table
+        :param rpf: bool, True to return the route to the source
+        :returns: the longest matching route, empty if there's none
+        :rtype: pd.DataFrame
+        """
+        rslt = self._graph.lpm_route(self.source if rpf else self.dest,
+                                     device, vrf)
+        return rslt[rslt.protocol != "access-internal"]
+
     def _get_vrf(self, hostname: str, ifname: str, addr: str) -> str:
         """Determine the VRF given either the ifname or ipaddr"""
         vrf = ''
@@ -166,38 +188,23 @@ class PathObj(SqPandasEngine):
         else:
             ipvers = 4
         if ifname:
-            iifdf = self._if_df[(self._if_df["hostname"] == hostname) &
-                                (self._if_df["ifname"] == ifname)]
+            iifdf = self._get_ifs(hostname, ifname)
         else:
             # TODO: Add support for IPv6 here
             addr = addr + '/'
-            if ipvers == 6:
-                iifdf = self._if_df.query(
-                    f'hostname=="{hostname}" and '
-                    f'ip6AddressList.str.startswith("{addr}")')
-            else:
-                iifdf = self._if_df.query(
-                    f'hostname=="{hostname}" and '
-                    f'ipAddressList.str.startswith("{addr}")')
+            iifdf = self._get_addr_ifs(hostname, addr, ipvers)
         if not iifdf.empty and iifdf.iloc[0].master == "bridge":
             # OK, find the SVI associated with this interface
-            if addr and ipvers == 6:
-                iifdf = self._if_df.query(
-                    f'hostname=="{hostname}" and '
-                    f'ip6AddressList.str.startswith("{addr}")')
-            elif addr and ipvers == 4:
-                iifdf = self._if_df.query(
-                    f'hostname=="{hostname}" and '
-                    f'ipAddressList.str.startswith("{addr}")')
+            if addr:
+                iifdf = self._get_addr_ifs(hostname, addr, ipvers)
             else:
                 # No address, but a bridge interface as the master
                 if iifdf.iloc[0]['vlan']:
                     # Check if there's an SVI, assuming format is vlan*
                     # TODO: Handle trunk
                     vlan = iifdf.iloc[0]['vlan']
-                    vdf = self._if_df.query(f'hostname=="{hostname}" and '
-                                            f'(ifname=="vlan{vlan}" or '
-                                            f'ifname=="Vlan{vlan}")')
+                    vdf = self._get_ifs(hostname)
+                    vdf = vdf[vdf.ifname.isin([f'vlan{vlan}', f'Vlan{vlan}'])]
                     if not vdf.empty:
                         vrf = vdf.iloc[0].master.strip()
 
@@ -224,8 +231,8 @@ class PathObj(SqPandasEngine):
         if not ip or self._arpnd_df.empty:
             return fhr_df
 
-        rslt_df = self._arpnd_df.query(
-            f'ipAddress=="{ip}" and not remote')
+        rslt_df = self._graph.get_rows('arpnd', ['ipAddress'], ip) \
+                             .query('not remote')
 
         if rslt_df.empty:
             return fhr_df
@@ -235,8 +242,7 @@ class PathObj(SqPandasEngine):
         if len(uniq_mac) != 1:
             return fhr_df
 
-        macdf = self._macsobj.get(namespace=rslt_df.iloc[0].namespace,
-                                  macaddr=uniq_mac[0], localOnly=True)
+        macdf = self._graph.get_macs(uniq_mac[0], local_only=True)
         if not macdf.empty:
             ign_ifs = ["bridge", "Vxlan1"]
             if device:
@@ -250,9 +256,8 @@ class PathObj(SqPandasEngine):
             mac_entry = macdf.query(f'hostname == "{row.hostname}"')
             if not mac_entry.empty:
                 # for row in macdf.iterrows():
-                idf = self._if_df.query(
-                    f'hostname=="{row.hostname}" and '
-                    f'ifname=="{mac_entry.oif.iloc[0]}"').copy()
+                idf = self._get_ifs(row.hostname,
+                                    mac_entry.oif.iloc[0]).copy()
 
                 # We need to replace the VLAN in the if_df with what
                 # is obtained from the MAC because of trunk ports.
@@ -264,9 +269,8 @@ class PathObj(SqPandasEngine):
                     # Assuming the VRF is identical across multiple entries
                     idf.at[idf.index, 'master'] = rslt_df.iloc[0].vrf
             else:
-                idf = self._if_df.query(f'hostname=="{row.hostname}" and '
-                                        f'ifname=="{row.oif}" and '
-                                        f'type=="vlan"').copy()
+                idf = self._get_ifs(row.hostname, row.oif)
+                idf = idf[idf.type == "vlan"].copy()
                 if idf.empty:
                     continue
             if fhr_df.empty:
@@ -276,8 +280,7 @@ class PathObj(SqPandasEngine):
         return fhr_df
 
     def _get_if_vlan(self, device: str, ifname: str) -> int:
-        oif_df = self._if_df[(self._if_df["hostname"] == device) &
-                             (self._if_df["ifname"] == ifname)]
+        oif_df = self._get_ifs(device, ifname)
 
         if oif_df.empty:
             return []
@@ -295,13 +298,11 @@ class PathObj(SqPandasEngine):
         if self._arpnd_df.empty:
             return []
 
-        rslt = self._arpnd_df[(self._arpnd_df['hostname'] == device) &
-                              (self._arpnd_df['ipAddress'] == dest)]
+        rslt = self._get_arpnd(device, dest)
         # the end of knowledge
         if rslt.empty:
             # Check if we have an EVPN entry as a route (symmetric routing)
-            rslt = self._rdf.query(
-                f'hostname == "{device}" and vrf == "{vrf}"')
+            rslt = self._get_route(device, vrf)
             if not rslt.empty:
                 # Check that we have a host route at this point
                 ipvers = 6 if ':' in dest else 4
@@ -327,9 +328,8 @@ class PathObj(SqPandasEngine):
         vlan = self._get_if_vlan(device, oif)
 
         if macaddr:
-            mac_df = self._macsobj.get(namespace=rslt.iloc[0]['namespace'],
-                                       hostname=device, macaddr=macaddr,
-                                       vlan=[str(vlan)])
+            mac_df = self._graph.get_macs(macaddr, hostname=device,
+                                          vlan=vlan)
 
             if mac_df.empty:
                 # On servers there's no bridge and thus no MAC table entry
@@ -360,16 +360,10 @@ class PathObj(SqPandasEngine):
 
         vrf = vrf_list[0].split(':')[-1]
         for vtep in vtep_list:
-            if vtep not in self._underlay_dfs:
-                if not vtep:
-                    raise AttributeError(
-                        f'false vtep {vtep_list}: vrf {vrf_list}')
-                self._underlay_dfs[vtep] = routes.RoutesObj(
-                    context=self.ctxt).lpm(namespace=self.namespace,
-                                           address=vtep, vrf=vrf)
-            vtep_df = self._underlay_dfs[vtep]
-            rslt = vtep_df.query(
-                f'hostname == "{hostname}" and vrf == "{vrf}"')
+            if not vtep:
+                raise AttributeError(
+                    f'false vtep {vtep_list}: vrf {vrf_list}')
+            rslt = self._graph.lpm_route(vtep, hostname, vrf)
             if not rslt.empty:
                 if is_overlay:
                     intres = zip(rslt.nexthopIps.iloc[0].tolist(),
@@ -407,7 +401,7 @@ class PathObj(SqPandasEngine):
             else:
                 return self._get_l2_nexthop(device, vrf, dest, macaddr, 'l2')
 
-        rslt = self._rdf.query(f'hostname == "{device}" and vrf == "{vrf}"')
+        rslt = self._get_route(device, vrf)
         # The following condition is checking that we have a pure L3 nexthop or
         # the start of an underlay route. if its a pure L3 route, the nexthopIp
         # is not empty OR the protocol is not hmm--NXOS' host mobility
@@ -500,13 +494,11 @@ class PathObj(SqPandasEngine):
                 # Replace Cumulus' VRR entry with actual SVI
                 iface = iface.split('-v0')[0]
             # This first pass is to handle Cumulus symmetric EVPN routes
-            arpdf = self._arpnd_df.query(f'hostname=="{device}" and '
-                                         f'ipAddress=="{addr}" and '
-                                         f'oif=="{iface}"')
+            arpdf = self._get_arpnd(device, addr)
+            arpdf = arpdf[arpdf.oif == iface]
             if not arpdf.empty and arpdf.remote.all():
-                macdf = self._macsobj.get(namespace=self.namespace,
-                                          hostname=device,
-                                          macaddr=arpdf.iloc[0].macaddr)
+                macdf = self._graph.get_macs(arpdf.iloc[0].macaddr,
+                                             hostname=device)
                 if not macdf.empty and macdf.remoteVtepIp.all():
                     overlay = macdf.iloc[0].remoteVtepIp
 
@@ -526,44 +518,37 @@ class PathObj(SqPandasEngine):
             errormsg = ''
             if is_l2 and macaddr and not overlay:
                 if (not nhip or nhip == 'None') and iface:
-                    addr = dest + '/'
+                    addr = dest
                 else:
-                    addr = nhip + '/'
-                df = self._if_df.query(
-                    f'macaddr=="{macaddr}" '
-                    f'and type != "bond_slave" '
-                    f'and state != "down" '
-                    f'and ipAddressList.str.startswith("{addr}")')
+                    addr = nhip
+                addr_df = self._get_ipv4_ifs(addr)
+                addr_df = addr_df[addr_df.type != "bond_slave"]
+                df = addr_df[(addr_df.macaddr == macaddr) &
+                             (addr_df.state != "down")]
                 if df.empty:
-                    df = self._if_df.query(
-                        f'ipAddressList.str.startswith("{addr}") and '
-                        f'type !="bond_slave"')
+                    df = addr_df
                     if df.empty:
                         continue
             else:
                 if not nhip:
                     nhip = dest
-                arpdf = self._arpnd_df.query(f'hostname=="{device}" and '
-                                             f'ipAddress=="{nhip}" and '
-                                             f'oif=="{iface}"')
+                arpdf = self._get_arpnd(device, nhip)
+                arpdf = arpdf[arpdf.oif == iface]
+                nhip_df = self._get_ipv4_ifs(nhip)
+                nhip_df = nhip_df[nhip_df.type != "bond_slave"]
                 if not arpdf.empty:
-                    addr = nhip + '/'
-                    df = self._if_df.query(
-                        f'macaddr=="{arpdf.iloc[0].macaddr}" '
-                        f'and type != "bond_slave" '
-                        f'and state != "down" '
-                        f'and ipAddressList.str.startswith("{addr}")')
+                    nhmac = arpdf.iloc[0].macaddr
+                    df = nhip_df[(nhip_df.macaddr == nhmac) &
+                                 (nhip_df.state != "down")]
                     if df.empty:
                         # In case of L2 interfaces as the nexthop, there'll be
                         # no IP address on the interface with matching NHIP.
-                        df = self._if_df.query(
-                            f'macaddr=="{arpdf.iloc[0].macaddr}" '
-                            f'and type != "bond_slave"')
+                        df = self._graph.get_rows('interfaces', ['macaddr'],
+                                                  nhmac)
+                        df = df[df.type != "bond_slave"]
                 elif protocol == 'direct':
                     continue
-                nhip_df = self._if_df.query(
-                    f'ipAddressList.str.startswith("{nhip}/") and '
-                    f'type != "bond_slave" and hostname != "{device}"')
+                nhip_df = nhip_df[nhip_df.hostname != device]
                 if df.empty and not nhip_df.empty:
                     df = nhip_df
                 elif on_src_node and not df.empty and not nhip_df.empty:
@@ -621,15 +606,14 @@ class PathObj(SqPandasEngine):
             # matching the IP/MAC of this device's OIF with the ARP/ND table
             # on the nexthop device
             if (df.hostname.nunique() == 1) and (df.ifname.nunique() > 1):
-                oif_df = self._if_df.query(f'hostname=="{device}" and '
-                                           f' ifname=="{iface}"')
+                oif_df = self._get_ifs(device, iface)
                 if not oif_df.empty and oif_df.ipAddressList.iloc[0]:
                     revip = oif_df.ipAddressList.iloc[0].split('/')[0]
                     revvrf = "default" if overlay else vrf
-                    revarp_df = self._arpnd_df.query(
-                        f'hostname=="{df.hostname.unique()[0]}" and '
-                        f'ipAddress=="{revip}" and vrf=="{revvrf}" and '
-                        'state!="failed"')
+                    revarp_df = self._get_arpnd(df.hostname.unique()[0],
+                                                revip)
+                    revarp_df = revarp_df[(revarp_df.vrf == revvrf) &
+                                          (revarp_df.state != "failed")]
                     if not revarp_df.empty:
                         df = df.query(f'ifname == "{revarp_df.oif.iloc[0]}"')
             df.apply(lambda x, nexthops:
@@ -676,9 +660,98 @@ class PathObj(SqPandasEngine):
         if srcvers != dstvers:
             raise AttributeError(
                 "Source and Dest MUST belong to same address familt")
+
+        return self._trace(src, dest, dvrf)
+
+    def trace_pairs(self, namespace: str, pairs: List[Tuple[str, str]],
+                    vrf: str = '', workers: int = 1) -> pd.DataFrame:
+        """Return the paths between each of the source and dest pairs
+
+        All the pairs are traced on the same forwarding graph of the
+        namespace, which is only built once, and the routes to all the
+        sources and dests are looked up in one go before the traces start.
+        With more than one worker, the pairs are split across a pool of
+        processes forked once the graph is built, which they inherit. A pair
+        that cannot be traced doesn't stop the others, the error is returned
+        instead of its path.
+
+        :param namespace: str, the namespace to trace the paths in
+        :param pairs: List[Tuple[str, str]], the source and dest addresses
+        :param vrf: str, the VRF of the sources, inferred if not specified
+        :param workers: int, the number of processes to trace the paths in
+        :returns: the paths, with the source and dest of each path
+        :rtype: pd.DataFrame
+        """
+        if not self.ctxt.engine:
+            raise AttributeError(
+                "Specify an analysis engine using set engine " "command"
+            )
+        if not namespace:
+            raise AttributeError("Must specify namespace to run the trace in")
+
+        self.namespace = namespace
+        pairs = list(pairs)
+        graph = get_path_graph(self.ctxt, self._dbeng, namespace)
+        graph.prefetch_lpm([x for pair in pairs for x in pair])
+
+        workers = min(workers or 1, os.cpu_count() or 1,
+                      -(-len(pairs) // PATH_PAIRS_PER_CHUNK))
+        if workers <= 1:
+            dfs = [self._trace_pairs(pairs, vrf, graph)]
+        else:
+            chunks = [pairs[i:i+PATH_PAIRS_PER_CHUNK]
+                      for i in range(0, len(pairs), PATH_PAIRS_PER_CHUNK)]
+            # The pool processes must be forked to inherit the graph
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_trace_process,
+                    initargs=(self, graph)) as pool:
+                dfs = list(pool.map(_trace_pairs_in_pool, chunks,
+                                    repeat(vrf)))
+
+        dfs = [x for x in dfs if not x.empty]
+        if not dfs:
+            return pd.DataFrame()
+        df = pd.concat(dfs, ignore_index=True)
+        if 'error' in df.columns:
+            df['error'] = df.error.fillna('')
+            if not any(df.error):
+                df.drop(columns=['error'], inplace=True)
+        return df
+
+    def _trace_pairs(self, pairs: List[Tuple[str, str]], vrf: str,
+                     graph) -> pd.DataFrame:
+        """Return the paths between the pairs, traced on the graph"""
+        dfs = []
+        for src, dest in pairs:
+            try:
+                if (ip_network(src, strict=False).version !=
+                        ip_network(dest, strict=False).version):
+                    raise AttributeError(
+                        "Source and Dest MUST belong to same address family")
+                df = self._trace(src, dest, vrf, graph)
+            except Exception as e:
+                # Whatever goes wrong with one pair mustn't stop the rest
+                df = pd.DataFrame({'namespace': [self.namespace],
+                                   'error': [str(e)]})
+            if df.empty:
+                continue
+            df.insert(1, 'source', src)
+            df.insert(2, 'dest', dest)
+            dfs.append(df)
+
+        if not dfs:
+            return pd.DataFrame()
+        return pd.concat(dfs, ignore_index=True)
+
+    def _trace(self, src: str, dest: str, dvrf: str,
+               graph=None) -> pd.DataFrame:
+        """Return the paths between the src and dest in the namespace"""
+        srcvers = ip_network(src, strict=False)._version
         # All exceptions in the initial data gathering will happen in this init
         # After this, at least we know we have the data to work on
-        self._init_dfs(self.namespace, src, dest)
+        self._init_dfs(self.namespace, src, dest, graph)
 
         devices_iifs = OrderedDict()
         src_mtu = None
@@ -763,8 +836,7 @@ class PathObj(SqPandasEngine):
                 if destdevkey in dest_device_iifs:
                     if revdf_check:
                         vrfchk = dest_device_iifs[destdevkey]["vrf"]
-                        rev_df = self._rpf_df.query(
-                            f'hostname == "{device}" and vrf == "{vrfchk}"')
+                        rev_df = self._get_route(device, vrfchk, rpf=True)
                         if rev_df.empty:
                             dest_device_iifs[destdevkey]['error'] \
                                 .append('no reverse path')
@@ -832,7 +904,7 @@ class PathObj(SqPandasEngine):
                     else:
                         ndst = devices_iifs[devkey].get('nhip', None)
                     # Check if this is the end of the L2 path or overlay
-                    nhdf = self._if_df.query(f'hostname=="{device}"')
+                    nhdf = self._get_ifs(device)
                     if not nhdf.empty:
                         if srcvers == 4:
                             nhdf = nhdf.query(
@@ -906,15 +978,13 @@ class PathObj(SqPandasEngine):
                 devices_iifs[devkey]['vrf'] = ivrf
                 rt_ts = None
                 if not (is_l2 or ioverlay):
-                    rslt = self._rdf.query('hostname == "{}" and vrf == "{}"'
-                                           .format(device, ivrf))
+                    rslt = self._get_route(device, ivrf)
                     if not rslt.empty:
                         devices_iifs[devkey]['timestamp'] = rslt.timestamp.iloc[0]
                         devices_iifs[devkey]['protocol'] = rslt.protocol.iloc[0]
                         devices_iifs[devkey]['lookup'] = rslt.prefix.iloc[0]
 
-                        rev_df = self._rpf_df.query(
-                            f'hostname == "{device}" and vrf == "{ivrf}"')
+                        rev_df = self._get_route(device, ivrf, rpf=True)
                         if rev_df.empty and not on_src_node:
                             devices_iifs[devkey]['error'] \
                                 .append('no reverse path')
@@ -947,14 +1017,9 @@ class PathObj(SqPandasEngine):
                             peer_if = self._mlag_peerlink[peer_device]
                         elif peer_if.startswith('sup-eth1'):
                             peer_if = 'loopback0'
-                        in_mtu = self._if_df[
-                            (self._if_df["hostname"] == peer_device) &
-                            (self._if_df["ifname"] == peer_if)
-                        ].iloc[-1].mtu
-                        out_mtu = self._if_df[
-                            (self._if_df["hostname"] == device) &
-                            (self._if_df["ifname"] == iface)
-                        ].iloc[-1].mtu
+                        in_mtu = self._get_ifs(peer_device, peer_if) \
+                                     .iloc[-1].mtu
+                        out_mtu = self._get_ifs(device, iface).iloc[-1].mtu
                         if on_src_node and src_mtu > MAX_MTU:
                             src_mtu = out_mtu
                         mtu_match = in_mtu == out_mtu
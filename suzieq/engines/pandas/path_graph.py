@@ -0,0 +1,261 @@
+import threading
+from collections import OrderedDict, defaultdict
+from typing import List
+
+import pandas as pd
+
+from suzieq.sqobjects import interfaces, routes, arpnd, macs, mlag
+from suzieq.utils import expand_nxos_ifname
+from .addr_index import AddrIndex
+from .lpm_index import LpmIndex
+
+# The tables the forwarding graph is built from
+PATH_GRAPH_TABLES = ['interfaces', 'routes', 'arpnd', 'macs', 'mlag']
+# Max graphs cached per process
+PATH_GRAPH_CACHE_ENTRIES = 4
+# Max addresses whose LPM result is retained per graph
+PATH_GRAPH_LPM_ENTRIES = 4096
+
+ROUTE_COLUMNS = ["namespace", "hostname", "vrf", "metric", "prefix",
+                 "prefixlen", "nexthopIps", "oifs", "protocol", "ipvers"]
+
+_graph_cache = OrderedDict()
+_graph_cache_lock = threading.Lock()
+
+
+class PathGraph(object):
+    '''The forwarding state of a namespace used to trace paths
+
+    The interfaces, ARP/ND, MAC, MLAG and routing tables of the namespace
+    are read once, and looked up via indices built on first use by the keys
+    they're looked up by during a trace, such as the hostname & ifname for
+    interfaces, instead of a query of the whole table per lookup. The
+    routes are held in an LpmIndex, and the longest prefix match of an
+    address is retained so that all the traces to the same destination, or
+    via the same VTEP, share it. A graph is not specific to a trace, and so
+    can be reused by any number of traces in the namespace.
+    '''
+
+    def __init__(self, ctxt, namespace: str):
+        self.namespace = namespace
+        self._groups = {}
+        self._lpm_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        try:
+            self.if_df = interfaces.IfObj(context=ctxt) \
+                                   .get(namespace=namespace, state='up',
+                                        addnl_fields=['macaddr']) \
+                                   .explode('ipAddressList') \
+                                   .fillna({'ipAddressList': ''}) \
+                                   .explode('ip6AddressList') \
+                                   .fillna({'ip6AddressList': ''}) \
+                                   .reset_index(drop=True)
+        except KeyError:
+            self.if_df = pd.DataFrame()
+        self.addr_index = AddrIndex(self.if_df)
+
+        # Need this in determining L2 peer
+        mlag_df = mlag.MlagObj(context=ctxt).get(namespace=namespace)
+        self.mlag_peers = defaultdict(str)
+        self.mlag_peerlink = defaultdict(str)
+        if not mlag_df.empty:
+            peerlist = [x.tolist()
+                        for x in mlag_df.groupby(by=['systemId'])['hostname']
+                        .unique().tolist()]
+            for peers in peerlist:
+                if len(peers) > 1:
+                    self.mlag_peers[peers[0]] = peers[1]
+                    self.mlag_peers[peers[1]] = peers[0]
+            for row in mlag_df.itertuples():
+                self.mlag_peerlink[row.hostname] = \
+                    expand_nxos_ifname(row.peerLink)
+
+        self.routes_df = routes.RoutesObj(context=ctxt) \
+                               .get(namespace=namespace,
+                                    columns=ROUTE_COLUMNS)
+        self._lpm_index = LpmIndex(self.routes_df)
+
+        self.arpnd_df = arpnd.ArpndObj(context=ctxt).get(namespace=namespace)
+        if not self.arpnd_df.empty and not self.if_df.empty:
+            # Enhance the ARPND table with the VRF field
+            self.arpnd_df = self.arpnd_df.merge(
+                self.if_df[['namespace', 'hostname', 'ifname', 'master']],
+                left_on=['namespace', 'hostname', 'oif'],
+                right_on=['namespace', 'hostname', 'ifname'], how='left') \
+                .drop(columns=['ifname']) \
+                .rename(columns={'master': 'vrf'}) \
+                .replace({'vrf': {'': 'default'}}) \
+                .query('state != "failed"') \
+                .reset_index(drop=True)
+
+        self.macs_df = macs.MacsObj(context=ctxt).get(namespace=namespace)
+
+    def get_rows(self, table: str, keys: List[str], value) -> pd.DataFrame:
+        """Return the rows of the table with the value for the key columns
+
+        The table is grouped by the key columns on the first lookup by them,
+        making every lookup a dict lookup instead of a scan of the table.
+
+        :param table: str, one of interfaces, arpnd or macs
+        :param keys: List[str], the columns to look up by
+        :param value: the value of the column, a tuple for many columns
+        :returns: the rows matching, in the order of the table
+        :rtype: pd.DataFrame
+        """
+        df = self._get_table(table)
+        groups = self._groups.get((table, tuple(keys)), None)
+        if groups is None:
+            if df.empty or not set(keys).issubset(df.columns):
+                groups = {}
+            else:
+                groups = dict(tuple(df.groupby(
+                    keys[0] if len(keys) == 1 else keys,
+                    sort=False, observed=True)))
+            self._groups[(table, tuple(keys))] = groups
+        return groups.get(value, df.iloc[0:0])
+
+    def get_macs(self, macaddr: str, hostname: str = '', vlan=None,
+                 local_only: bool = False) -> pd.DataFrame:
+        """Return the MAC table entries for the MAC address
+
+        :param macaddr: str, the MAC address
+        :param hostname: str, the device to restrict the entries to
+        :param vlan: the VLAN to restrict the entries to
+        :param local_only: bool, True to exclude the entries behind a VTEP
+        :returns: the MAC table entries
+        :rtype: pd.DataFrame
+        """
+        df = self.get_rows('macs', ['macaddr'], macaddr)
+        if hostname:
+            df = df[df.hostname == hostname]
+        if vlan is not None:
+            try:
+                df = df[df.vlan == int(vlan)]
+            except (TypeError, ValueError):
+                return df.iloc[0:0]
+        if local_only:
+            df = df[df.remoteVtepIp == '']
+        return df
+
+    def lpm(self, address: str) -> pd.DataFrame:
+        """Return the longest matching route per route table for the address
+
+        :param address: str, the IP address to look up
+        :returns: the matching routes
+        :rtype: pd.DataFrame
+        """
+        return self._get_lpm(address)[0]
+
+    def lpm_route(self, address: str, hostname: str,
+                  vrf: str) -> pd.DataFrame:
+        """Return the longest matching route for the address on a device
+
+        :param address: str, the IP address to look up
+        :param hostname: str, the device to look up in
+        :param vrf: str, the VRF of the route table to look up in
+        :returns: the matching route, empty if there's none
+        :rtype: pd.DataFrame
+        """
+        df, tables = self._get_lpm(address)
+        return tables.get((hostname, vrf), df.iloc[0:0])
+
+    def prefetch_lpm(self, addresses: List[str]) -> None:
+        """Look up the longest matching routes of many addresses in one go
+
+        The routes of all the addresses are looked up with a single lookup
+        of the LpmIndex instead of one per address, and retained for the
+        traces to or from these addresses. Only as many addresses as are
+        retained per graph are looked up.
+
+        :param addresses: List[str], the IP addresses to look up
+        """
+        with self._lock:
+            addresses = [x for x in dict.fromkeys(addresses)
+                         if x not in self._lpm_cache]
+        addresses = addresses[:PATH_GRAPH_LPM_ENTRIES]
+        if not addresses:
+            return
+
+        df = self._lpm_index.lpm(addresses, addr_col='address')
+        if df.empty:
+            groups = {}
+        else:
+            groups = dict(tuple(df.groupby('address', sort=False)))
+        for addr in addresses:
+            self._put_lpm(addr, groups.get(addr, df.iloc[0:0])
+                          .drop(columns=['address']))
+
+    def _get_lpm(self, address: str) -> tuple:
+        with self._lock:
+            entry = self._lpm_cache.get(address, None)
+            if entry is not None:
+                self._lpm_cache.move_to_end(address)
+                return entry
+
+        return self._put_lpm(address,
+                             self._lpm_index.lpm([address], addr_col=''))
+
+    def _put_lpm(self, address: str, df: pd.DataFrame) -> tuple:
+        if df.empty:
+            tables = {}
+        else:
+            tables = dict(tuple(df.groupby(['hostname', 'vrf'], sort=False,
+                                           observed=True)))
+        with self._lock:
+            self._lpm_cache[address] = (df, tables)
+            while len(self._lpm_cache) > PATH_GRAPH_LPM_ENTRIES:
+                self._lpm_cache.popitem(last=False)
+        return df, tables
+
+    def _get_table(self, table: str) -> pd.DataFrame:
+        if table == 'interfaces':
+            return self.if_df
+        elif table == 'arpnd':
+            return self.arpnd_df
+        elif table == 'macs':
+            return self.macs_df
+        raise ValueError(f'Unknown path graph table {table}')
+
+
+def get_path_graph(ctxt, dbeng, namespace: str) -> PathGraph:
+    """Return the forwarding graph of the namespace, building it if needed
+
+    Graphs of the latest state of a namespace are cached along with the
+    tokens of the tables they're built from, and rebuilt when the data of
+    any of these tables changes. The tables are read with the hostname
+    filter of the context, and so the graphs are cached per filter. Graphs
+    of a time window or of another view aren't cached, as the window may be
+    relative to the current time.
+
+    :param ctxt: SqContext, the context to read the tables with
+    :param dbeng: SqDB, the DB the tables are read from
+    :param namespace: str, the namespace
+    :returns: the forwarding graph
+    :rtype: PathGraph
+    """
+    if (ctxt.start_time or ctxt.end_time or
+            getattr(ctxt, 'view', 'latest') not in ['latest', '']):
+        return PathGraph(ctxt, namespace)
+
+    tokens = tuple(dbeng.get_table_token(x) for x in PATH_GRAPH_TABLES)
+    if None in tokens:
+        return PathGraph(ctxt, namespace)
+
+    hostname = ctxt.hostname or []
+    if isinstance(hostname, str):
+        hostname = hostname.split()
+    key = (ctxt.cfg.get('data-directory', ''), namespace, tuple(hostname))
+    with _graph_cache_lock:
+        entry = _graph_cache.get(key, None)
+        if entry and entry[0] == tokens:
+            _graph_cache.move_to_end(key)
+            return entry[1]
+
+    graph = PathGraph(ctxt, namespace)
+    with _graph_cache_lock:
+        _graph_cache[key] = (tokens, graph)
+        _graph_cache.move_to_end(key)
+        while len(_graph_cache) > PATH_GRAPH_CACHE_ENTRIES:
+            _graph_cache.popitem(last=False)
+    return graph
@@ -1,8 +1,8 @@
-from collections import defaultdict
 from .engineobj import SqPandasEngine
+from .lpm_index import LpmIndex
 import pandas as pd
 import numpy as np
-from ipaddress import ip_address, ip_network
+from ipaddress import ip_address
 
 
 class RoutesObj(SqPandasEngine):
@@ -155,6 +155,12 @@ class RoutesObj(SqPandasEngine):
         return self.ns_df.convert_dtypes()
 
     def lpm(self, **kwargs):
+        """Return the longest prefix match for the address(es) per route table
+
+        address can be a single address or a list of addresses. With a list,
+        the matches for all the addresses are looked up at once, and the
+        result includes the address column to identify the match.
+        """
         if not self.iobj._table:
             raise NotImplementedError
 
@@ -165,9 +171,9 @@ class RoutesObj(SqPandasEngine):
         df = kwargs.pop('cached_df', pd.DataFrame())
         addnl_fields = kwargs.pop('addnl_fields', [])
 
+        addrlist = addr if isinstance(addr, list) else [addr]
         try:
-            ipaddr = ip_address(addr)
-            ipvers = ipaddr._version
+            ipvers_list = set(ip_address(x).version for x in addrlist)
         except ValueError as e:
             raise ValueError(e)
 
@@ -180,14 +186,13 @@ class RoutesObj(SqPandasEngine):
                 addnl_fields.insert(-1, 'prefix')
                 drop_cols.append('prefix')
 
-        rslt = pd.DataFrame()
-
         # if not using a pre-populated dataframe
         if df.empty:
+            ipvers = ipvers_list.pop() if len(ipvers_list) == 1 else ''
             df = self.get(ipvers=ipvers, columns=cols,
                           addnl_fields=addnl_fields, **kwargs)
         else:
-            df = df.query(f'ipvers=={ipvers}')
+            df = df.loc[df.ipvers.isin(ipvers_list)]
 
         if df.empty:
             return df
@@ -198,33 +203,8 @@ class RoutesObj(SqPandasEngine):
             df['prefixlen'] = df['prefixlen'].str[1].astype('int')
             drop_cols.append('prefixlen')
 
-        # Vectorized operation for faster results with IPv4:
-        if ipvers == 4:
-            intaddr = df.prefix.str.split('/').str[0] \
-                .map(lambda y: int(''.join(['%02x' % int(x)
-                                            for x in y.split('.')]),
-                                   16))
-            netmask = df.prefixlen \
-                .map(lambda x: (0xffffffff << (32 - x)) & 0xffffffff)
-            match = (ipaddr._ip & netmask) == (intaddr & netmask)
-            rslt = df.loc[match.loc[match].index] \
-                .sort_values('prefixlen', ascending=False) \
-                .drop_duplicates(['namespace', 'hostname', 'vrf'])
-        else:
-            selected_entries = {}
-            max_plens = defaultdict(int)
-            for row in df.itertuples():
-                rtentry = ip_network(row.prefix)
-                if ipaddr in rtentry:
-                    key = f'{row.namespace}-{row.hostname}-{row.vrf}'
-                    if rtentry.prefixlen > max_plens[key]:
-                        max_plens[key] = rtentry.prefixlen
-                        selected_entries[key] = row
-            if selected_entries:
-                rslt = pd.DataFrame(list(selected_entries.values())) \
-                    .drop(columns=['Index'], errors='ignore')
-            else:
-                rslt = pd.DataFrame()
+        rslt = LpmIndex(df).lpm(
+            addrlist, addr_col='address' if isinstance(addr, list) else '')
 
         if drop_cols:
             return rslt.drop(columns=drop_cols, errors='ignore')
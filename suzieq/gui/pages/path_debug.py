@@ -1,7 +1,6 @@
 from itertools import zip_longest
 from typing import Collection
 
-import pandas as pd
 import streamlit as st
 
 
@@ -20,7 +19,6 @@ def path_debug_sidebar(state):
 def handle_edge_url(url_params: dict, pathSession):
     '''Display tables associated with a link'''
 
-    namespace = url_params.get('namespace', [""])[0]
     hostname = url_params.get('hostname', [""])[0]
     nhip = url_params.get('nhip', [""])[0]
     ipLookup = url_params.get('ipLookup', [""])[0]
@@ -50,11 +48,10 @@ def handle_edge_url(url_params: dict, pathSession):
 
         if vtepLookup:
             st.info(f'Underlay Lookup on {hostname} for {vtepLookup}')
-            vtepdf = engobj._underlay_dfs.get(vtepLookup,
-                                              pd.DataFrame())
+            vtepdf = engobj._graph.lpm_route(vtepLookup, hostname,
+                                             'default')
             if not vtepdf.empty:
-                st.dataframe(data=vtepdf.query(
-                    f'hostname=="{hostname}" and vrf=="default"'))
+                st.dataframe(data=vtepdf)
         if nhip:
             st.info(
                 f'ARP/ND Table on {hostname} for nexthop {nhip}, oif={oif}')
@@ -96,14 +93,13 @@ def handle_edge_url(url_params: dict, pathSession):
     if macaddr:
         with st.beta_expander(f'MAC Table for {hostname}, MAC addr {macaddr}',
                               expanded=True):
-            st.dataframe(data=pathobj.engine._macsobj.get(
-                namespace=namespace, hostname=hostname, macaddr=macaddr))
+            st.dataframe(data=pathobj.engine._graph.get_macs(
+                macaddr, hostname=hostname))
 
 
 def handle_hop_url(url_params, pathSession):
     '''Handle table display associated with hop'''
 
-    namespace = url_params.get('namespace', [""])[0]
     hostname = url_params.get('hostname', [""])[0]
 
     if not hostname:
@@ -140,9 +136,8 @@ def handle_hop_url(url_params, pathSession):
                               f'{row.hopCount}', expanded=True):
             if row.macaddr:
                 st.info(f'MAC Table on {hostname}, MAC addr {row.macaddr}')
-                st.dataframe(data=engobj._macsobj.get(namespace=namespace,
-                                                      hostname=hostname,
-                                                      macaddr=row.macaddr))
+                st.dataframe(data=engobj._graph.get_macs(
+                    row.macaddr, hostname=hostname))
                 continue
 
             if (row.ipLookup != row.vtepLookup):
@@ -152,11 +147,10 @@ def handle_hop_url(url_params, pathSession):
 
             if row.vtepLookup:
                 st.info(f'Underlay Lookup on {hostname} for {row.vtepLookup}')
-                vtepdf = engobj._underlay_dfs.get(row.vtepLookup,
-                                                  pd.DataFrame())
+                vtepdf = engobj._graph.lpm_route(row.vtepLookup, hostname,
+                                                 'default')
                 if not vtepdf.empty:
-                    st.dataframe(data=vtepdf.query(
-                        f'hostname=="{hostname}" and vrf=="default"'))
+                    st.dataframe(data=vtepdf)
 
             oifs = row.oif.tolist()
             nhops = row.nexthopIp.tolist()
@@ -1,4 +1,4 @@
-from .node import init_hosts, Node
+from .node import init_hosts, get_worker_for_host, Node
 from .files import init_files
 
-__all__ = [init_hosts, init_files, Node]
+__all__ = [init_hosts, get_worker_for_host, init_files, Node]
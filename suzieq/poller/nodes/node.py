@@ -8,6 +8,7 @@ import random
 from http import HTTPStatus
 import json
 import re
+import hashlib
 
 import yaml
 from urllib.parse import urlparse
@@ -20,11 +21,23 @@ from asyncio.subprocess import PIPE, DEVNULL
 from concurrent.futures._base import TimeoutError
 
 from suzieq.poller.services.service import RsltToken
+from suzieq.poller.nodes.shell import SshShell, get_shell_profile
 from suzieq.poller.genhosts import convert_ansible_inventory
 from suzieq.utils import get_timestamp_from_junos_time, known_devtypes
 
 logger = logging.getLogger(__name__)
 
+# Commands a node starts with running in parallel, and the default upper
+# limit the adaptive concurrency control can raise it to
+NODE_INIT_CONCURRENCY = 4
+NODE_MAX_CONCURRENCY = 8
+
+# Max parallel connections of a node's REST session and how long an idle
+# connection is kept open. The keepalive must exceed the polling period for
+# the connections to be reused across polls.
+REST_CONN_LIMIT = 4
+REST_KEEPALIVE_TIMEOUT = 75
+
 
 def get_hostsdata_from_hostsfile(hosts_file) -> dict:
     """Read the suzieq devices file and return the data from the file"""
@@ -74,10 +87,31 @@ def get_hostsdata_from_hostsfile(hosts_file) -> dict:
     return hostsconf
 
 
+def get_worker_for_host(hostkey: str, num_workers: int) -> int:
+    """Return the poller worker that polls the host
+
+    Rendezvous hashing is used, so every host maps to the same worker in
+    every run, and changing the number of workers only moves the hosts
+    of the workers added or removed.
+
+    :param hostkey: str, identifies the host, namespace/address:port
+    :param num_workers: int, the number of poller workers
+    :returns: the index of the worker the host is assigned to
+    :rtype: int
+    """
+    if num_workers <= 1:
+        return 0
+    return max(range(num_workers),
+               key=lambda x: hashlib.md5(f'{hostkey}/{x}'.encode())
+               .digest())
+
+
 async def init_hosts(**kwargs):
     """Process list of devices to gather data from.
     This involves creating a node for each device listed, and connecting to
-    those devices and initializing state about those devices
+    those devices and initializing state about those devices.
+    With more than one poller worker, only the hosts assigned to this worker
+    are initialized.
     """
 
     nodes = {}
@@ -97,6 +131,10 @@ async def init_hosts(**kwargs):
     ignore_known_hosts = kwargs.pop('ignore_known_hosts', False)
     user_password = kwargs.pop('password', None)
     connect_timeout = kwargs.pop('connect_timeout', 15)
+    max_concurrency = kwargs.pop('max_concurrency', NODE_MAX_CONCURRENCY)
+    shell_devtypes = kwargs.pop('shell_devtypes', [])
+    worker_id = kwargs.pop('worker_id', 0)
+    num_workers = kwargs.pop('num_workers', 1)
 
     if kwargs:
         logger.error(f'Received unrecognized keywords {kwargs}, aborting')
@@ -136,6 +174,7 @@ async def init_hosts(**kwargs):
         nsname = namespace["namespace"]
 
         tasks = []
+        skipped = 0
         hostlist = namespace.get("hosts", [])
         if not hostlist:
             logger.error(f'No hosts in namespace {nsname}')
@@ -172,6 +211,11 @@ async def init_hosts(**kwargs):
                     logger.error(f'Ignoring node {host}')
                     continue
 
+                if get_worker_for_host(f'{nsname}/{host}:{port}',
+                                       num_workers) != worker_id:
+                    skipped += 1
+                    continue
+
                 newnode = Node()
                 tasks += [newnode._init(
                     address=host,
@@ -188,11 +232,16 @@ async def init_hosts(**kwargs):
                     namespace=nsname,
                     connect_timeout=connect_timeout,
                     ignore_known_hosts=ignore_known_hosts,
+                    max_concurrency=max_concurrency,
+                    shell_devtypes=shell_devtypes,
                 )]
             else:
                 logger.error(f'Ignoring invalid host specification: {entry}')
 
         if not tasks:
+            if skipped:
+                # All the hosts of this namespace are polled by other workers
+                continue
             logger.error("No hosts detected in provided inventory file")
             return []
 
@@ -211,6 +260,57 @@ async def init_hosts(**kwargs):
     return nodes
 
 
+class AimdConcurrency(object):
+    '''Adapts the number of commands a node runs in parallel
+
+    The limit is raised additively, by 1/limit for every command that
+    completes in time, and halved when a command times out or its latency
+    is more than latency_factor times the lowest latency seen for that
+    service on the node. The limit is halved at most once per command
+    latency, so a burst of slow commands in parallel counts only once.
+    The lowest latency creeps up slowly towards the latencies seen, to
+    adapt to a device that has become permanently slower.
+    '''
+
+    def __init__(self, initial: int = NODE_INIT_CONCURRENCY,
+                 min_limit: int = 1,
+                 max_limit: int = NODE_MAX_CONCURRENCY,
+                 latency_factor: float = 2.0):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latency_factor = latency_factor
+        self.base_latency = {}     # lowest latency per service
+        self._last_decrease = 0
+
+    @property
+    def current(self) -> int:
+        """The number of commands that can be run in parallel now"""
+        return int(self.limit)
+
+    def update(self, service: str, latency: float, timedout: bool) -> None:
+        """Adapt the limit based on the outcome of a command
+
+        :param service: str, the service the command was run for
+        :param latency: float, secs taken by the command to complete
+        :param timedout: bool, True if the command timed out
+        """
+        base = self.base_latency.get(service, 0)
+        if not base or latency < base:
+            base = latency
+        else:
+            base += (latency - base) * 0.01
+        self.base_latency[service] = base
+
+        now = time.time()
+        if timedout or latency > base * self.latency_factor:
+            if now - self._last_decrease > latency:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
 class Node(object):
     @property
     def status(self):
@@ -241,12 +341,21 @@ class Node(object):
         self.init_again_at = 0  # after this epoch secs, try init again
         self.connect_timeout = kwargs.get('connect_timeout', 15)
         self.cmd_timeout = 10  # default command timeout in seconds
-        self.batch_size = 4    # Number of commands to issue in parallel
+        # Number of commands to issue in parallel, adapted to the device
+        self.concurrency = AimdConcurrency(
+            max_limit=kwargs.get('max_concurrency', NODE_MAX_CONCURRENCY))
         self.bootupTimestamp = 0
         self.version = 0                 # OS Version to pick the right defn
         self._service_queue = None
         self._conn = None
         self._tunnel = None
+        self._session = None   # REST session, kept open across polls
+        # Device types whose commands are run over a persistent shell
+        self.shell_devtypes = kwargs.get('shell_devtypes', None) or []
+        self._shell = None
+        self._shell_lock = asyncio.Lock()
+        self.rest_conn_created = 0  # REST connections (handshakes) made
+        self.rest_conn_reused = 0   # REST requests over an open connection
         self._status = "init"
         self.svcs_proc = set()
         self.error_svcs_proc = set()
@@ -566,7 +675,7 @@ class Node(object):
                 self._terminate()
                 return
 
-            while (len(tasks) < self.batch_size):
+            while (len(tasks) < self.concurrency.current):
                 try:
                     request = await self._service_queue.get()
                 except asyncio.CancelledError:
@@ -574,7 +683,7 @@ class Node(object):
                     return
 
                 if request:
-                    tasks.append(self.exec_service(
+                    tasks.append(self._run_service(
                         request[0], request[1], request[2]))
                     self.logger.debug(
                         f"Scheduling {request[2].service} for execution")
@@ -587,6 +696,23 @@ class Node(object):
 
                 tasks = list(pending)
 
+    async def _run_service(self, service_callback, svc_defn: dict,
+                           cb_token: RsltToken):
+        """Execute the service, adapting concurrency to its outcome"""
+        start = time.time()
+
+        async def measure_callback(result, token):
+            timedout = isinstance(result, list) and any(
+                x.get('status', -1) == HTTPStatus.REQUEST_TIMEOUT
+                for x in result)
+            self.concurrency.update(svc_defn.get('service', ''),
+                                    time.time() - start, timedout)
+            if isinstance(token, RsltToken):
+                token.nodeConcurrency = self.concurrency.current
+            return await service_callback(result, token)
+
+        return await self.exec_service(measure_callback, svc_defn, cb_token)
+
     async def ssh_gather(self, service_callback, cmd_list, cb_token, oformat,
                          timeout):
         """Run ssh for cmd in cmdlist and place output on service callback"""
@@ -611,6 +737,11 @@ class Node(object):
             cb_token.node_token = self.bootupTimestamp
 
         timeout = timeout or self.cmd_timeout
+        if self._use_shell():
+            await self._shell_gather(service_callback, cmd_list, cb_token,
+                                     timeout)
+            return
+
         for cmd in cmd_list:
             try:
                 output = await asyncio.wait_for(self._conn.run(cmd),
@@ -638,7 +769,52 @@ class Node(object):
 
         await service_callback(result, cb_token)
 
+    def _use_shell(self) -> bool:
+        """True if the commands are to be run over a persistent shell"""
+        return (self.devtype in self.shell_devtypes and
+                get_shell_profile(self.devtype) is not None)
+
+    async def _shell_gather(self, service_callback, cmd_list, cb_token,
+                            timeout):
+        """Run the commands pipelined over the node's persistent shell
+
+        The shell is opened on the node's SSH connection the first time,
+        and reopened after a failure. The commands of concurrent calls are
+        run one call after the other, as the shell can only run one batch
+        of commands at a time.
+        """
+        result = []
+        try:
+            async with self._shell_lock:
+                if not self._shell or self._shell.closed:
+                    self._shell = await SshShell.open(
+                        self._conn, get_shell_profile(self.devtype),
+                        timeout)
+                output = await self._shell.run(cmd_list, timeout)
+            for cmd, (status, data) in zip(cmd_list, output):
+                result.append(self._create_result(cmd, status, data))
+        except Exception as e:
+            if self.sigend:
+                self._terminate()
+                return
+            self.last_exception = e
+            result = [self._create_error(cmd) for cmd in cmd_list]
+            if isinstance(e, asyncio.TimeoutError):
+                self.logger.error(
+                    f"Unable to connect to {self.hostname} {cmd_list} "
+                    "due to timeout")
+            else:
+                self.logger.error(
+                    f"Unable to connect to {self.hostname} for {cmd_list} "
+                    f"due to {str(e)}")
+                await self._close_connection()
+
+        await service_callback(result, cb_token)
+
     async def _close_connection(self):
+        if self._shell:
+            self._shell.close()
+            self._shell = None
         if self._conn:
             self._conn.close()
             await self._conn.wait_closed()
@@ -648,6 +824,51 @@ class Node(object):
 
         self._conn = None
         self._tunnel = None
+        await self._close_rest_session()
+
+    def _get_rest_session(self) -> aiohttp.ClientSession:
+        """Return the node's REST session, creating it if needed
+
+        The session, and the TCP/TLS connections in its pool, are kept open
+        across polls instead of paying for a fresh handshake with the device
+        on every command. The session is only recreated after a failure.
+
+        :returns: the REST session of the node
+        :rtype: aiohttp.ClientSession
+        """
+        if self._session and not self._session.closed:
+            return self._session
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(
+            self._on_rest_conn_create)
+        trace_config.on_connection_reuseconn.append(self._on_rest_conn_reuse)
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.username, password=self.password),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout),
+            connector=aiohttp.TCPConnector(
+                ssl=False, limit=REST_CONN_LIMIT,
+                keepalive_timeout=REST_KEEPALIVE_TIMEOUT),
+            trace_configs=[trace_config],
+        )
+        return self._session
+
+    async def _close_rest_session(self):
+        if self._session:
+            await self._session.close()
+        self._session = None
+
+    async def _on_rest_conn_create(self, session, trace_ctx, params):
+        self.rest_conn_created += 1
+
+    async def _on_rest_conn_reuse(self, session, trace_ctx, params):
+        self.rest_conn_reused += 1
+
+    def _update_rest_stats(self, cb_token: RsltToken):
+        """Pass on the REST connection counters via the callback token"""
+        if isinstance(cb_token, RsltToken):
+            cb_token.restConnCnt = self.rest_conn_created
+            cb_token.restConnReuseCnt = self.rest_conn_reused
 
     async def _terminate(self):
         self.logger.warning(
@@ -852,7 +1073,8 @@ class Node(object):
                 cmd = use.get("command", None)
 
         if not cmd:
-            return result
+            # Let the service know, to free up the poll's slot
+            return await service_callback(result, cb_token)
 
         oformat = use.get('format', 'json')
         if type(cmd) is not list:
@@ -945,7 +1167,6 @@ class EosNode(Node):
         timeout = timeout or self.cmd_timeout
 
         now = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-        auth = aiohttp.BasicAuth(self.username, password=self.password)
         data = {
             "jsonrpc": "2.0",
             "method": "runCmds",
@@ -962,18 +1183,17 @@ class EosNode(Node):
         status = 200  # status OK
 
         try:
-            async with aiohttp.ClientSession(
-                    auth=auth,
-                    conn_timeout=self.connect_timeout,
-                    read_timeout=timeout,
-                    connector=aiohttp.TCPConnector(ssl=False),
-            ) as session:
-                async with session.post(url, json=data, headers=headers) as response:
-                    status, json_out = response.status, await response.json()
-                    if "result" in json_out:
-                        output.extend(json_out["result"])
-                    else:
-                        output.extend(json_out["error"].get('data', []))
+            session = self._get_rest_session()
+            async with session.post(
+                    url, json=data, headers=headers,
+                    timeout=aiohttp.ClientTimeout(
+                        total=timeout, sock_connect=self.connect_timeout)
+            ) as response:
+                status, json_out = response.status, await response.json()
+                if "result" in json_out:
+                    output.extend(json_out["result"])
+                else:
+                    output.extend(json_out["error"].get('data', []))
 
             for i, cmd in enumerate(cmd_list):
                 result.append(
@@ -999,7 +1219,13 @@ class EosNode(Node):
             self.logger.error("ERROR: (REST) Unable to communicate with node "
                               "{}:{} due to {}".format(
                                   self.address, self.port, str(e)))
+            if isinstance(e, (aiohttp.ClientConnectionError,
+                              asyncio.TimeoutError)):
+                # Only drop the session shared with the other services if
+                # the node is unreachable, not if a command failed
+                await self._close_rest_session()
 
+        self._update_rest_stats(cb_token)
         await service_callback(result, cb_token)
 
     async def _parse_hostname(self, output, cb_token) -> None:
@@ -1034,33 +1260,31 @@ class CumulusNode(Node):
         if not cmd_list:
             return result
 
-        auth = aiohttp.BasicAuth(self.username, password=self.password)
         url = "https://{0}:{1}/nclu/v1/rpc".format(self.address, self.port)
         headers = {"Content-Type": "application/json"}
+        req_timeout = aiohttp.ClientTimeout(
+            total=timeout or self.cmd_timeout,
+            sock_connect=self.connect_timeout)
 
         try:
-            async with aiohttp.ClientSession(
-                    auth=auth,
-                    timeout=timeout or self.cmd_timeout,
-                    connector=aiohttp.TCPConnector(ssl=False),
-            ) as session:
-                for cmd in cmd_list:
-                    data = {"cmd": cmd}
-                    async with session.post(
-                            url, json=data, headers=headers
-                    ) as response:
-                        result.append(
-                            {
-                                "status": response.status,
-                                "timestamp": int(datetime.now(tz=timezone.utc).timestamp() * 1000),
-                                "cmd": cmd,
-                                "devtype": self.devtype,
-                                "namespace": self.nsname,
-                                "hostname": self.hostname,
-                                "address": self.address,
-                                "data": await response.text(),
-                            }
-                        )
+            session = self._get_rest_session()
+            for cmd in cmd_list:
+                data = {"cmd": cmd}
+                async with session.post(
+                        url, json=data, headers=headers, timeout=req_timeout
+                ) as response:
+                    result.append(
+                        {
+                            "status": response.status,
+                            "timestamp": int(datetime.now(tz=timezone.utc).timestamp() * 1000),
+                            "cmd": cmd,
+                            "devtype": self.devtype,
+                            "namespace": self.nsname,
+                            "hostname": self.hostname,
+                            "address": self.address,
+                            "data": await response.text(),
+                        }
+                    )
         except Exception as e:
             if self.sigend:
                 self._terminate()
@@ -1070,7 +1294,13 @@ class CumulusNode(Node):
             self.logger.error("ERROR: (REST) Unable to communicate with node "
                               "{}:{} due to {}".format(
                                   self.address, self.port, str(e)))
+            if isinstance(e, (aiohttp.ClientConnectionError,
+                              asyncio.TimeoutError)):
+                # Only drop the session shared with the other services if
+                # the node is unreachable, not if a command failed
+                await self._close_rest_session()
 
+        self._update_rest_stats(cb_token)
         await service_callback(result, cb_token)
 
 
@@ -1168,6 +1398,11 @@ class IosXENode(Node):
            This is different from IOSXE to avoid reinit node info each time
         """
 
+        if self._use_shell():
+            # The shell keeps a single connection & channel open instead
+            return await super().ssh_gather(service_callback, cmd_list,
+                                            cb_token, oformat, timeout)
+
         result = []
 
         if cmd_list is None:
@@ -0,0 +1,187 @@
+import re
+import asyncio
+from uuid import uuid4
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import asyncssh
+
+# Width of the terminal requested, wide enough to not wrap command echoes
+SHELL_TERM_WIDTH = 511
+SHELL_READ_SIZE = 65536
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+# Errors reported by network OS CLIs at the start of a command's output
+_CLI_ERROR_RE = re.compile(
+    r'^\s*(% ?(Invalid|Incomplete|Ambiguous|Unrecognized|Unknown)|'
+    r'syntax error|unknown command|error:)', re.IGNORECASE | re.MULTILINE)
+
+
+@dataclass
+class ShellProfile:
+    '''How to drive the interactive shell of a NOS'''
+    # Commands run once when the shell is opened, to disable paging etc.
+    init_cmds: List[str] = field(default_factory=list)
+    # Command that marks the end of a command's output, formatted with the
+    # sentinel. On network OS CLIs this is a comment that's echoed back.
+    sentinel_cmd: str = '! {}'
+    # True if the shell echoes the commands back
+    echo: bool = True
+    # True if the sentinel cmd outputs the sentinel followed by :exit status
+    exit_status: bool = False
+
+
+_LINUX_PROFILE = ShellProfile(
+    init_cmds=['stty -echo', "export PS1='' PS2=''", 'unset PROMPT_COMMAND'],
+    sentinel_cmd='echo {}:$?', echo=False, exit_status=True)
+
+SHELL_PROFILES = {
+    'eos': ShellProfile(['terminal length 0', 'terminal width 32767']),
+    'ios': ShellProfile(['terminal length 0', 'terminal width 0']),
+    'iosxe': ShellProfile(['terminal length 0', 'terminal width 0']),
+    'iosxr': ShellProfile(['terminal length 0', 'terminal width 0']),
+    'nxos': ShellProfile(['terminal length 0', 'terminal width 511']),
+    'junos': ShellProfile(['set cli screen-length 0',
+                           'set cli screen-width 0'], sentinel_cmd='# {}'),
+    'cumulus': _LINUX_PROFILE,
+    'linux': _LINUX_PROFILE,
+    'sonic': _LINUX_PROFILE,
+}
+
+
+def get_shell_profile(devtype: str) -> ShellProfile:
+    """Return the shell profile of the device type, None if unsupported"""
+    if devtype and devtype.startswith('junos'):
+        devtype = 'junos'
+    return SHELL_PROFILES.get(devtype, None)
+
+
+class SshShell(object):
+    '''Runs commands pipelined over a single interactive shell
+
+    Instead of opening a new SSH channel for every command, a single shell
+    is opened on the connection and all the commands of a batch are written
+    to it in one go, each followed by a command that outputs a unique
+    sentinel. The output of each command is what the shell returns between
+    the sentinels. The commands must be run one batch at a time, as the
+    output is read in the order the commands were written.
+    '''
+
+    def __init__(self, process: asyncssh.SSHClientProcess,
+                 profile: ShellProfile):
+        self.profile = profile
+        self.closed = False
+        self._proc = process
+        self._buf = ''
+        self._marker = f'SQ{uuid4().hex[:12]}'
+        self._seq = 0
+
+    @classmethod
+    async def open(cls, conn: asyncssh.SSHClientConnection,
+                   profile: ShellProfile, timeout: int) -> 'SshShell':
+        """Open a shell on the connection and prepare it to run commands
+
+        :param conn: asyncssh.SSHClientConnection, the device connection
+        :param profile: ShellProfile, how to drive the device's shell
+        :param timeout: int, secs to wait for the init cmds to complete
+        :returns: the shell
+        :rtype: SshShell
+        """
+        process = await conn.create_process(
+            term_type='vt100', term_size=(SHELL_TERM_WIDTH, 24))
+        shell = cls(process, profile)
+        # Also swallows the login banner and the first prompt
+        await shell.run(['']+profile.init_cmds, timeout)
+        return shell
+
+    async def run(self, cmd_list: List[str],
+                  timeout: int) -> List[Tuple[int, str]]:
+        """Run the commands, returning the status and output of each
+
+        :param cmd_list: List[str], the commands to run
+        :param timeout: int, secs to wait for the output of each command
+        :returns: the exit status and output of each command
+        :rtype: List[Tuple[int, str]]
+        """
+        sentinels = []
+        lines = []
+        for cmd in cmd_list:
+            self._seq += 1
+            sentinel = f'{self._marker}-{self._seq}'
+            lines += [cmd, self.profile.sentinel_cmd.format(sentinel)]
+            sentinels.append(sentinel)
+
+        try:
+            self._proc.stdin.write('\n'.join(lines) + '\n')
+            result = []
+            for cmd, sentinel in zip(cmd_list, sentinels):
+                chunk, endline = await asyncio.wait_for(
+                    self._read_until(sentinel), timeout)
+                output = self._get_output(cmd, chunk)
+                result.append((self._get_status(output, endline), output))
+        except Exception:
+            # We can't tell what output belongs to which command anymore
+            self.close()
+            raise
+
+        return result
+
+    def close(self) -> None:
+        """Close the shell, the connection is left open"""
+        self.closed = True
+        self._proc.close()
+
+    def _is_sentinel(self, line: str, sentinel: str) -> bool:
+        line = _ANSI_RE.sub('', line).rstrip()
+        if self.profile.exit_status:
+            # The output can follow a prompt, but must not be the echo of
+            # the sentinel cmd, which is possible till echo is turned off
+            idx = line.find(f'{sentinel}:')
+            return idx >= 0 and not line[:idx].rstrip().endswith('echo')
+        return line.endswith(sentinel)
+
+    async def _read_until(self, sentinel: str) -> Tuple[str, str]:
+        """Return the output before the sentinel, and the sentinel's line"""
+        pieces = []
+        text, self._buf = self._buf, ''
+        while True:
+            end = text.rfind('\n') + 1
+            # Large outputs arrive in many reads, so avoid rescanning them
+            if text.find(sentinel, 0, end) >= 0:
+                pos = 0
+                while pos < end:
+                    nl = text.find('\n', pos)
+                    if self._is_sentinel(text[pos:nl], sentinel):
+                        pieces.append(text[:pos])
+                        self._buf = text[nl+1:]
+                        return ''.join(pieces), text[pos:nl]
+                    pos = nl + 1
+            pieces.append(text[:end])
+            data = await self._proc.stdout.read(SHELL_READ_SIZE)
+            if not data:
+                self.closed = True
+                raise ConnectionResetError('Shell closed by device')
+            text = text[end:] + data.replace('\r', '')
+
+    def _get_output(self, cmd: str, chunk: str) -> str:
+        """Strip the command's echo and what precedes it from the chunk"""
+        chunk = _ANSI_RE.sub('', chunk)
+        if not self.profile.echo:
+            return chunk
+
+        lines = chunk.split('\n')
+        cmd = cmd.strip()
+        for i, line in enumerate(lines):
+            if line.rstrip().endswith(cmd):
+                return '\n'.join(lines[i+1:])
+        return '\n'.join(lines[1:])
+
+    def _get_status(self, output: str, endline: str) -> int:
+        if self.profile.exit_status:
+            try:
+                return int(_ANSI_RE.sub('', endline).rsplit(':', 1)[1])
+            except ValueError:
+                return -1
+        if _CLI_ERROR_RE.search('\n'.join(output.split('\n', 3)[:3])):
+            return 1
+        return 0
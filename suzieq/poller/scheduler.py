@@ -0,0 +1,123 @@
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from collections import deque
+
+
+class PollScheduler(object):
+    '''Schedules the polls of all the services across all the nodes
+
+    Every service & node pair is polled at a fixed phase within the service
+    period, derived from a hash of the pair. This spreads the polls evenly
+    across the period instead of firing them all at the same instant, and
+    the phase stays the same across restarts. A random jitter of upto
+    jitter x period is added to every poll to avoid lockstep between pairs
+    with close phases.
+
+    The number of polls posted to the nodes but not yet returned is capped
+    at max_inflight, with the polls beyond that waiting in a FIFO queue.
+    A poll is considered done if it hasn't returned within two periods,
+    so that a node not responding doesn't hold up the others forever.
+    '''
+
+    def __init__(self, max_inflight: int = 0, jitter: float = 0.1):
+        self.max_inflight = max_inflight
+        self.jitter = jitter
+        self.logger = logging.getLogger(__name__)
+        self._inflight = {}         # poll key -> when its considered done
+        self._waiting = deque()
+        self._next_due = {}         # poll key -> due time of the next poll
+        # poll key -> when the last poll began and the secs since the one
+        # before that, i.e. the achieved period
+        self._last_start = {}
+
+    @staticmethod
+    def get_phase(key: str, period: int) -> float:
+        """Return the offset within the period at which the key is polled"""
+        digest = hashlib.md5(key.encode()).digest()
+        return int.from_bytes(digest[:8], 'big') / 2**64 * period
+
+    def schedule_first(self, service: str, nodename: str, period: int,
+                       callback, *args) -> None:
+        """Schedule the first poll of the service on the node at its phase
+
+        :param service: str, the name of the service
+        :param nodename: str, the name of the node
+        :param period: int, the polling period of the service in secs
+        :param callback: the function to call with args to post the poll,
+                         returning True if the poll was posted
+        """
+        key = (service, nodename)
+        due = time.time() + self.get_phase(f'{service}/{nodename}', period)
+        self._schedule(key, due, period, callback, args)
+
+    def schedule_next(self, service: str, nodename: str, period: int,
+                      callback, *args) -> None:
+        """Schedule the next poll of the service on the node
+
+        The poll is scheduled a period after the previous one was due. If
+        that time is past, as the previous poll took longer than the period,
+        the poll is scheduled at the next due time, retaining the phase.
+        The parameters are the same as for schedule_first.
+        """
+        key = (service, nodename)
+        now = time.time()
+        due = self._next_due.get(key, now) + period
+        if due < now:
+            due += math.ceil((now - due)/period)*period
+        self._schedule(key, due, period, callback, args)
+
+    def done(self, service: str, nodename: str) -> None:
+        """Mark the poll of the service on the node as complete"""
+        self._inflight.pop((service, nodename), None)
+        self._dispatch_waiting()
+
+    def get_achieved_period(self, service: str, nodename: str) -> float:
+        """Return the secs between the starts of the last two polls"""
+        return self._last_start.get((service, nodename), (0, 0))[1]
+
+    def stats(self) -> dict:
+        """Return the number of polls in flight and waiting"""
+        return {'inflight': len(self._inflight),
+                'waiting': len(self._waiting)}
+
+    def _schedule(self, key: tuple, due: float, period: int, callback,
+                  args: tuple) -> None:
+        self._next_due[key] = due
+        delay = due - time.time() + \
+            random.uniform(0, self.jitter) * period
+        asyncio.get_event_loop().call_later(
+            max(0, delay), self._dispatch, key, period, callback, args)
+
+    def _dispatch(self, key: tuple, period: int, callback,
+                  args: tuple) -> None:
+        if self.max_inflight and len(self._inflight) >= self.max_inflight:
+            self._expire_inflight()
+            if len(self._inflight) >= self.max_inflight:
+                self._waiting.append((key, period, callback, args))
+                return
+        self._post(key, period, callback, args)
+
+    def _post(self, key: tuple, period: int, callback, args: tuple) -> None:
+        now = time.time()
+        last_start, _ = self._last_start.get(key, (0, 0))
+        self._last_start[key] = (now, now - last_start if last_start else 0)
+        self._inflight[key] = now + 2*period
+        if not callback(*args):
+            self._inflight.pop(key, None)
+
+    def _dispatch_waiting(self) -> None:
+        while self._waiting and (not self.max_inflight or
+                                 len(self._inflight) < self.max_inflight):
+            self._post(*self._waiting.popleft())
+
+    def _expire_inflight(self) -> None:
+        now = time.time()
+        expired = [k for k, v in self._inflight.items() if v < now]
+        for key in expired:
+            self.logger.warning(f'Poll of {key[0]} on {key[1]} did not '
+                                'complete in time')
+            del self._inflight[key]
@@ -7,9 +7,13 @@ from inspect import getmembers, isclass, getfile
 import importlib
 from collections import defaultdict
 from pathlib import Path
+from typing import List
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from suzieq.utils import Schema, SchemaForTable
-from .service import Service
+from .service import Service, register_pool_service
 
 
 logger = logging.getLogger(__name__)
@@ -176,6 +180,7 @@ async def init_services(svc_dir: str, schema_dir: str, queue, svclist: list,
                 run_once
             )
 
+        service.compile_json_templates()
         service.poller_schema = poller_schema
         service.poller_schema_version = poller_schema_version
         logger.info("Service {} added".format(service.name))
@@ -183,4 +188,47 @@ async def init_services(svc_dir: str, schema_dir: str, queue, svclist: list,
 
     return svcs_list
 
-__all__ = [Service, init_services]
+def _init_parser_process():
+    """Leave the handling of signals to the poller process"""
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def init_parser_pool(svcs: List[Service], pool_size: int,
+                     pool_svcs: List[str]) -> ProcessPoolExecutor:
+    """Create the process pool to parse the output of the services specified
+
+    Parsing the output of services such as routes from large devices can take
+    long enough to stall the polling of other devices. Services that opt in
+    via the list in the config have their output parsed in a pool of
+    processes instead of in the poller's event loop.
+
+    :param svcs: List[Service], the list of services initialized
+    :param pool_size: int, the number of parser processes
+    :param pool_svcs: List[str], the services whose output is parsed in pool
+    :returns: the parser pool, None if there are no services to use it
+    :rtype: ProcessPoolExecutor
+    """
+    if not pool_size or not pool_svcs:
+        return None
+
+    use_pool = [x for x in svcs if x.name in pool_svcs]
+    if not use_pool:
+        return None
+
+    for svc in use_pool:
+        register_pool_service(svc)
+
+    # The pool processes must be forked for the services to be inherited
+    pool = ProcessPoolExecutor(
+        max_workers=pool_size, mp_context=multiprocessing.get_context('fork'),
+        initializer=_init_parser_process)
+    for svc in use_pool:
+        svc.parser_pool = pool
+        logger.info(f'Service {svc.name} output will be parsed in pool')
+
+    return pool
+
+
+__all__ = [Service, init_services, init_parser_pool]
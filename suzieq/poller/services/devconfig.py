@@ -30,6 +30,10 @@ class ConfigService(Service):
 
         return processed_data
 
+    def get_record_state(self, records: list) -> list:
+        """The config is diffed by itself, so save the records as is"""
+        return records
+
     def get_diff(self, old, new):
         """Compare string hashes for fast matches of config
         """
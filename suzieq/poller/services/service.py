@@ -3,7 +3,6 @@ from typing import List
 import asyncio
 from datetime import datetime, timezone
 import time
-import copy
 import logging
 import json
 import yaml
@@ -11,14 +10,35 @@ from tempfile import mkstemp
 from dataclasses import dataclass, field
 from http import HTTPStatus
 from collections import defaultdict
+from concurrent.futures.process import BrokenProcessPool
 
 import pyarrow as pa
 
-from suzieq.poller.services.svcparser import cons_recs_from_json_template
+from suzieq.poller.services.svcparser import (cons_recs_from_json_template,
+                                              compile_json_template)
 from suzieq.utils import known_devtypes
+from suzieq.poller.writer import RecordBatchBuilder
 from suzieq.version import SUZIEQ_VERSION
 
 HOLD_TIME_IN_MSECS = 60000  # How long b4 declaring node dead
+# NaN != NaN, so NaNs are replaced by this in the record fingerprints
+NAN_FINGERPRINT = '<NaN>'
+
+# Services whose output is parsed in the parser pool, keyed by service name.
+# The pool processes are forked after this is populated, and so inherit the
+# services and their templates. Only the device output and the parsed
+# records need to be passed to and from the pool processes.
+_pool_services = {}
+
+
+def register_pool_service(service: 'Service') -> None:
+    """Make the service available to the parser pool processes"""
+    _pool_services[service.name] = service
+
+
+def process_data_in_pool(svcname: str, data: list) -> list:
+    """Parse the device output in a parser pool process"""
+    return _pool_services[svcname].process_data(data)
 
 
 @dataclass
@@ -29,6 +49,9 @@ class RsltToken:
     nodeQsize: int        # Size of the node q at queuing time
     service: str          # Name of this service, if node needs it
     timeout: int          # timeout value for cmd to complete
+    restConnCnt: int = 0       # REST connections made by node so far
+    restConnReuseCnt: int = 0  # REST requests that reused a connection
+    nodeConcurrency: int = 0   # Commands node runs in parallel currently
 
 
 @dataclass
@@ -38,7 +61,10 @@ class ServiceStats:
     svcQsize: List[float] = field(default_factory=list)
     nodeQsize: List[float] = field(default_factory=list)
     wrQsize: List[float] = field(default_factory=list)
+    wrBufRows: List[float] = field(default_factory=list)
     rxBytes: List[float] = field(default_factory=list)
+    achieved_period: List[float] = field(default_factory=list)
+    node_concurrency: List[float] = field(default_factory=list)
     empty_count: int = 0
     time_excd_count: int = 0    # Number of times total_time > poll period
     next_update_time: int = 0   # When results will be logged
@@ -76,6 +102,17 @@ class Service(object):
         self._poller_schema = {}
         self.node_boot_times = defaultdict(int)
         self._failed_node_set = set()
+        # Returns rows buffered by writer given topic, namespace & hostname
+        self.writer_bufsize_cb = None
+        # Process pool to parse the device output in, if opted in
+        self.parser_pool = None
+        # Compiled normalize templates keyed by the template string
+        self.json_templates = {}
+        # Index of the poller worker process running this service
+        self.poller_worker = 0
+        # Spreads the polls across the period, if set. Else every node is
+        # polled a period after its previous poll returned.
+        self.scheduler = None
 
         self.poller_schema = property(
             self.get_poller_schema, self.set_poller_schema)
@@ -93,6 +130,12 @@ class Service(object):
             self.keys.insert(1, "hostname")
 
         self.partition_cols = schema.get_partition_columns()
+        # Key fields to maintain the table's latest state snapshot with.
+        # Only record tables have a snapshot.
+        if schema.type == "record":
+            self.table_keys = schema.key_fields()
+        else:
+            self.table_keys = []
 
         # Setup dictionary of NOS specific extracted data cleaners
         self.dev_clean_fn = {}
@@ -168,43 +211,64 @@ class Service(object):
             return name
         return ""
 
+    def _freeze(self, val):
+        """Return a hashable version of the value for use in a fingerprint"""
+        if isinstance(val, list):
+            val = tuple(self._freeze(x) for x in val)
+        elif isinstance(val, float) and val != val:
+            return NAN_FINGERPRINT
+        try:
+            hash(val)
+        except TypeError:
+            val = str(val)
+        return val
+
+    def get_record_state(self, records: list) -> dict:
+        """Return the fingerprinted records used to diff with the next poll
+
+        Every record is keyed by a fingerprint of the values of all its
+        fields except the ignored and transient fields. The fingerprint
+        tuple refers to the record's values and so is cheap to build and
+        hold, and is compared by its hash. Along with the record, we save
+        its key field values to decide if a record is deleted or updated.
+
+        :param records: list, the records extracted from the device output
+        :returns: dict of fingerprint to the key field values & the record
+        :rtype: dict
+        """
+        ignore_fields = set(self.ignore_fields)
+        keys = set(self.keys)
+        state = {}
+        for elem in records:
+            # keys that start with _ are transient and must be ignored
+            # from comparison
+            fprint = tuple(self._freeze(v) for k, v in elem.items()
+                           if k not in ignore_fields and not k.startswith('_'))
+            kvals = tuple(self._freeze(v) for k, v in elem.items()
+                          if k in keys)
+            state[fprint] = (kvals, elem)
+
+        return state
+
     def get_diff(self, old, new):
-        """Compare list of dictionaries ignoring certain fields
+        """Compare the record states ignoring certain fields
         Return list of adds and deletes
+
+        :param old: dict, the record state of the previous poll
+        :param new: dict, the record state of this poll
         """
-        adds = []
-        dels = []
-        koldvals = {}
-        knewvals = {}
-        koldkeys = []
-        knewkeys = []
-
-        # keys that start with _ are transient and must be ignored
-        # from comparison
-        for i, elem in enumerate(old):
-            vals = [v for k, v in elem.items()
-                    if k not in self.ignore_fields and not k.startswith('_')]
-            kvals = [v for k, v in elem.items() if k in self.keys]
-            koldvals.update({tuple(str(vals)): i})
-            koldkeys.append(kvals)
-
-        for i, elem in enumerate(new):
-            vals = [v for k, v in elem.items()
-                    if k not in self.ignore_fields and not k.startswith('_')]
-            kvals = [v for k, v in elem.items() if k in self.keys]
-            knewvals.update({tuple(str(vals)): i})
-            knewkeys.append(kvals)
-
-        addlist = [v for k, v in knewvals.items() if k not in koldvals.keys()]
-        dellist = [v for k, v in koldvals.items() if k not in knewvals.keys()]
-
-        adds = [new[v] for v in addlist]
-        dels = [old[v] for v in dellist if koldkeys[v] not in knewkeys]
+        adds = [rec for fprint, (_, rec) in new.items() if fprint not in old]
+        if not old:
+            dels = []
+        else:
+            newkeys = set(kvals for kvals, _ in new.values())
+            dels = [rec for fprint, (kvals, rec) in old.items()
+                    if fprint not in new and kvals not in newkeys]
 
         if adds and self.stype == "counters":
             # If there's a change in any field of the counters, update them all
             # simplifies querying
-            adds = new
+            adds = [rec for _, rec in new.values()]
 
         return adds, dels
 
@@ -230,12 +294,14 @@ class Service(object):
         else:
             self.logger.error(f"No queue for service {self.name}")
 
-    def call_node_postcmd(self, postcall, nodename) -> None:
+    def call_node_postcmd(self, postcall, nodename) -> bool:
         """Start data gathering by calling the post command list"""
         if postcall and postcall['postq']:
             token = RsltToken(int(time.time()*1000), nodename, 0, 0, self.name,
                               self.period-5)
             postcall['postq'](self.post_results, self.defn, token)
+            return True
+        return False
 
     def clean_json_input(self, data):
         """Clean the JSON input data that is sometimes messed up
@@ -253,6 +319,11 @@ class Service(object):
         """
 
         for node in self.node_postcall_list:
+            if self.scheduler:
+                self.scheduler.schedule_first(
+                    self.name, node, self.period, self.call_node_postcmd,
+                    self.node_postcall_list[node], node)
+                continue
             try:
                 self.call_node_postcmd(self.node_postcall_list[node],
                                        node),
@@ -325,7 +396,8 @@ class Service(object):
                                 return []
 
                         result = cons_recs_from_json_template(
-                            norm_str, in_info)
+                            self.json_templates.get(norm_str, norm_str),
+                            in_info)
 
                 else:
                     tfsm_template = nfn.get("textfsm", None)
@@ -367,6 +439,24 @@ class Service(object):
 
         return result
 
+    def compile_json_templates(self) -> None:
+        """Compile the normalize templates of the service once for reuse"""
+        for val in self.defn.values():
+            norm_strs = [val.get('normalize', None)]
+            if isinstance(val.get('command', None), list):
+                norm_strs += [x.get('normalize', None)
+                              for x in val['command'] if isinstance(x, dict)]
+            for norm_str in norm_strs:
+                if not norm_str or norm_str in self.json_templates:
+                    continue
+                try:
+                    self.json_templates[norm_str] = compile_json_template(
+                        norm_str)
+                except Exception:
+                    # The template is parsed on every use, as before
+                    self.logger.warning(
+                        f'{self.name}: Unable to compile template {norm_str}')
+
     def process_data(self, data):
         """Derive the data to be stored from the raw input"""
         result_list = []
@@ -377,6 +467,21 @@ class Service(object):
         result = self.merge_results(result_list, data)
         return self.clean_data(result, data)
 
+    async def _parse_output(self, output: list) -> list:
+        """Parse the output, in the parser pool if this service uses one"""
+        if not self.parser_pool:
+            return self.process_data(output)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self.parser_pool, process_data_in_pool, self.name, output)
+        except BrokenProcessPool:
+            self.logger.error(f'{self.name}: Parser pool failed, parsing '
+                              'data inline from now on')
+            self.parser_pool = None
+            return self.process_data(output)
+
     def get_key_flds(self):
         """Get the key fields associated with this service. 
         Its a function because we want to override it.
@@ -503,19 +608,21 @@ class Service(object):
 
     async def commit_data(self, result, namespace, hostname):
         """Write the result data out"""
-        records = []
-        prev_res = self.previous_results.get(hostname, [])
+        records = RecordBatchBuilder(self.schema)
+        prev_res = self.previous_results.get(hostname, {})
 
         if result or prev_res:
-            adds, dels = self.get_diff(prev_res, result)
+            cur_res = self.get_record_state(result)
+            adds, dels = self.get_diff(prev_res, cur_res)
             if adds or dels:
-                self.previous_results[hostname] = copy.deepcopy(result)
-                for entry in adds:
-                    records.append(entry)
+                self.previous_results[hostname] = cur_res
+                records.extend(adds)
                 for entry in dels:
                     if entry.get("active", True):
                         # If there's already an entry marked as deleted
-                        # No point in adding one more
+                        # No point in adding one more. We copy the entry as
+                        # the original may not have been written out yet.
+                        entry = dict(entry)
                         entry.update({"active": False})
                         entry.update(
                             {"timestamp":
@@ -523,7 +630,39 @@ class Service(object):
                         )
                         records.append(entry)
 
-                self._post_work_to_writer(records)
+                if not self._post_batch_to_writer(records, namespace,
+                                                  hostname):
+                    # Diff the next poll with what was last written, so
+                    # the changes dropped now are sent again
+                    self.previous_results[hostname] = prev_res
+
+    def _post_batch_to_writer(self, records: RecordBatchBuilder,
+                              namespace: str, hostname: str) -> bool:
+        """Post the records to the writer as an Arrow record batch
+
+        :returns: False if the records couldn't be converted to Arrow
+        :rtype: bool
+        """
+        if not records.num_rows:
+            return True
+        try:
+            batch = records.build()
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            self.logger.error(f'Unable to convert {self.name} records from '
+                              f'{namespace}/{hostname} to Arrow: {e}')
+            return False
+        self.writer_queue.put_nowait(
+            {
+                "records": batch,
+                "topic": self.name,
+                "schema": self.schema,
+                "partition_cols": self.partition_cols,
+                "key_fields": self.table_keys,
+                "namespace": namespace,
+                "hostname": hostname,
+            }
+        )
+        return True
 
     def _post_work_to_writer(self, records: dict):
         """This posts the data to be written to the worker queue"""
@@ -533,7 +672,8 @@ class Service(object):
                     "records": records,
                     "topic": self.name,
                     "schema": self.schema,
-                    "partition_cols": self.partition_cols
+                    "partition_cols": self.partition_cols,
+                    "key_fields": self.table_keys
                 }
             )
 
@@ -560,9 +700,17 @@ class Service(object):
 
         return statsList
 
+    @staticmethod
+    def get_reuse_ratio(token: RsltToken) -> float:
+        """Return the fraction of REST requests that reused a connection"""
+        total = token.restConnCnt + token.restConnReuseCnt
+        return round(token.restConnReuseCnt/total, 3) if total else 0.0
+
     def update_stats(self, stats: ServiceStats, total_time: int,
                      gather_time: int, qsize: int, wrQsize: int,
-                     nodeQsize: int, rxBytes) -> bool:
+                     nodeQsize: int, rxBytes, wrBufRows: int = 0,
+                     achieved_period: float = 0,
+                     nodeConcurrency: int = 0) -> bool:
         """Update per-node stats"""
         write_stat = False
         now = int(time.time()*1000)
@@ -573,8 +721,16 @@ class Service(object):
                                                      gather_time)
         stats.svcQsize = self.compute_basic_stats(stats.svcQsize, qsize)
         stats.wrQsize = self.compute_basic_stats(stats.wrQsize, wrQsize)
+        stats.wrBufRows = self.compute_basic_stats(stats.wrBufRows,
+                                                   wrBufRows)
         stats.nodeQsize = self.compute_basic_stats(stats.nodeQsize, nodeQsize)
         stats.rxBytes = self.compute_basic_stats(stats.rxBytes, rxBytes)
+        if achieved_period:
+            stats.achieved_period = self.compute_basic_stats(
+                stats.achieved_period, achieved_period)
+        if nodeConcurrency:
+            stats.node_concurrency = self.compute_basic_stats(
+                stats.node_concurrency, nodeConcurrency)
 
         if total_time > self.period*1000:
             stats.time_excd_count += 1
@@ -612,6 +768,8 @@ class Service(object):
             if isinstance(token, list):
                 token = token[0]
             gather_time = int(time.time()*1000) - token.start_time
+            if self.scheduler:
+                self.scheduler.done(self.name, token.nodename)
 
             status = HTTPStatus.NO_CONTENT        # Empty content
             write_poller_stat = False
@@ -649,7 +807,7 @@ class Service(object):
                     continue
 
                 try:
-                    result = self.process_data(output)
+                    result = await self._parse_output(output)
                 except Exception:
                     result = []
                     status = HTTPStatus.BAD_GATEWAY
@@ -683,7 +841,7 @@ class Service(object):
                 if token.bootupTimestamp != self.node_boot_times[hostname]:
                     self.node_boot_times[hostname] = token.bootupTimestamp
                     # Flush the prev results data for this node
-                    self.previous_results[hostname] = []
+                    self.previous_results[hostname] = {}
                 await self.commit_data(result, output[0]["namespace"],
                                        hostname)
             else:
@@ -701,10 +859,22 @@ class Service(object):
                 statskey = output[0]["namespace"] + '/' + output[0]["hostname"]
 
                 stats = pernode_stats[statskey]
+                if self.writer_bufsize_cb:
+                    wrBufRows = self.writer_bufsize_cb(
+                        self.name, output[0]["namespace"],
+                        output[0]["hostname"])
+                else:
+                    wrBufRows = 0
+                if self.scheduler:
+                    achieved_period = self.scheduler.get_achieved_period(
+                        self.name, token.nodename)
+                else:
+                    achieved_period = 0
                 write_poller_stat = (self.update_stats(
                     stats, total_time, gather_time, qsize,
-                    self.writer_queue.qsize(), token.nodeQsize, rxBytes) or
-                    write_poller_stat)
+                    self.writer_queue.qsize(), token.nodeQsize, rxBytes,
+                    wrBufRows, achieved_period, token.nodeConcurrency)
+                    or write_poller_stat)
                 pernode_stats[statskey] = stats
                 if write_poller_stat:
                     poller_stat = [
@@ -716,14 +886,21 @@ class Service(object):
                          "status": status,
                          "svcQsize": stats.svcQsize,
                          "wrQsize": stats.wrQsize,
+                         "wrBufRows": stats.wrBufRows,
                          "nodeQsize": stats.nodeQsize,
+                         "nodeConcurrency": stats.node_concurrency,
                          "rxBytes": stats.rxBytes,
+                         "restConnCnt": token.restConnCnt,
+                         "restConnReuseRatio": self.get_reuse_ratio(token),
                          "pollExcdPeriodCount": stats.time_excd_count,
+                         "pollPeriod": self.period,
+                         "achievedPeriod": stats.achieved_period,
                          "gatherTime": stats.gather_time,
                          "totalTime": stats.total_time,
                          "version": SUZIEQ_VERSION,
                          "nodesPolledCnt": len(self.node_postcall_list),
                          "nodesFailedCnt": len(self._failed_node_set),
+                         "pollerWorker": self.poller_worker,
                          "timestamp": int(datetime.now(tz=timezone.utc)
                                           .timestamp() * 1000)}]
 
@@ -738,6 +915,13 @@ class Service(object):
             # Post a cmd to fire up the next poll after the specified period
             self.logger.debug(
                 f"Rescheduling service for {self.name} service")
-            loop.call_later(self.period, self.call_node_postcmd,
-                            self.node_postcall_list.get(token.nodename),
-                            token.nodename)
+            if self.scheduler:
+                self.scheduler.schedule_next(
+                    self.name, token.nodename, self.period,
+                    self.call_node_postcmd,
+                    self.node_postcall_list.get(token.nodename),
+                    token.nodename)
+            else:
+                loop.call_later(self.period, self.call_node_postcmd,
+                                self.node_postcall_list.get(token.nodename),
+                                token.nodename)
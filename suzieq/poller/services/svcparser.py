@@ -2,6 +2,9 @@ import re
 import ast
 import logging
 import operator as op
+from typing import Any, List
+from functools import lru_cache
+from dataclasses import dataclass, field
 
 
 def _stepdown_rest(entry) -> list:
@@ -79,7 +82,7 @@ def parse_subtree(subflds, tmpval, maybe_list, defval):
                 useval = True
                 break
             elif tmpval:
-                tmpval = tmpval[eval_expr(subfld)]
+                tmpval = tmpval[_eval_index(subfld)]
         elif isinstance(tmpval, dict):
             tmpval = tmpval.get(subfld, None)
         else:
@@ -97,88 +100,175 @@ def parse_subtree(subflds, tmpval, maybe_list, defval):
         return tmpval
 
 
-def cons_recs_from_json_template(tmplt_str, in_data):
-    ''' Return an array of records given the template and input data.
+@dataclass
+class _JsonHdrStep:
+    '''A step of the leading hierarchy traversal of a normalize template'''
+    xstr: str                   # the step as specified in the template
+    keyed: bool = False         # True if the step extracts a key such as vrf
+    lval: List[str] = field(default_factory=list)
+    rval: str = ''
+    nxtfld: str = None
+
+
+@dataclass
+class _JsonFieldSpec:
+    '''The extraction spec of a single field of a normalize template'''
+    lval: str                   # where to find the value in the input
+    rval: str                   # the field name, with an optional operation
+    subflds: List[str] = None   # lval split into its hierarchy, if nested
+    maybe_list: bool = False
+    op: str = None              # the default value specification, if any
+    exp_val: str = None
+    def_val: Any = None
+    dyn_def_val: bool = False   # def_val may be a field of the record
+    lit_def_val: Any = None     # def_val as a literal, if not a field
+    rval_op: List[str] = None   # rval split around the arithmetic operator
+
+
+class JsonTemplate(object):
+    '''A normalize template compiled for repeated use
+
+    Parsing the template string is independent of the data being extracted.
+    Compiling a template does this parsing once, leaving only the walk over
+    the input data to be done for every output received from a device.
+    '''
 
-    This uses an XPATH-like template string to create a list of records
-    matching the template. It also normalizes the key fields so that we
-    can create records with keys that are agnostic of the source.
+    def __init__(self, tmplt_str: str):
+        self.tmplt_str = tmplt_str
+        self.steps = []
+        self.fields = []
+        self._compile(tmplt_str)
 
-    I could not use a ready-made library like jsonpath because of the
-    difficulty in handling normalization and how jsonpath returns the
-    result. For example, if I have 3 route records, one with 2 nexthop IPs,
-    one with a single nexthop IP and one without a nexthop IP, jsonpath
-    returns the data as a single flat list of nexthop IPs without a hint of
-    figuring out which route the nexthops correspond to. We also support
-    some amount of additional processing on the extracted fields such as
-    the basic 4 arithmetic operations and specifying a default or
-    substitute.
-    '''
-    result = []
-    # Find prefix string
-    try:
-        ppos = re.search(r'/\[\s+', tmplt_str).start()
-    except AttributeError:
-        ppos = tmplt_str.index('[')
-
-    # templates have a structure with a leading hierarchy traversal
-    # followed by the fields for each record within that hierarchy.
-    # One example is: vrfs/*:vrf/routes/*:prefix/[... where '[' marks
-    # the start of the template to extract the values from the route
-    # records (prefix) across all the VRFs(vrf). We break up this
-    # processing into two parts, one before we reach  the inner record
-    # (before '[') and the other after.
-    #
-    # Before we enter the inner records, we flatten the hierarchy by
-    # creating as many records as necessary with the container values
-    # filled into each record as a separate key. So with the above
-    # template, we transform the route records to carry the vrf and the
-    # prefix as fields of each record. Thus, when we have 2 VRFs and 10
-    # routes in the first VRF and 6 routes in the second VRF, before
-    # we're done with the processing of the prefix hierarchy, the result
-    # has 16 records (10+6 routes) with the VRF and prefix values contained
-    # in each record.
-    #
-    # We flatten because that is how pandas (and pyarrow) can process the
-    # data best and queries can be made simple. The only nested structure
-    # we allow is a list in the innermost fields. Thus, the list of nexthop
-    # IP addresses associated with a route or the list of IP addresses
-    # associated with an interface are allowed, but not a tuple consisting
-    # of the nexthopIP and oif as a single entry.
-    data = in_data
-    nokeys = True
-    try:
-        pos = tmplt_str.index("/")
-    except ValueError:
-        ppos = 0                # completely flat JSON struct
-    while ppos > 0:
-        xstr = tmplt_str[0:pos]
-
-        if ":" not in xstr:
-            if not result:
-                if xstr != '*' and xstr != '*?':
-                    if not data or not data.get(xstr, None):
-                        # Some outputs contain just the main key with a null
-                        # body such as ospfNbr from EOS: {'vrfs': {}}.
-                        logging.info(
-                            f"Unnatural return from svcparser. xstr is {xstr}. \
-                            Result is {result}")
-                        return cleanup_and_return(result)
-                    result = [{"rest": data[xstr]}]
-                else:
-                    if isinstance(data, dict):
-                        result = [{"rest": []}]
-                        for key in data.keys():
-                            result[0]["rest"].append(data[key])
-                    else:
-                        result = [{"rest": data}]
+    def __repr__(self):
+        return f'JsonTemplate({self.tmplt_str})'
+
+    def _compile(self, tmplt_str: str):
+        # Find prefix string
+        try:
+            ppos = re.search(r'/\[\s+', tmplt_str).start()
+        except AttributeError:
+            ppos = tmplt_str.index('[')
+
+        # See cons_recs_from_json_template for the structure of a template
+        try:
+            pos = tmplt_str.index("/")
+        except ValueError:
+            ppos = 0                # completely flat JSON struct
+        while ppos > 0:
+            xstr = tmplt_str[0:pos]
+
+            if ":" not in xstr:
+                self.steps.append(_JsonHdrStep(xstr))
+                tmplt_str = tmplt_str[pos + 1:]
+                if re.match(r'^\[\s+"', tmplt_str):
+                    ppos = 0
+                    continue
+                try:
+                    pos = tmplt_str.index("/")
+                except ValueError:
+                    # its ppossible the JSON data is entirely flat
+                    ppos = 0
+                    continue
+                ppos -= pos
+                continue
+
+            *lval, rval = xstr.split(":")
+            if "|" in rval:
+                rval, nxtfld = rval.split('|')
             else:
-                if xstr != "*" and xstr != '*?':
+                nxtfld = None
+            self.steps.append(_JsonHdrStep(xstr, True, lval, rval, nxtfld))
+
+            tmplt_str = tmplt_str[pos + 1:]
+            try:
+                # handle EOS' ospfIf output
+                pos = tmplt_str.index("/")
+            except ValueError:
+                pos = ppos
+            ppos -= pos
+
+        # The if handles cases of flat JSON data such as evpnVni
+        if tmplt_str.startswith('/['):
+            tmplt_str = tmplt_str[2:-1]
+        else:
+            tmplt_str = tmplt_str[1:][:-1]         # eliminate'[', ']'
+        for selem in tmplt_str.split(","):
+            # every element here MUST have the form lval:rval
+            selem = selem.replace('"', '').strip()
+            if not selem:
+                # dealing with trailing "."
+                continue
+
+            try:
+                lval, rval = selem.split(": ")
+            except ValueError:
+                logging.error(f"Unable to parse JSON field entry {selem}")
+                continue
+
+            spec = _JsonFieldSpec(lval, rval)
+            # Process default value processing of the form <key>?|<def_val>
+            # or <key>?<expected_val>|<def_val>
+            if "?" in rval:
+                rval, spec.op = rval.split("?")
+                spec.exp_val, def_val = spec.op.split("|")
+
+                # Handle the case that the values are not strings
+                if def_val.isdigit():
+                    def_val = int(def_val)
+                elif def_val:
+                    # Whether this is a field of the record or a literal
+                    # depends on the data, and so is decided on extraction
+                    spec.dyn_def_val = True
+                    try:
+                        spec.lit_def_val = ast.literal_eval(def_val)
+                    except (ValueError, SyntaxError):
+                        spec.lit_def_val = def_val
+                spec.def_val = def_val
+
+            if "/" in lval:
+                spec.subflds = lval.split("/")
+                spec.maybe_list = any(x in spec.subflds
+                                      for x in ["*", "*?", "[*]?", "[*]",
+                                                '*:_sqstore'])
+            else:
+                spec.lval = lval.strip()
+
+            spec.rval = rval.strip()
+            spec.rval_op = re.split(r"([+/*-])", spec.rval)
+            self.fields.append(spec)
+
+    def extract(self, in_data) -> List[dict]:
+        '''Return the records extracted from the input data'''
+        result = []
+        data = in_data
+        nokeys = True
+
+        for step in self.steps:
+            xstr = step.xstr
+            if not step.keyed:
+                if not result:
+                    if xstr != '*' and xstr != '*?':
+                        if not data or not data.get(xstr, None):
+                            # Some outputs contain just the main key with a
+                            # null body such as ospfNbr from EOS: {'vrfs': {}}.
+                            logging.info(
+                                f"Unnatural return from svcparser. xstr is "
+                                f"{xstr}. Result is {result}")
+                            return cleanup_and_return(result)
+                        result = [{"rest": data[xstr]}]
+                    else:
+                        if isinstance(data, dict):
+                            result = [{"rest": []}]
+                            for key in data.keys():
+                                result[0]["rest"].append(data[key])
+                        else:
+                            result = [{"rest": data}]
+                elif xstr != "*" and xstr != '*?':
                     # Handle xstr being a specific array index or dict key
                     if xstr.startswith('['):
                         if len(result[0]['rest']):
-                            result[0]["rest"] = result[0]["rest"][eval_expr(
-                                xstr)]
+                            result[0]["rest"] = \
+                                result[0]["rest"][_eval_index(xstr)]
                         else:
                             # Handling the JUNOS EVPN pfx DB entry
                             logging.info(
@@ -198,7 +288,8 @@ def cons_recs_from_json_template(tmplt_str, in_data):
                                             tmpval.append(
                                                 {"rest": subele[xstr]})
                                         else:
-                                            ele['rest'][subidx] = subele[xstr]
+                                            ele['rest'][subidx] = \
+                                                subele[xstr]
                                 if not nokeys:
                                     if len(ele['rest']) == 1:
                                         ele['rest'] = ele['rest'][0]
@@ -212,8 +303,8 @@ def cons_recs_from_json_template(tmplt_str, in_data):
                 else:
                     if (xstr == '*?'):
                         # Massaging the format to handle cases like NXOS that
-                        # provide dict when there's a single element and a list
-                        # if there's more than one element
+                        # provide dict when there's a single element and a
+                        # list if there's more than one element
                         tmpres = []
                         for item in result:
                             if not isinstance(item, list):
@@ -237,8 +328,8 @@ def cons_recs_from_json_template(tmplt_str, in_data):
                                 elekeys = entry[0].keys() - set(['rest'])
                                 if not elekeys:
                                     # this happens when NXOS routes returns
-                                    # half-baked data when there are no routes
-                                    # in a VRF.
+                                    # half-baked data when there are no
+                                    # routes in a VRF.
                                     continue
                                 for rstentry in entry[0]['rest']:
                                     rstentry['sq-addnl-keys'] = []
@@ -248,7 +339,7 @@ def cons_recs_from_json_template(tmplt_str, in_data):
                                 for key in elekeys:
                                     del entry[0][key]
                                 # We should only have 'rest' entries now
-                            nokeys = True  # We've moved all the external keys in
+                            nokeys = True  # We've moved all the ext keys in
 
                         # Handle the output of the likes of EOS' BGP with
                         # starting string: 'vrfs/*/peerList/*/[ by
@@ -256,234 +347,226 @@ def cons_recs_from_json_template(tmplt_str, in_data):
                         for entry in result[1:]:
                             tmpres[0]['rest'].extend(entry[0]['rest'])
                         result = tmpres
-
-            tmplt_str = tmplt_str[pos + 1:]
-            if re.match(r'^\[\s+"', tmplt_str):
-                ppos = 0
                 continue
-            try:
-                pos = tmplt_str.index("/")
-            except ValueError:
-                # its ppossible the JSON data is entirely flat
-                ppos = 0
-                continue
-            ppos -= pos
-            continue
-
-        # handle one level of nesting to deal with Junos route JSON, NXOS route
-        # and many others that have an interesting field in parallel with
-        # the rest of the useful data
-        *lval, rval = xstr.split(":")
-        if "|" in rval:
-            rval, nxtfld = rval.split('|')
-        else:
-            nxtfld = None
-        nokeys = False
-        ks = [lval[0]]
-        tmpres = []
-        intres = []
-        if result:
-            for ele in result:
-                if lval[0] == "*":
-                    if isinstance(ele['rest'], dict):
-                        if nxtfld:
-                            intres = [{rval: ele['rest'].get(lval[1], ''),
-                                       "rest": ele['rest'].get(nxtfld, [])}]
-                        else:
-                            ks = list(ele["rest"].keys())
 
-                            intres = [{rval: x,
-                                       "rest": ele["rest"][x]}
-                                      for x in ks]
-                    else:
-                        if nxtfld:
-                            intres = [{rval: x.get(lval[1], ''),
-                                       "rest": x.get(nxtfld, [])}
-                                      for x in ele["rest"]]
+            # handle one level of nesting to deal with Junos route JSON, NXOS
+            # route and many others that have an interesting field in
+            # parallel with the rest of the useful data
+            lval, rval, nxtfld = step.lval, step.rval, step.nxtfld
+            nokeys = False
+            ks = [lval[0]]
+            tmpres = []
+            intres = []
+            if result:
+                for ele in result:
+                    if lval[0] == "*":
+                        if isinstance(ele['rest'], dict):
+                            if nxtfld:
+                                intres = [{rval: ele['rest'].get(lval[1], ''),
+                                           "rest": ele['rest'].get(nxtfld,
+                                                                   [])}]
+                            else:
+                                ks = list(ele["rest"].keys())
+
+                                intres = [{rval: x,
+                                           "rest": ele["rest"][x]}
+                                          for x in ks]
                         else:
-                            intres = [{rval: x.get(lval[1], ''), "rest": x}
-                                      for x in ele["rest"]]
-
-                for oldkey in ele.keys():
-                    if oldkey == "rest":
-                        continue
-                    for newele in intres:
-                        newele.update({oldkey: ele[oldkey]})
-                tmpres += intres
-            result = tmpres
-        else:
-            if lval == ["*"]:
-                ks = list(data.keys())
+                            if nxtfld:
+                                intres = [{rval: x.get(lval[1], ''),
+                                           "rest": x.get(nxtfld, [])}
+                                          for x in ele["rest"]]
+                            else:
+                                intres = [{rval: x.get(lval[1], ''),
+                                           "rest": x}
+                                          for x in ele["rest"]]
+
+                    for oldkey in ele.keys():
+                        if oldkey == "rest":
+                            continue
+                        for newele in intres:
+                            newele.update({oldkey: ele[oldkey]})
+                    tmpres += intres
+                result = tmpres
+            else:
+                if lval == ["*"]:
+                    ks = list(data.keys())
 
-            result = [{rval: x,
-                       "rest": data[x]} for x in ks]
+                result = [{rval: x,
+                           "rest": data[x]} for x in ks]
 
-        tmplt_str = tmplt_str[pos + 1:]
-        try:
-            # handle EOS' ospfIf output
-            pos = tmplt_str.index("/")
-        except ValueError:
-            pos = ppos
-        ppos -= pos
-
-    # Now for the rest of the fields
-    # if we only have 'rest' as the key, break out into individual mbrs
-    if nokeys:
-        if not result:
-            result = [{"rest": data}]
-        elif len(result) == 1:
-            if isinstance(result[0], list):
-                tmpval = []
-                for x in result[0]["rest"]:
-                    tmpval.append({"rest": x})
-                result = tmpval
-
-    # In some cases such as FRR's BGP, you need to eliminate elements which
-    # have no useful 'rest' field, for example the elements with vrfId and
-    # vrfName. If at this point, you have nn element in result with rest
-    # that is not a list or a dict, remove it
-
-    result = list(filter(lambda x: isinstance(x["rest"], list) or
-                         isinstance(x["rest"], dict),
-                         result))
-
-    # At this point, we're expecting result to contain a list where each
-    # entry contains the "rest' key with the fields from which further data
-    # is to be extracted, and a series of keys which represent what has already
-    # been extracted from the header string. If the format of result isn't
-    # this, fix it
-    if len(result) == 1 and isinstance(result[0]['rest'], list):
-        tmpres = []
-        entry = result[0]
-        elekeys = entry.keys() - set(['rest'])
-        for elem in entry['rest']:
-            newentry = {}
-            [newentry.update({x: entry[x]}) for x in elekeys]
-            newentry['rest'] = elem
-            tmpres.append(newentry)
-        result = tmpres
-
-    # The if handles cases of flat JSON data such as evpnVni
-    if tmplt_str.startswith('/['):
-        tmplt_str = tmplt_str[2:-1]
-    else:
-        tmplt_str = tmplt_str[1:][:-1]         # eliminate'[', ']'
-    for selem in tmplt_str.split(","):
-        per_entry_defval = False
-        def_val = None
-        # every element here MUST have the form lval:rval
-        selem = selem.replace('"', '').strip()
-        if not selem:
-            # dealing with trailing "."
-            continue
+        # Now for the rest of the fields
+        # if we only have 'rest' as the key, break out into individual mbrs
+        if nokeys:
+            if not result:
+                result = [{"rest": data}]
+            elif len(result) == 1:
+                if isinstance(result[0], list):
+                    tmpval = []
+                    for x in result[0]["rest"]:
+                        tmpval.append({"rest": x})
+                    result = tmpval
+
+        # In some cases such as FRR's BGP, you need to eliminate elements
+        # which have no useful 'rest' field, for example the elements with
+        # vrfId and vrfName. If at this point, you have nn element in result
+        # with rest that is not a list or a dict, remove it
+
+        result = list(filter(lambda x: isinstance(x["rest"], list) or
+                             isinstance(x["rest"], dict),
+                             result))
+
+        # At this point, we're expecting result to contain a list where each
+        # entry contains the "rest' key with the fields from which further
+        # data is to be extracted, and a series of keys which represent what
+        # has already been extracted from the header string. If the format of
+        # result isn't this, fix it
+        if len(result) == 1 and isinstance(result[0]['rest'], list):
+            tmpres = []
+            entry = result[0]
+            elekeys = entry.keys() - set(['rest'])
+            for elem in entry['rest']:
+                newentry = {}
+                [newentry.update({x: entry[x]}) for x in elekeys]
+                newentry['rest'] = elem
+                tmpres.append(newentry)
+            result = tmpres
 
-        try:
-            lval, rval = selem.split(": ")
-        except ValueError:
-            logging.error(f"Unable to parse JSON field entry {selem}")
-            continue
-
-        # Process default value processing of the form <key>?|<def_val> or
-        # <key>?<expected_val>|<def_val>
-        op = None
-        if "?" in rval:
-            rval, op = rval.split("?")
-            exp_val, def_val = op.split("|")
-
-            # Handle the case that the values are not strings
-            if def_val.isdigit():
-                def_val = int(def_val)
-            elif def_val:
+        for spec in self.fields:
+            per_entry_defval = False
+            lval = spec.lval
+            rval = spec.rval
+            op = spec.op
+            exp_val = spec.exp_val
+            def_val = spec.def_val
+            if spec.dyn_def_val:
                 if result and def_val not in result[0]:
                     # handle array indices, such as [] for default
-                    # If the field to be init is a prev val, then handle this
-                    # in the loop for x below as its different for each entry
-                    # an example of such an entry is:
+                    # If the field to be init is a prev val, then handle
+                    # this in the loop for x below as its different for
+                    # each entry. an example of such an entry is:
                     # "advertisedAndReceived: v4Enabled?|v4Enabled"
-                    # which means if advertisedAndReceived is not found in this
-                    # iteration, retain the previous value. This is useful when
-                    # handling minor changes in JSON output such as one version
-                    # with a key 'Advertised And Received' changing to
-                    # 'advertisedAndReceived' in the next version of output
-                    try:
-                        adef_val = ast.literal_eval(def_val)
-                        def_val = adef_val
-                    except ValueError:
-                        pass
+                    # which means if advertisedAndReceived is not found in
+                    # this iteration, retain the previous value. This is
+                    # useful when handling minor changes in JSON output such
+                    # as one version with a key 'Advertised And Received'
+                    # changing to 'advertisedAndReceived' in the next version
+                    def_val = spec.lit_def_val
                 else:
                     per_entry_defval = True
 
-        # Process for every element in result so far
-        # Handles entries such as "vias/*/nexthopIps" and returns
-        # a list of all nexthopIps.
-        for x in result:
+            # Process for every element in result so far
+            # Handles entries such as "vias/*/nexthopIps" and returns
+            # a list of all nexthopIps.
+            for x in result:
 
-            loopdef_val = def_val
-            if per_entry_defval and def_val is not None:
-                if def_val in x:
-                    loopdef_val = x[def_val]
-                else:
-                    loopdef_val = ''  # this shouldn't happen
+                loopdef_val = def_val
+                if per_entry_defval and def_val is not None:
+                    if def_val in x:
+                        loopdef_val = x[def_val]
+                    else:
+                        loopdef_val = ''  # this shouldn't happen
 
-            if "/" in lval:
-                subflds = lval.split("/")
-                tmpval = x["rest"]
-                value = None
-                if any(x in subflds for x in ["*", "*?", "[*]?", "[*]",
-                                              '*:_sqstore']):
-                    # Returning a list is the only supported option for now
-                    value = []
-                    maybe_list = True
+                if spec.subflds:
+                    maybe_list = spec.maybe_list
+                    value = parse_subtree(
+                        spec.subflds, x["rest"], maybe_list, loopdef_val)
                 else:
-                    maybe_list = False
+                    if isinstance(x['rest'], dict):
+                        value = x["rest"].get(lval, None)
 
-                value = parse_subtree(
-                    subflds, tmpval, maybe_list, loopdef_val)
-                subflds = []
-            else:
-                if isinstance(x['rest'], dict):
-                    value = x["rest"].get(lval.strip(), None)
-
-            if op:
-                if exp_val and value != exp_val:
-                    value = loopdef_val
-                elif not exp_val:
-                    if (isinstance(value, list) and not
-                            any(x or (x == loopdef_val) for x in value)):
-                        if not isinstance(loopdef_val, list) and maybe_list:
-                            if loopdef_val == '':
-                                value = []
+                if op:
+                    if exp_val and value != exp_val:
+                        value = loopdef_val
+                    elif not exp_val:
+                        if (isinstance(value, list) and not
+                                any(x or (x == loopdef_val) for x in value)):
+                            if (not isinstance(loopdef_val, list) and
+                                    maybe_list):
+                                if loopdef_val == '':
+                                    value = []
+                                else:
+                                    value = [loopdef_val]
                             else:
-                                value = [loopdef_val]
-                        else:
+                                value = loopdef_val
+                        elif not value:
                             value = loopdef_val
-                    elif not value:
-                        value = loopdef_val
 
-            # Handle any operation on string
-            rval = rval.strip()
-            rval1 = re.split(r"([+/*-])", rval)
-            if len(rval1) > 1:
-                iop = rval1[1]
-                if value is not None:
-                    if rval1[0] in x:
-                        value = eval_expr(f'{value}{iop}{x[rval1[0]]}')
-                    else:
-                        value = eval_expr(f'{value}{iop}{rval1[2]}')
-                try:
-                    x.update({rval1[0]: value})
-                except ValueError:
+                # Handle any operation on string
+                rval1 = spec.rval_op
+                if len(rval1) > 1:
+                    iop = rval1[1]
+                    if value is not None:
+                        if rval1[0] in x:
+                            value = eval_expr(f'{value}{iop}{x[rval1[0]]}')
+                        else:
+                            value = eval_expr(f'{value}{iop}{rval1[2]}')
                     x.update({rval1[0]: value})
-                continue
+                    continue
 
-            if (isinstance(value, str) and value.startswith('"') and
-                    value.endswith('"')):
-                # Strip leading and trailing quotes from string
-                x.update({rval: value[1:-1]})
-            else:
-                x.update({rval: value})
+                if (isinstance(value, str) and value.startswith('"') and
+                        value.endswith('"')):
+                    # Strip leading and trailing quotes from string
+                    x.update({rval: value[1:-1]})
+                else:
+                    x.update({rval: value})
+
+        return cleanup_and_return(result)
 
-    return cleanup_and_return(result)
+
+def compile_json_template(tmplt_str: str) -> JsonTemplate:
+    '''Compile the normalize template string for repeated use'''
+    return JsonTemplate(tmplt_str)
+
+
+def cons_recs_from_json_template(tmplt_str, in_data):
+    ''' Return an array of records given the template and input data.
+
+    This uses an XPATH-like template string to create a list of records
+    matching the template. It also normalizes the key fields so that we
+    can create records with keys that are agnostic of the source.
+
+    I could not use a ready-made library like jsonpath because of the
+    difficulty in handling normalization and how jsonpath returns the
+    result. For example, if I have 3 route records, one with 2 nexthop IPs,
+    one with a single nexthop IP and one without a nexthop IP, jsonpath
+    returns the data as a single flat list of nexthop IPs without a hint of
+    figuring out which route the nexthops correspond to. We also support
+    some amount of additional processing on the extracted fields such as
+    the basic 4 arithmetic operations and specifying a default or
+    substitute.
+
+    templates have a structure with a leading hierarchy traversal
+    followed by the fields for each record within that hierarchy.
+    One example is: vrfs/*:vrf/routes/*:prefix/[... where '[' marks
+    the start of the template to extract the values from the route
+    records (prefix) across all the VRFs(vrf). We break up this
+    processing into two parts, one before we reach  the inner record
+    (before '[') and the other after.
+
+    Before we enter the inner records, we flatten the hierarchy by
+    creating as many records as necessary with the container values
+    filled into each record as a separate key. So with the above
+    template, we transform the route records to carry the vrf and the
+    prefix as fields of each record. Thus, when we have 2 VRFs and 10
+    routes in the first VRF and 6 routes in the second VRF, before
+    we're done with the processing of the prefix hierarchy, the result
+    has 16 records (10+6 routes) with the VRF and prefix values contained
+    in each record.
+
+    We flatten because that is how pandas (and pyarrow) can process the
+    data best and queries can be made simple. The only nested structure
+    we allow is a list in the innermost fields. Thus, the list of nexthop
+    IP addresses associated with a route or the list of IP addresses
+    associated with an interface are allowed, but not a tuple consisting
+    of the nexthopIP and oif as a single entry.
+
+    The template can be the string or a template compiled via
+    compile_json_template, which avoids parsing the string every time.
+    '''
+    if isinstance(tmplt_str, JsonTemplate):
+        return tmplt_str.extract(in_data)
+    return JsonTemplate(tmplt_str).extract(in_data)
 
 
 def cleanup_and_return(result):
@@ -505,6 +588,12 @@ def eval_expr(expr):
     return num_eval(ast.parse(expr, mode='eval').body)
 
 
+@lru_cache(maxsize=None)
+def _eval_index(expr):
+    """eval_expr for the array indices in templates, cached as they're few"""
+    return eval_expr(expr)
+
+
 def num_eval(node):
     # supported arithmetic operators
     operators = {ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul,
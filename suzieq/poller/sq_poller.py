@@ -4,6 +4,8 @@ import sys
 import os
 import argparse
 from time import sleep
+import time
+import copy
 import asyncio
 import logging
 from pathlib import Path
@@ -13,18 +15,36 @@ from importlib.util import find_spec
 import fcntl
 import signal
 import errno
+from functools import partial
+import multiprocessing
 
 import uvloop
 
 from suzieq.poller.nodes import init_hosts, init_files
-from suzieq.poller.services import init_services
+from suzieq.poller.services import init_services, init_parser_pool
 
-from suzieq.poller.writer import init_output_workers, run_output_worker
+from suzieq.poller.writer import (init_output_workers, run_output_worker,
+                                  get_buffered_rows)
+from suzieq.poller.scheduler import PollScheduler
 from suzieq.utils import (load_sq_config, init_logger, ensure_single_instance,
                           get_sq_install_dir, get_log_params)
 
+# Backoff in secs before restarting a failed poller worker, doubled with
+# every failure of a worker that ran for less than WORKER_STABLE_TIME secs
+WORKER_MIN_BACKOFF = 5
+WORKER_MAX_BACKOFF = 300
+WORKER_STABLE_TIME = 600
+# Secs to wait for a worker to terminate before killing it
+WORKER_TERM_TIMEOUT = 30
+
+# Set once the poller's asked to terminate, to tell a worker shutting down
+# apart from one that died
+shutdown_requested = False
+
 
 async def process_signal(signum, loop):
+    global shutdown_requested
+    shutdown_requested = True
     tasks = [t for t in asyncio.all_tasks() if t is not
              asyncio.current_task()]
 
@@ -148,6 +168,10 @@ async def start_poller(userargs, cfg):
 
     logfile, loglevel, logsize = get_log_params(
         'poller', cfg, '/tmp/sq-poller.log')
+    worker_id = getattr(userargs, 'worker_id', 0)
+    num_workers = getattr(userargs, 'num_workers', 1)
+    if num_workers > 1:
+        logfile = get_worker_logfile(logfile, worker_id)
     logger = init_logger('suzieq.poller', logfile, loglevel, logsize, False)
 
     if userargs.devices_file and userargs.namespace:
@@ -185,6 +209,13 @@ async def start_poller(userargs, cfg):
 
     if "parquet" in userargs.outputs:
         validate_parquet_args(cfg, output_args, logger)
+        poller_cfg = cfg.get('poller', {})
+        output_args.update({
+            'buffer_age': poller_cfg.get('write-buffer-age', 0),
+            'buffer_rows': poller_cfg.get('write-buffer-rows', 0),
+            'buffer_bytes': poller_cfg.get('write-buffer-bytes', 0),
+            'pool_type': poller_cfg.get('writer-pool-type', 'thread'),
+            'pool_size': poller_cfg.get('writer-pool-size', 0)})
 
     if userargs.run_once:
         userargs.outputs = ["gather"]
@@ -220,6 +251,8 @@ async def start_poller(userargs, cfg):
         sys.exit(1)
 
     connect_timeout = cfg.get('poller', {}).get('connect-timeout', 15)
+    max_concurrency = cfg.get('poller', {}).get('max-node-concurrency', 8)
+    shell_devtypes = cfg.get('poller', {}).get('ssh-shell-devtypes', [])
     if userargs.input_dir:
         tasks.append(init_files(userargs.input_dir))
     else:
@@ -231,8 +264,12 @@ async def start_poller(userargs, cfg):
                                 jump_host_key_file=userargs.jump_host_key_file,
                                 password=userargs.ask_pass,
                                 connect_timeout=connect_timeout,
+                                max_concurrency=max_concurrency,
+                                shell_devtypes=shell_devtypes,
                                 ssh_config_file=userargs.ssh_config_file,
-                                ignore_known_hosts=ignore_known_hosts))
+                                ignore_known_hosts=ignore_known_hosts,
+                                worker_id=worker_id,
+                                num_workers=num_workers))
 
     period = cfg.get('poller', {}).get('period', 15)
 
@@ -253,8 +290,22 @@ async def start_poller(userargs, cfg):
                            'postq': nodes[x].post_commands}
                        for x in nodes})
 
+    poller_cfg = cfg.get('poller', {})
+    if userargs.run_once or userargs.input_dir:
+        scheduler = None
+    else:
+        scheduler = PollScheduler(poller_cfg.get('max-inflight', 0),
+                                  poller_cfg.get('poll-jitter', 0.1))
+
     for svc in svcs:
         svc.set_nodes(node_callq)
+        svc.writer_bufsize_cb = partial(get_buffered_rows, outputs)
+        svc.poller_worker = worker_id
+        svc.scheduler = scheduler
+
+    parser_pool = init_parser_pool(svcs,
+                                   poller_cfg.get('parser-pool-size', 0),
+                                   poller_cfg.get('parser-pool-services', []))
 
     logger.setLevel(logging.INFO)
     logger.info("Suzieq Started")
@@ -290,10 +341,138 @@ async def start_poller(userargs, cfg):
                 break
     finally:
         logger.warning("sq-poller: Received terminate signal. Terminating")
+        # Don't lose the data still buffered by the writer
+        for worker in outputs:
+            worker.close()
+        if parser_pool:
+            parser_pool.shutdown(wait=True)
         loop.stop()
         return
 
 
+def get_worker_logfile(logfile: str, worker_id: int) -> str:
+    """Return the log file of a poller worker, the logfile suffixed by id"""
+    base, ext = os.path.splitext(logfile)
+    return f'{base}-{worker_id}{ext}'
+
+
+def run_poller_worker(userargs, cfg: dict, worker_id: int,
+                      num_workers: int) -> None:
+    """Run a poller worker, polling its share of the devices
+
+    This is the entry point of the worker processes forked by the
+    supervisor. Only the first worker runs the coalescer. The worker exits
+    with a non-zero code for the supervisor to restart it, unless it was
+    asked to terminate.
+    """
+    # Replace the supervisor's signal handling, and undo its logging
+    def sig_handler(signum, frame):
+        global shutdown_requested
+        shutdown_requested = True
+        raise KeyboardInterrupt
+
+    for s in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(s, sig_handler)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    userargs = copy.copy(userargs)
+    userargs.worker_id = worker_id
+    userargs.num_workers = num_workers
+    if worker_id:
+        userargs.no_coalescer = True
+
+    try:
+        asyncio.run(start_poller(userargs, cfg))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError:
+        # Stopping the loop on termination ends asyncio.run this way
+        if not shutdown_requested:
+            logging.getLogger('suzieq.poller').exception(
+                f'Poller worker {worker_id} failed')
+            sys.exit(1)
+
+    sys.exit(0)
+
+
+def run_poller_supervisor(userargs, cfg: dict, num_workers: int) -> None:
+    """Split the devices across poller worker processes and monitor them
+
+    Every worker has its own event loop and writer, and polls the devices
+    assigned to it by get_worker_for_host. A worker that dies is restarted
+    after a backoff that doubles with every failure in quick succession.
+    A worker that exits normally, for example because it had no devices
+    assigned, is not restarted.
+
+    :param userargs: the parsed poller arguments
+    :param cfg: dict, the Suzieq config
+    :param num_workers: int, the number of workers to start
+    """
+    logfile, loglevel, logsize = get_log_params(
+        'poller', cfg, '/tmp/sq-poller.log')
+    logger = init_logger('suzieq.poller', logfile, loglevel, logsize, False)
+
+    terminate = False
+
+    def sig_handler(signum, frame):
+        nonlocal terminate
+        terminate = True
+
+    for s in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(s, sig_handler)
+
+    # The workers are forked to inherit the arguments, passwords included
+    ctx = multiprocessing.get_context('fork')
+    workers = [None]*num_workers
+    start_times = [0]*num_workers
+    restart_at = [0]*num_workers
+    restarts = [0]*num_workers
+    done = set()
+
+    logger.warning(f'Starting {num_workers} poller workers')
+    while not terminate and len(done) < num_workers:
+        now = time.time()
+        for i, proc in enumerate(workers):
+            if i in done or (proc and proc.is_alive()):
+                continue
+            if proc:
+                workers[i] = None
+                if proc.exitcode == 0:
+                    logger.warning(f'Poller worker {i} finished')
+                    done.add(i)
+                    continue
+                if now - start_times[i] > WORKER_STABLE_TIME:
+                    restarts[i] = 0
+                restarts[i] += 1
+                backoff = min(WORKER_MAX_BACKOFF,
+                              WORKER_MIN_BACKOFF * 2**(restarts[i]-1))
+                restart_at[i] = now + backoff
+                logger.error(f'Poller worker {i} exited with '
+                             f'{proc.exitcode}, restarting in {backoff}s')
+                continue
+            if now < restart_at[i]:
+                continue
+            workers[i] = ctx.Process(target=run_poller_worker,
+                                     name=f'sq-poller-{i}',
+                                     args=(userargs, cfg, i, num_workers))
+            workers[i].start()
+            start_times[i] = now
+            logger.info(f'Started poller worker {i}, pid {workers[i].pid}')
+        sleep(1)
+
+    logger.warning("sq-poller: Received terminate signal. Terminating")
+    for proc in workers:
+        if proc and proc.is_alive():
+            proc.terminate()
+    for proc in workers:
+        if proc:
+            proc.join(WORKER_TERM_TIMEOUT)
+            if proc.is_alive():
+                proc.kill()
+
+
 def poller_main() -> None:
 
     supported_outputs = ["parquet"]
@@ -420,6 +599,14 @@ def poller_main() -> None:
         help="Path to ssh config file to use. If not set, config file is not used"
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of poller processes to split the devices across",
+    )
+
     parser.add_argument(
         "--no-coalescer",
         default=False,
@@ -455,6 +642,15 @@ def poller_main() -> None:
         print("Could not load config file, aborting")
         sys.exit(1)
 
+    num_workers = userargs.workers or cfg.get('poller', {}) \
+        .get('workers', 1)
+    if num_workers > 1 and (userargs.run_once or userargs.input_dir):
+        print('WARNING: Ignoring workers with run-once or input-dir')
+        num_workers = 1
+    if num_workers > 1:
+        run_poller_supervisor(userargs, cfg, num_workers)
+        sys.exit(0)
+
     try:
         asyncio.run(start_poller(userargs, cfg))
     except (KeyboardInterrupt, RuntimeError):
@@ -1,11 +1,78 @@
 import os
+import time
 import logging
 import asyncio
+from uuid import uuid4
+from typing import List
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 
+from suzieq.db.parquet.pq_manifest import (SqParquetManifest,
+                                           get_manifest_entries)
+from suzieq.db.parquet.pq_latest import SqLatestSnapshot
+
+# How often the writer checks for buffers to flush when idle, in secs
+WRITER_FLUSH_CHECK_INTERVAL = 1
+
+
+class RecordBatchBuilder(object):
+    '''Builds an Arrow record batch from records, column by column
+
+    The records are appended into a list per column of the schema, and the
+    columns converted into typed Arrow arrays when the batch is built. This
+    skips building a pandas dataframe just to convert it to Arrow. Fields of
+    a record not in the schema are ignored, and missing ones are null.
+    '''
+
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+        self._columns = {x: [] for x in schema.names}
+        self.num_rows = 0
+
+    def append(self, record: dict) -> None:
+        """Append a single record"""
+        for name, col in self._columns.items():
+            col.append(record.get(name, None))
+        self.num_rows += 1
+
+    def extend(self, records: List[dict]) -> None:
+        """Append a list of records"""
+        for name, col in self._columns.items():
+            col.extend([x.get(name, None) for x in records])
+        self.num_rows += len(records)
+
+    def build(self) -> pa.RecordBatch:
+        """Return the record batch of all the records appended
+
+        :returns: the records as a record batch with the builder's schema
+        :rtype: pa.RecordBatch
+        """
+        arrays = []
+        for fld in self.schema:
+            col = self._columns[fld.name]
+            try:
+                # from_pandas treats NaN as null, as the dataframe path did
+                arr = pa.array(col, type=fld.type, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Such as integral floats in an int column, which a safe
+                # cast handles
+                arr = pa.array(col, from_pandas=True).cast(fld.type)
+            arrays.append(arr)
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+@dataclass
+class WriteBuffer:
+    data: dict                  # first queued item, for topic, schema etc.
+    start_time: float           # when the first item was buffered
+    tables: List[pa.Table] = field(default_factory=list)
+    rows: int = 0
+    nbytes: int = 0
+
 
 class OutputWorker(object):
 
@@ -27,20 +94,65 @@ class OutputWorker(object):
     def write_data(self, data):
         raise NotImplementedError
 
+    def flush(self, force: bool = False):
+        """Write out buffered data, all of it if force is True"""
+        return
+
+    def get_buffered_rows(self, topic: str, namespace: str,
+                          hostname: str) -> int:
+        """Return the number of rows buffered for the node's topic"""
+        return 0
+
+    async def wait_pending(self):
+        """Wait for writes in progress, if too many, to complete"""
+        return
+
+    def close(self):
+        """Write out everything pending, called at termination"""
+        self.flush(force=True)
+
 
 class ParquetOutputWorker(OutputWorker):
+    """Write the records out as parquet files
 
-    def write_data(self, data):
-        cdir = "{}/{}/".format(self.root_output_dir, data["topic"])
-        if not os.path.isdir(cdir):
-            os.makedirs(cdir)
+    If a buffer age is specified, the records of each topic, namespace and
+    hostname are accumulated and written out as a single file once the oldest
+    buffered record is older than the buffer age, or the buffer grows beyond
+    the row count or size limits. Without a buffer age, every queued item is
+    written out as a file as soon as it arrives.
 
-        # dtypes = {x: data['schema'].field(x).type.__str__()
-        #           if 'list' not in data['schema'].field(x).type.__str__()
-        #           else data['schema'].field(x).type.to_pandas_dtype()
-        #           for x in data['schema'].names}
+    If a pool size is specified, the files are written out by a pool of
+    threads or processes instead of inline in the poller's event loop.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.buffer_age = kwargs.get('buffer_age', 0) or 0
+        self.buffer_rows = kwargs.get('buffer_rows', 0) or 100000
+        self.buffer_bytes = kwargs.get('buffer_bytes', 0) or 64*1024*1024
+        self._buffers = {}
+
+        # Compression and writing the files out can be handed off to a pool
+        # of threads or processes to keep the poller's event loop free.
+        pool_size = kwargs.get('pool_size', 0) or 0
+        if not pool_size:
+            self.executor = None
+        elif kwargs.get('pool_type', 'thread') == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=pool_size)
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=pool_size, thread_name_prefix='sq-writer')
+        # Number of writes in progress beyond which we stop dequeuing
+        self.max_pending = 2*pool_size
+        self._pending = set()
+
+    def write_data(self, data):
+        records = data["records"]
+        if isinstance(records, pa.RecordBatch):
+            self._write_table(data, pa.Table.from_batches([records]))
+            return
 
-        df = pd.DataFrame.from_dict(data["records"])
+        df = pd.DataFrame.from_dict(records)
         # df.to_parquet(
         #     path=cdir,
         #     partition_cols=data['partition_cols'],
@@ -53,15 +165,114 @@ class ParquetOutputWorker(OutputWorker):
 
         table = pa.Table.from_pandas(df, schema=data["schema"],
                                      preserve_index=False)
+        self._write_table(data, table)
+
+    def _write_table(self, data: dict, table: pa.Table):
+        if not self.buffer_age:
+            self._write_out_table(data, table)
+            return
+
+        if 'namespace' in data:
+            key = (data['topic'], data['namespace'], data['hostname'])
+        else:
+            key = (data['topic'], data['records'][0].get('namespace', ''),
+                   data['records'][0].get('hostname', ''))
+        buf = self._buffers.get(key, None)
+        if not buf:
+            buf = self._buffers[key] = WriteBuffer(data, time.time())
+        buf.tables.append(table)
+        buf.rows += table.num_rows
+        buf.nbytes += table.nbytes
+
+        if buf.rows >= self.buffer_rows or buf.nbytes >= self.buffer_bytes:
+            self._flush_buffer(key)
+
+    def flush(self, force: bool = False):
+        now = time.time()
+        for key in list(self._buffers.keys()):
+            if force or (now - self._buffers[key].start_time >=
+                         self.buffer_age):
+                self._flush_buffer(key)
+
+    def get_buffered_rows(self, topic: str, namespace: str,
+                          hostname: str) -> int:
+        buf = self._buffers.get((topic, namespace, hostname), None)
+        return buf.rows if buf else 0
+
+    def _flush_buffer(self, key: tuple):
+        buf = self._buffers.pop(key)
+        if len(buf.tables) > 1:
+            table = pa.concat_tables(buf.tables)
+        else:
+            table = buf.tables[0]
+        self._write_out_table(buf.data, table)
+
+    def _write_out_table(self, data: dict, table: pa.Table):
+        # Only pass on what's needed to write, the records are in the table
+        meta = {x: data.get(x, None)
+                for x in ['topic', 'schema', 'partition_cols', 'key_fields']}
+        if not self.executor:
+            write_parquet_table(self.root_output_dir, meta, table)
+            return
 
-        pq.write_to_dataset(
-            table,
-            root_path=cdir,
-            partition_cols=data['partition_cols'],
-            version="2.0",
-            compression='ZSTD',
-            row_group_size=100000,
-        )
+        fut = asyncio.get_event_loop().run_in_executor(
+            self.executor, write_parquet_table, self.root_output_dir, meta,
+            table)
+        self._pending.add(fut)
+        fut.add_done_callback(self._write_done)
+
+    def _write_done(self, fut: asyncio.Future):
+        self._pending.discard(fut)
+        if not fut.cancelled() and fut.exception():
+            self.logger.error(f'Writing data failed: {fut.exception()}')
+
+    async def wait_pending(self):
+        """Block till the number of writes in progress is within limits"""
+        while self._pending and len(self._pending) >= self.max_pending:
+            await asyncio.wait(self._pending,
+                               return_when=asyncio.FIRST_COMPLETED)
+
+    def close(self):
+        self.flush(force=True)
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def write_parquet_table(root_output_dir: str, data: dict,
+                        table: pa.Table) -> None:
+    """Write the table out as parquet, updating the manifest & snapshot
+
+    This is run in the writer pool if one is configured, and so must not
+    depend on any state of the writer object.
+
+    :param root_output_dir: str, the root of the parquet data directory
+    :param data: dict, the topic, schema, partition_cols & key_fields
+    :param table: pa.Table, the data to write
+    """
+    logger = logging.getLogger(__name__)
+    cdir = "{}/{}/".format(root_output_dir, data["topic"])
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir, exist_ok=True)
+
+    # We name the file ourselves to be able to record it in the manifest
+    fname = f'{uuid4().hex}.parquet'
+    entries = get_manifest_entries(table, data['partition_cols'],
+                                   lambda keys: fname)
+    pq.write_to_dataset(
+        table,
+        root_path=cdir,
+        partition_cols=data['partition_cols'],
+        version="2.0",
+        compression='ZSTD',
+        row_group_size=100000,
+        partition_filename_cb=lambda keys: fname,
+    )
+    SqParquetManifest(cdir, logger).add_files(entries)
+
+    if data.get('key_fields'):
+        SqLatestSnapshot(cdir, logger).merge(table, data['key_fields'],
+                                             data['schema'])
 
 
 class GatherOutputWorker(OutputWorker):
@@ -74,20 +285,42 @@ class GatherOutputWorker(OutputWorker):
             f.write(data['records'])
 
 
+def get_buffered_rows(output_workers: List[OutputWorker], topic: str,
+                      namespace: str, hostname: str) -> int:
+    """Return the rows waiting to be written for a node's topic"""
+    return sum(x.get_buffered_rows(topic, namespace, hostname)
+               for x in output_workers)
+
+
 async def run_output_worker(queue, output_workers, logger):
 
+    last_flush = time.time()
     while True:
         try:
-            data = await queue.get()
+            data = await asyncio.wait_for(queue.get(),
+                                          WRITER_FLUSH_CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            data = None
         except asyncio.CancelledError:
             logger.error(f"Writer thread received task cancel")
+            for worker in output_workers:
+                worker.close()
             return
 
         if not output_workers:
             return
 
-        for worker in output_workers:
-            worker.write_data(data)
+        if data:
+            for worker in output_workers:
+                worker.write_data(data)
+                # Backpressure if the writer pool can't keep up
+                await worker.wait_pending()
+
+        # Write out the buffers that have aged enough
+        if time.time() - last_flush >= WRITER_FLUSH_CHECK_INTERVAL:
+            for worker in output_workers:
+                worker.flush()
+            last_flush = time.time()
 
 
 def init_output_workers(output_types, output_args):
@@ -96,7 +329,13 @@ def init_output_workers(output_types, output_args):
     workers = []
     for otype in output_types:
         if otype == "parquet":
-            worker = ParquetOutputWorker(output_dir=output_args["output_dir"])
+            worker = ParquetOutputWorker(
+                output_dir=output_args["output_dir"],
+                buffer_age=output_args.get("buffer_age", 0),
+                buffer_rows=output_args.get("buffer_rows", 0),
+                buffer_bytes=output_args.get("buffer_bytes", 0),
+                pool_type=output_args.get("pool_type", "thread"),
+                pool_size=output_args.get("pool_size", 0))
             if worker:
                 workers.append(worker)
         elif otype == "gather":
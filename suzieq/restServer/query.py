@@ -14,7 +14,8 @@ import logging
 import uvicorn
 
 from suzieq.sqobjects import *
-from suzieq.utils import (load_sq_config, get_sq_install_dir, get_log_params,
+from suzieq.sqobjects.basicobj import SqContext
+from suzieq.utils import (get_sq_install_dir, get_log_params,
                           sq_get_config_file)
 
 API_KEY_NAME = 'access_token'
@@ -42,12 +43,38 @@ def app_init(cfg_file):
     global app
 
     app.cfg_file = cfg_file
+    # The context with the config and schemas is loaded once and shared by
+    # all requests. Its reloaded if the config file changes.
+    app.sqcontext = None
+    app.cfg_mtime = None
 
     return app
 
 
+def _get_cfg_mtime():
+    try:
+        return os.stat(app.cfg_file).st_mtime_ns
+    except OSError:
+        return None
+
+
+def reload_app_context() -> SqContext:
+    '''Load the config and schemas afresh into the shared context'''
+    app.cfg_mtime = _get_cfg_mtime()
+    app.sqcontext = SqContext('pandas', config_file=app.cfg_file)
+    return app.sqcontext
+
+
+def get_app_context() -> SqContext:
+    '''Return the context shared by all requests'''
+    if (getattr(app, 'sqcontext', None) is None or
+            _get_cfg_mtime() != app.cfg_mtime):
+        return reload_app_context()
+    return app.sqcontext
+
+
 def get_configured_api_key():
-    cfg = load_sq_config(config_file=app.cfg_file)
+    cfg = get_app_context().cfg
     try:
         api_key = cfg['rest']['API_KEY']
     except KeyError:
@@ -143,7 +170,8 @@ def rest_main(*args) -> None:
 
     config_file = sq_get_config_file(userargs.config)
     app = app_init(config_file)
-    cfg = load_sq_config(config_file=config_file)
+    # Preload the context shared by all requests
+    cfg = get_app_context().cfg
     try:
         api_key = cfg['rest']['API_KEY']
     except KeyError:
@@ -201,6 +229,7 @@ class RouteVerbs(str, Enum):
 class PathVerbs(str, Enum):
     show = "show"
     summarize = "summarize"
+    bulk = "bulk"
 
 
 class TableVerbs(str, Enum):
@@ -265,6 +294,7 @@ async def query_address(verb: CommonVerbs, request: Request,
                         address: List[str] = Query(None),
                         ipvers: str = None,
                         vrf: str = None, query_str: str = None,
+                        prefix: List[str] = Query(None),
                         ):
     function_name = inspect.currentframe().f_code.co_name
     return read_shared(function_name, verb, request, locals())
@@ -481,8 +511,9 @@ async def query_path(verb: PathVerbs, request: Request,
                      namespace: List[str] = Query(None),
                      columns: List[str] = Query(default=["default"]),
                      vrf: str = None,
-                     dest: str = None,
-                     source: str = Query(None, alias="src")
+                     dest: List[str] = Query(None),
+                     source: List[str] = Query(None, alias="src"),
+                     pairs: List[str] = Query(None)
                      ):
     function_name = inspect.currentframe().f_code.co_name
     return read_shared(function_name, verb, request, locals())
@@ -562,6 +593,16 @@ async def query_vlan(verb: CommonVerbs, request: Request,
     return read_shared(function_name, verb, request, locals())
 
 
+@ app.post("/api/v2/reload")
+async def reload_config(token: str = Depends(get_api_key)):
+    """Reload the config file and schemas used to serve requests"""
+    try:
+        reload_app_context()
+    except Exception as err:
+        return_error(500, f"unable to reload config: {err}")
+    return {'status': 'ok'}
+
+
 @ app.get("/api/v2/table/{verb}")
 async def query_table(verb: TableVerbs, request: Request,
                       token: str = Depends(get_api_key),
@@ -599,6 +640,8 @@ def create_filters(function_name, command, request, local_vars):
     all_cmd_args = ['namespace', 'hostname',
                     'start_time', 'end_time', 'view', 'columns']
     both_verb_and_command = ['namespace', 'hostname', ]
+    # Query params whose name differs from the arg they're read into
+    alias_args = {'src': 'source'}
 
     query_ks = request.query_params
     for arg in query_ks.keys():
@@ -611,6 +654,7 @@ def create_filters(function_name, command, request, local_vars):
                     verb_args[arg] = command_args[arg]
         else:
             if query_ks.get(arg) is not None:
+                arg = alias_args.get(arg, arg)
                 verb_args[arg] = local_vars.get(arg, None)
 
     return command_args, verb_args
@@ -677,7 +721,7 @@ def run_command_verb(command, verb, command_args, verb_args, columns=['default']
     """
     svc = get_svc(command)
     try:
-        svc_inst = svc(**command_args, config_file=app.cfg_file)
+        svc_inst = svc(**command_args, context=get_app_context())
         df = getattr(svc_inst, verb)(**verb_args)
 
     except AttributeError as err:
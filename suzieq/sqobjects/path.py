@@ -1,3 +1,5 @@
+from itertools import product
+
 from pandas import DataFrame
 from suzieq.sqobjects.basicobj import SqObject
 
@@ -8,6 +10,12 @@ class PathObj(SqObject):
         self._valid_get_args = ['namespace', 'hostname', 'columns',
                                 'vrf', 'source', 'dest']
 
+    def get(self, **kwargs) -> DataFrame:
+        for arg in ['source', 'dest']:
+            if arg in kwargs:
+                kwargs[arg] = self._get_one_addr(kwargs[arg])
+        return super().get(**kwargs)
+
     def summarize(self, namespace=[], hostname=[], source='',
                   dest='', vrf='', query_str='') -> DataFrame():
         """Path summarize, different because of the params
@@ -30,5 +38,68 @@ class PathObj(SqObject):
         if not self.ctxt.engine:
             raise AttributeError('No analysis engine specified')
 
-        return self.engine.summarize(namespace=namespace, source=source,
-                                     dest=dest, vrf=vrf, query_str=query_str)
+        return self.engine.summarize(namespace=namespace,
+                                     source=self._get_one_addr(source),
+                                     dest=self._get_one_addr(dest),
+                                     vrf=vrf, query_str=query_str)
+
+    def bulk(self, namespace=[], hostname=[], source=[], dest=[], pairs=[],
+             vrf='', workers=1) -> DataFrame:
+        """Paths between many sources and dests in one go
+
+        The paths are computed between each of the pairs, or if no pairs are
+        given, between every source and every dest other than itself.
+
+        :param namespace: List[str], can really only be a single namespace
+        :param hostname: List[str], ignored for now
+        :param source: List[str], Source IP addresses
+        :param dest: List[str], Dest IP addresses
+        :param pairs: List[str], "source,dest" IP address pairs
+        :param vrf: str, VRF within which to run the paths
+        :param workers: int, number of processes to compute the paths in
+        :returns: Pandas dataframe, the paths with their source and dest
+        """
+        if not self._table:
+            raise NotImplementedError
+
+        if not self.ctxt.engine:
+            raise AttributeError('No analysis engine specified')
+
+        namespace = namespace or self.ctxt.namespace
+        if not namespace:
+            raise AttributeError('Must specify namespace to run the trace in')
+        if isinstance(namespace, list):
+            namespace = namespace[0]
+
+        if pairs:
+            if isinstance(pairs, str):
+                pairs = pairs.split()
+            try:
+                pairs = [tuple(x.split(',')) if isinstance(x, str) else x
+                         for x in pairs]
+                pairs = [(src.strip(), dst.strip()) for src, dst in pairs]
+            except ValueError:
+                raise AttributeError('Pairs must be of the form source,dest')
+        else:
+            if isinstance(source, str):
+                source = source.split()
+            if isinstance(dest, str):
+                dest = dest.split()
+            if not source or not dest:
+                raise AttributeError(
+                    'Must specify trace source and dest, or pairs')
+            pairs = [(src, dst) for src, dst in product(source, dest)
+                     if src != dst]
+
+        return self.engine.trace_pairs(namespace, pairs, vrf=vrf,
+                                       workers=int(workers or 1))
+
+    @staticmethod
+    def _get_one_addr(addr):
+        """The REST API passes addresses as lists, for bulk paths"""
+        if not isinstance(addr, list):
+            return addr
+        if len(addr) > 1:
+            raise AttributeError(
+                'Use bulk to trace paths between many sources and dests')
+        return addr[0] if addr else None
@@ -11,13 +11,16 @@ class RoutesObj(SqObject):
                                 'add_filter', 'address', 'query_str']
 
     def lpm(self, **kwargs):
-        '''Get the lpm for the given address'''
+        '''Get the lpm for the given address(es)
+
+        With a list of more than one address, the matches for all of them
+        are returned along with the address column to identify the match.
+        '''
         if not kwargs.get("address", None):
             raise AttributeError('ip address is mandatory parameter')
         if isinstance(kwargs['address'], list):
-            if len(kwargs['address']) > 1:
-                raise AttributeError('Just one address at a time')
-            kwargs['address'] = kwargs['address'][0]
+            if len(kwargs['address']) == 1:
+                kwargs['address'] = kwargs['address'][0]
         return self.engine.lpm(**kwargs)
 
     def summarize(self, namespace=[], vrf=[], hostname=[], query_str=''):
@@ -0,0 +1,87 @@
+from ipaddress import ip_address, ip_interface, ip_network
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from suzieq.engines.pandas.addr_index import AddrIndex
+
+
+def _get_if_df() -> pd.DataFrame:
+    '''Return a small address table'''
+    ifaces = [
+        ('leaf01', 'lo', ['10.0.0.11/32'], ['2001:db8::11/128'],
+         '44:38:39:00:00:01'),
+        ('leaf01', 'swp1', ['10.1.1.1/24', '10.1.2.1/24'],
+         ['2001:db8:0:1::1/64'], '44:38:39:00:00:02'),
+        ('leaf02', 'swp1', ['10.1.1.2/24'], [], '44:38:39:00:00:03'),
+        ('leaf02', 'vlan13', ['10.1.1.1/24'], ['fe80::1/64'],
+         '44:39:39:ff:00:13'),
+        ('spine01', 'swp1', [], ['fe80::1/64'], '44:38:39:00:00:04'),
+        ('spine01', 'eth0', ['junk'], [], None),
+    ]
+    df = pd.DataFrame(ifaces, columns=['hostname', 'ifname', 'ipAddressList',
+                                       'ip6AddressList', 'macaddr'])
+    df['ipAddressList'] = df.ipAddressList.apply(np.array)
+    df['ip6AddressList'] = df.ip6AddressList.apply(np.array)
+    return df
+
+
+def _brute_force(df: pd.DataFrame, match_fn) -> set:
+    '''Return the (hostname, ifname) with an address matching the fn'''
+    rslt = set()
+    for row in df.itertuples():
+        for addr in row.ipAddressList.tolist() + row.ip6AddressList.tolist():
+            try:
+                if match_fn(ip_interface(addr)):
+                    rslt.add((row.hostname, row.ifname))
+            except ValueError:
+                continue
+    return rslt
+
+
+@pytest.mark.engines
+def test_addr_index_lookup():
+    '''The address index must match a brute force lookup'''
+    df = _get_if_df()
+    index = AddrIndex(df)
+
+    addresses = ['10.1.1.1', '10.0.0.11/32', '10.0.0.11/24', '10.9.9.9',
+                 'fe80::1', '2001:db8:0:1::1']
+    rslt = index.find(addresses)
+    for addr in addresses:
+        got = set((x.hostname, x.ifname)
+                  for x in rslt.query(f'address == "{addr}"').itertuples())
+        if '/' in addr:
+            exp = _brute_force(df, lambda x: x == ip_interface(addr))
+        else:
+            exp = _brute_force(df, lambda x: x.ip == ip_address(addr))
+        assert got == exp, addr
+
+    # MAC addresses, in any format, in the same lookup
+    match = index.lookup(['4439.39ff.0013', '10.1.1.2', '44:38:39:00:00:01'])
+    assert match.addrIdx.tolist() == [0, 1, 2]
+    assert match.row.tolist() == [3, 2, 0]
+    assert match.entry.tolist() == ['44:39:39:ff:00:13', '10.1.1.2/24',
+                                    '44:38:39:00:00:01']
+
+
+@pytest.mark.engines
+def test_addr_index_within():
+    '''Addresses within prefixes must match a brute force lookup'''
+    df = _get_if_df()
+    index = AddrIndex(df)
+
+    prefixes = ['10.0.0.0/8', '10.1.1.0/25', '10.1.2.0/24', '10.0.0.11',
+                '0.0.0.0/0', '2001:db8::/32', 'fe80::/10', '192.168.0.0/16']
+    rslt = index.find_within(prefixes)
+    for pfx in prefixes:
+        net = ip_network(pfx)
+        got = set((x.hostname, x.ifname)
+                  for x in rslt.query(f'prefix == "{pfx}"').itertuples())
+        exp = _brute_force(df, lambda x: (x.version == net.version and
+                                          x.ip in net))
+        assert got == exp, pfx
+
+    assert index.lookup_within(['junk']).empty
+    assert AddrIndex(df.iloc[0:0]).lookup(['10.0.0.11']).empty
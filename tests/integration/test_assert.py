@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from suzieq.engines.pandas.engineobj import SqAssertChecks
+
+
+def _get_checks() -> SqAssertChecks:
+    '''Return checks on a small BGP like dataframe'''
+    df = pd.DataFrame({
+        'hostname': ['leaf01', 'leaf02', 'spine01', 'spine02'],
+        'state': ['Established', 'NotEstd', 'NotEstd', 'Established'],
+        'reason': ['', 'Hold timer expired', '', ''],
+        'afisAdvOnly': [np.array([]), np.array(['evpn']), np.array([]),
+                        np.array([''])],
+        'timestamp': [1, 2, 3, 4]}, index=[10, 11, 12, 13])
+
+    checks = SqAssertChecks(df)
+    checks.add((df.reason != '').to_numpy(), 'reason: ' + df.reason)
+    checks.add((df.state == 'NotEstd').to_numpy() & checks.passed,
+               'Matching BGP Peer not found')
+    checks.add(checks.any_in_list(df.afisAdvOnly),
+               'Not all Afi/Safis enabled')
+    return checks
+
+
+@pytest.mark.engines
+def test_assert_checks():
+    '''Verify the result of vectorized assert checks'''
+    columns = ['hostname', 'assert', 'assertReason', 'timestamp']
+
+    result = _get_checks().get_result(columns)
+    assert result.columns.tolist() == columns
+    assert result.index.tolist() == [10, 11, 11, 12, 13]
+    assert result.assertReason.tolist() == [
+        '-', 'reason: Hold timer expired', 'Not all Afi/Safis enabled',
+        'Matching BGP Peer not found', '-']
+    assert result['assert'].tolist() == ['pass', 'fail', 'fail', 'fail',
+                                         'pass']
+
+    result = _get_checks().get_result(columns, status='fail')
+    assert result.hostname.tolist() == ['leaf02', 'leaf02', 'spine01']
+
+    result = _get_checks().get_result(columns, status='pass')
+    assert result.hostname.tolist() == ['leaf01', 'spine02']
+    assert (result.assertReason == '-').all()
+
+    result = _get_checks().get_result(columns, explode=False)
+    assert result.assertReason.tolist() == [
+        [], ['reason: Hold timer expired', 'Not all Afi/Safis enabled'],
+        ['Matching BGP Peer not found'], []]
+
+    # No checks failed
+    checks = SqAssertChecks(pd.DataFrame({'hostname': ['leaf01']}))
+    checks.add(np.array([False]), 'never')
+    result = checks.get_result(['hostname', 'assert', 'assertReason'],
+                               status='fail')
+    assert result.empty
+
+
+@pytest.mark.engines
+def test_assert_checks_list():
+    '''Verify checks failing a row with a list of reasons'''
+    columns = ['hostname', 'assert', 'assertReason']
+    df = pd.DataFrame({'hostname': ['leaf01', 'leaf02', 'leaf03'],
+                       'state': ['up', 'down', 'up']})
+
+    checks = SqAssertChecks(df)
+    checks.add_list([2, 1, 2], ['10.0.0.1 not reachable',
+                                '10.0.0.2 not reachable',
+                                '10.0.0.3 reachable via default'])
+    checks.add((df.state == 'down').to_numpy(), 'interface is down')
+
+    result = checks.get_result(columns)
+    assert result.hostname.tolist() == ['leaf01', 'leaf02', 'leaf02',
+                                        'leaf03', 'leaf03']
+    assert result.assertReason.tolist() == [
+        '-', '10.0.0.2 not reachable', 'interface is down',
+        '10.0.0.1 not reachable', '10.0.0.3 reachable via default']
+
+    result = checks.get_result(columns, explode=False)
+    assert result.assertReason.tolist() == [
+        [], ['10.0.0.2 not reachable', 'interface is down'],
+        ['10.0.0.1 not reachable', '10.0.0.3 reachable via default']]
@@ -1,6 +1,8 @@
 import pytest
 import asyncio
 import os
+import tarfile
+from glob import glob
 from tests.conftest import create_dummy_config_file
 import yaml
 from tempfile import TemporaryDirectory, NamedTemporaryFile
@@ -187,6 +189,329 @@ def test_coalescer_bin(run_sequential):
     _coalescer_cleanup(temp_dir, tmpfile)
 
 
+@pytest.mark.coalesce
+def test_coalescer_manifest():
+    '''Verify the file manifest and latest snapshot are used consistently'''
+
+    temp_dir, tmpfile = _coalescer_init(
+        'tests/data/basic_dual_bgp/parquet-out')
+
+    from suzieq.sqobjects.tables import TablesObj
+
+    cfg = load_sq_config(config_file=tmpfile.name)
+    dbeng = get_sqdb_engine(cfg, 'routes', None, None)
+
+    # No manifest yet, reads walk the directories
+    assert(not dbeng.get_manifest('routes', False).is_complete())
+    pre_routes_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+
+    dbeng.update_manifest('routes')
+    manifest = dbeng.get_manifest('routes', False)
+    assert(manifest.is_complete())
+    mdf = manifest.get_files()
+    assert(mdf.shape[0] == len([x for x in mdf.path if os.path.exists(x)]))
+    assert(not manifest.get_files(hostname=['leaf01']).empty)
+    assert(manifest.get_files(hostname=['nosuchhost']).empty)
+
+    post_routes_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    assert_df_equal(pre_routes_df, post_routes_df, None)
+
+    pre_tables_df = TablesObj(config_file=tmpfile.name).get()
+    do_coalesce(cfg, None)
+    _verify_coalescing(temp_dir)
+
+    # Coalesced files must've been removed, and the coalesced ones added
+    assert(manifest.get_files().empty)
+    assert(not dbeng.get_manifest('routes', True).get_files().empty)
+
+    # The latest state is now served from the snapshot
+    assert(dbeng.get_latest_snapshot('routes').is_complete())
+    snap_routes_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    assert_df_equal(pre_routes_df, snap_routes_df, None)
+
+    post_tables_df = TablesObj(config_file=tmpfile.name).get()
+    assert_df_equal(pre_tables_df, post_tables_df, None)
+
+    _coalescer_cleanup(temp_dir, tmpfile)
+
+
+@pytest.mark.coalesce
+@pytest.mark.cumulus
+def test_coalescer_parallel():
+    '''Verify coalescing tables & namespaces in parallel loses nothing'''
+
+    temp_dir, tmpfile = _coalescer_init('tests/data/multidc/parquet-out')
+
+    from suzieq.sqobjects.tables import TablesObj
+
+    cfg = load_sq_config(config_file=tmpfile.name)
+    cfg.setdefault('coalescer', {})['workers'] = 4
+    pre_tables_df = TablesObj(config_file=tmpfile.name).get()
+    pre_bgp_df = get_sqobject('bgp')(config_file=tmpfile.name).get()
+
+    stats = do_coalesce(cfg, None)
+    _verify_coalescing(temp_dir)
+
+    assert(stats[0].service == 'sqPoller')
+    assert(len(set(x.service for x in stats)) == len(stats))
+    assert(sum(x.fileCount for x in stats))
+    # Every namespace of the table is coalesced by a separate task
+    assert(len(glob(f'{temp_dir.name}/coalesced/bgp/sqvers=*/namespace=*')) ==
+           pre_bgp_df.namespace.nunique())
+
+    post_tables_df = TablesObj(config_file=tmpfile.name).get()
+    assert_df_equal(pre_tables_df, post_tables_df, None)
+    post_bgp_df = get_sqobject('bgp')(config_file=tmpfile.name).get()
+    assert_df_equal(pre_bgp_df, post_bgp_df, None)
+
+    _coalescer_cleanup(temp_dir, tmpfile)
+
+
+@pytest.mark.coalesce
+def test_coalescer_file_timestamps():
+    '''Verify file timestamps from footers & manifest match the data'''
+
+    temp_dir, tmpfile = _coalescer_init(
+        'tests/data/basic_dual_bgp/parquet-out')
+
+    from suzieq.db.parquet.pq_coalesce import (get_file_timestamps,
+                                               find_broken_files)
+
+    cfg = load_sq_config(config_file=tmpfile.name)
+    dbeng = get_sqdb_engine(cfg, 'routes', None, None)
+    files = sorted(glob(f'{temp_dir.name}/routes/**/*.parquet',
+                        recursive=True))
+    assert(files)
+
+    expected = pd.DataFrame({
+        'file': files,
+        'timestamp': [pd.read_parquet(x, columns=['timestamp'])
+                      .timestamp.min() for x in files]})
+    expected['timestamp'] = humanize_timestamp(expected.timestamp, 'UTC')
+    expected = expected.sort_values(by=['timestamp'])
+
+    for manifest in [None, dbeng.get_manifest('routes', False)]:
+        if manifest:
+            dbeng.update_manifest('routes')
+        fdf = get_file_timestamps(files, manifest)
+        assert(sorted(fdf.file) == files)
+        assert((fdf.set_index('file').timestamp.sort_index() ==
+                expected.set_index('file').timestamp.sort_index()).all())
+
+    # Unreadable files are skipped, and found as broken
+    broken = f'{os.path.dirname(files[0])}/broken.parquet'
+    with open(broken, 'w') as f:
+        f.write('not a parquet file')
+    fdf = get_file_timestamps(files + [broken])
+    assert(broken not in fdf.file.tolist())
+    assert([os.path.basename(x) for x in
+            find_broken_files(f'{temp_dir.name}/routes')] ==
+           ['broken.parquet'])
+    assert(get_file_timestamps([]).empty)
+
+    _coalescer_cleanup(temp_dir, tmpfile)
+
+
+@pytest.mark.coalesce
+@pytest.mark.cumulus
+@pytest.mark.parametrize('table', ['routes', 'interfaces', 'macs'])
+def test_coalescer_streaming(table):
+    '''Verify streaming a namespace at a time matches coalescing in memory'''
+
+    rslts = []
+    for per_namespace in [False, True]:
+        temp_dir, tmpfile = _coalescer_init('tests/data/multidc/parquet-out')
+        cfg = load_sq_config(config_file=tmpfile.name)
+        dbeng = get_sqdb_engine(cfg, table, None, None)
+
+        poller_periods = set()
+        for tbl in ['sqPoller', table]:
+            dbeng.prepare_coalesce(tbl)
+            namespaces = dbeng._get_coalesce_namespaces(tbl) \
+                if per_namespace else ['']
+            periods = set()
+            for namespace in namespaces:
+                periods.update(dbeng.coalesce_table(
+                    tbl, namespace, '1h', poller_periods)[4])
+            if tbl == 'sqPoller':
+                poller_periods = periods
+
+        rslts.append(pd.read_parquet(f'{temp_dir.name}/coalesced/{table}'))
+        _coalescer_cleanup(temp_dir, tmpfile)
+
+    assert(not rslts[0].empty)
+    assert_df_equal(rslts[0], rslts[1], None)
+
+
+@pytest.mark.coalesce
+@pytest.mark.parametrize('mode', ['tar', 'tar.bz2', 'parquet', 'move'])
+def test_coalescer_archive_mode(mode):
+    '''Verify the coalesced files are archived as per the archive mode'''
+
+    temp_dir, tmpfile = _coalescer_init(
+        'tests/data/basic_dual_bgp/parquet-out')
+
+    cfg = load_sq_config(config_file=tmpfile.name)
+    cfg.setdefault('coalescer', {})['archive-mode'] = mode
+    in_files = glob(f'{temp_dir.name}/routes/sqvers=*/**/*.parquet',
+                    recursive=True)
+    in_rows = sum(pd.read_parquet(x, columns=['timestamp']).shape[0]
+                  for x in in_files)
+    assert(in_files)
+
+    do_coalesce(cfg, None)
+    _verify_coalescing(temp_dir)
+
+    # The archived files are gone, and aren't left in the staging dir
+    assert(not any(os.path.exists(x) for x in in_files))
+    assert(not glob(f'{temp_dir.name}/routes/_archiving/*'))
+
+    archive_dir = f'{temp_dir.name}/_archived/routes'
+    if mode == 'move':
+        archived = glob(f'{archive_dir}/*/sqvers=*/**/*.parquet',
+                        recursive=True)
+        assert(sorted(os.path.basename(x) for x in archived) ==
+               sorted(os.path.basename(x) for x in in_files))
+    elif mode == 'parquet':
+        archived = glob(f'{archive_dir}/_archive-*.parquet')
+        assert(sum(pd.read_parquet(x).shape[0] for x in archived) ==
+               in_rows)
+    else:
+        archived = glob(f'{archive_dir}/_archive-*.{mode}')
+        names = []
+        for archive in archived:
+            with tarfile.open(archive) as f:
+                names.extend(os.path.basename(x) for x in f.getnames())
+        assert(sorted(names) ==
+               sorted(os.path.basename(x) for x in in_files))
+
+    _coalescer_cleanup(temp_dir, tmpfile)
+
+
+@pytest.mark.coalesce
+def test_query_cache():
+    '''Verify reads are cached until the table's data changes'''
+
+    temp_dir, tmpfile = _coalescer_init(
+        'tests/data/basic_dual_bgp/parquet-out')
+
+    from suzieq.db.parquet.pq_cache import get_query_cache
+
+    cfg = load_sq_config(config_file=tmpfile.name)
+    cache = get_query_cache(cfg)
+    cache.clear()
+
+    first_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    stats = cache.stats()
+    second_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    assert(cache.stats()['hits'] == stats['hits'] + 1)
+    assert_df_equal(first_df, second_df, None)
+
+    # Modifying what's returned mustn't affect what's cached
+    second_df.drop(second_df.index, inplace=True)
+    third_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    assert_df_equal(first_df, third_df, None)
+
+    # Changing the data must invalidate the cached results
+    stats = cache.stats()
+    do_coalesce(cfg, None)
+    coalesced_df = get_sqobject('routes')(config_file=tmpfile.name).get()
+    assert(cache.stats()['hits'] == stats['hits'])
+    assert_df_equal(first_df, coalesced_df, None)
+
+    # The latest view is read from the snapshot, which the writer updates
+    # after the manifest, so updating it alone must change the token too
+    dbeng = get_sqdb_engine(cfg, 'routes', '', None)
+    token = dbeng.get_table_token('routes')
+    snapshot = dbeng.get_latest_snapshot('routes')
+    with snapshot._locked():
+        snapshot._bump_generation()
+    assert(dbeng.get_table_token('routes') != token)
+
+    _coalescer_cleanup(temp_dir, tmpfile)
+
+
+@pytest.mark.coalesce
+def test_query_cache_stores(monkeypatch):
+    '''Reads of different DBs with equal tokens mustn't share results'''
+
+    from suzieq.db.parquet.parquetdb import SqParquetDB
+    from suzieq.db.parquet.pq_cache import get_query_cache
+
+    # Tables of different DBs can have the same generations
+    monkeypatch.setattr(SqParquetDB, 'get_table_token',
+                        lambda self, table: (('generation', 1),
+                                             ('generation', 1),
+                                             ('snapshot', True, 1)))
+    cfgfiles = [create_dummy_config_file(datadir=x)
+                for x in ['tests/data/basic_dual_bgp/parquet-out',
+                          'tests/data/eos/parquet-out']]
+    cache = get_query_cache(load_sq_config(config_file=cfgfiles[0]))
+    cache.clear()
+
+    dfs = [get_sqobject('device')(config_file=x).get()
+           for x in cfgfiles]
+    assert(set(dfs[0].namespace) != set(dfs[1].namespace))
+    for cfgfile, df in zip(cfgfiles, dfs):
+        stats = cache.stats()
+        cached_df = get_sqobject('device')(config_file=cfgfile).get()
+        assert(cache.stats()['hits'] == stats['hits'] + 1)
+        assert_df_equal(df, cached_df, None)
+
+    for cfgfile in cfgfiles:
+        os.remove(cfgfile)
+
+
+@pytest.mark.coalesce
+def test_latest_snapshot_deltas(tmp_path):
+    '''Writes append deltas to the snapshot, folded in on compaction'''
+
+    import pyarrow as pa
+    from suzieq.db.parquet.pq_latest import SqLatestSnapshot
+
+    schema = pa.schema([('sqvers', pa.string()), ('namespace', pa.string()),
+                        ('hostname', pa.string()), ('prefix', pa.string()),
+                        ('state', pa.string()), ('timestamp', pa.int64())])
+    key_fields = ['namespace', 'hostname', 'prefix']
+    snapshot = SqLatestSnapshot(str(tmp_path))
+
+    def _snapshot_df():
+        datasets, _ = snapshot.get_datasets()
+        return pd.concat([x.to_table().to_pandas() for x in datasets]) \
+                 .sort_values(by='timestamp') \
+                 .drop_duplicates(subset=key_fields, keep='last') \
+                 .sort_values(by=['hostname', 'prefix']) \
+                 .reset_index(drop=True)[schema.names[1:]]
+
+    for ts, state in [(1, 'up'), (2, 'down')]:
+        df = pd.DataFrame({
+            'sqvers': '1.0', 'namespace': 'ns',
+            'hostname': ['leaf01', 'leaf01', 'leaf02'],
+            'prefix': ['10.0.0.0/24', f'10.{ts}.0.0/24', '10.0.0.0/24'],
+            'state': state, 'timestamp': ts})
+        snapshot.merge(pa.Table.from_pandas(df, schema=schema,
+                                            preserve_index=False),
+                       key_fields, schema)
+    assert(snapshot.generation == 2)
+
+    folder = f'{snapshot.folder}/sqvers=1.0/namespace=ns/hostname=leaf01'
+    files = sorted(os.listdir(folder))
+    assert(len(files) == 2 and all(x.startswith('delta-') for x in files))
+    expected = _snapshot_df()
+    assert(expected.shape[0] == 4)
+    assert(expected.query('prefix == "10.0.0.0/24"').state.tolist() ==
+           ['down', 'down'])
+
+    snapshot.compact(key_fields, schema)
+    assert(snapshot.generation == 3)
+    assert(os.listdir(folder) == ['latest.parquet'])
+    assert_df_equal(expected, _snapshot_df(), None)
+
+    # Nothing to fold in, so the readers' cached results stay valid
+    snapshot.compact(key_fields, schema)
+    assert(snapshot.generation == 3)
+
+
 async def _run(cmd):
     proc = await asyncio.create_subprocess_shell(
         cmd,
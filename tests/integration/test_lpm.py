@@ -0,0 +1,58 @@
+from ipaddress import ip_address, ip_network
+
+import pandas as pd
+import pytest
+
+from suzieq.engines.pandas.lpm_index import LpmIndex
+
+
+def _brute_force_lpm(df: pd.DataFrame, address: str) -> set:
+    '''Return the (hostname, vrf, prefix) of the longest match per table'''
+    addr = ip_address(address)
+    best = {}
+    for row in df.itertuples():
+        net = ip_network(row.prefix, strict=False)
+        if net.version != addr.version or addr not in net:
+            continue
+        key = (row.namespace, row.hostname, row.vrf)
+        if key not in best or net.prefixlen > best[key][1]:
+            best[key] = (row.prefix, net.prefixlen)
+    return set((k[1], k[2], v[0]) for k, v in best.items())
+
+
+@pytest.mark.route
+def test_lpm_index():
+    '''The LPM index must match a brute force LPM in every route table'''
+    routes = [
+        ('leaf01', 'default', '0.0.0.0/0'),
+        ('leaf01', 'default', '10.0.0.0/8'),
+        ('leaf01', 'default', '10.1.0.0/16'),
+        ('leaf01', 'default', '10.1.1.1/32'),
+        ('leaf01', 'evpn-vrf', '10.1.0.0/24'),
+        ('leaf01', 'default', '::/0'),
+        ('leaf01', 'default', '2001:db8::/32'),
+        ('leaf01', 'default', '2001:db8:0:1::/64'),
+        ('leaf01', 'default', '2001:db8:0:1::1/128'),
+        ('leaf02', 'default', '10.0.0.0/8'),
+        ('leaf02', 'default', '10.1.1.0/25'),
+        ('leaf02', 'default', '2001:db8:8000::/33'),
+        ('leaf02', 'default', 'junk'),
+    ]
+    df = pd.DataFrame(routes, columns=['hostname', 'vrf', 'prefix'])
+    df.insert(0, 'namespace', 'dual-evpn')
+    index = LpmIndex(df)
+
+    addresses = ['10.1.1.1', '10.1.1.200', '10.2.0.1', '192.168.1.1',
+                 '2001:db8:0:1::1', '2001:db8:0:1::2', '2001:db8:8000::1',
+                 '3001::1']
+    rslt = index.lpm(addresses)
+    validdf = df.query('prefix != "junk"')
+    for addr in addresses:
+        got = set((x.hostname, x.vrf, x.prefix)
+                  for x in rslt.query(f'address == "{addr}"').itertuples())
+        assert got == _brute_force_lpm(validdf, addr), addr
+
+    # A single lookup without the address column
+    rslt = index.lpm(['10.1.1.200'], addr_col='')
+    assert 'address' not in rslt.columns
+    assert sorted(rslt.prefix.tolist()) == ['10.0.0.0/8', '10.1.0.0/16']
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from suzieq.sqobjects.path import PathObj
+from tests.conftest import create_dummy_config_file
+
+PAIRS = [('172.16.1.101', '172.16.2.104'),
+         ('172.16.1.104', '172.16.2.104'),
+         ('172.16.1.101', '172.16.253.1'),
+         ('172.16.1.103', '172.16.2.102'),
+         ('172.16.1.101', '2001:db8::12')]
+
+
+@pytest.mark.engines
+@pytest.mark.cumulus
+def test_trace_pairs():
+    '''Paths traced in a batch must match the paths traced one at a time'''
+    cfgfile = create_dummy_config_file(
+        datadir='tests/data/multidc/parquet-out/')
+    pathobj = PathObj(config_file=cfgfile)
+
+    df = pathobj.engine.trace_pairs('dual-evpn', PAIRS)
+    assert not df.empty
+    for src, dest in PAIRS:
+        got = df.query(f'source == "{src}" and dest == "{dest}"') \
+                .drop(columns=['source', 'dest']) \
+                .dropna(axis=1, how='all') \
+                .reset_index(drop=True)
+        try:
+            exp = pathobj.get(namespace=['dual-evpn'], source=src, dest=dest)
+        except Exception as e:
+            assert got.error.tolist() == [str(e)]
+            continue
+
+        if 'error' in got.columns and 'error' not in exp.columns:
+            assert (got.error == '').all()
+            got = got.drop(columns=['error'])
+        pd.testing.assert_frame_equal(got, exp.reset_index(drop=True),
+                                      check_dtype=False)
+
+
+@pytest.mark.engines
+@pytest.mark.cumulus
+def test_bulk_paths(monkeypatch):
+    '''Paths between a source and dest set, in one or many processes'''
+    cfgfile = create_dummy_config_file(
+        datadir='tests/data/multidc/parquet-out/')
+    pathobj = PathObj(config_file=cfgfile)
+    sources = ['172.16.1.101', '172.16.1.104']
+    dests = ['172.16.2.104', '172.16.1.104', '172.16.253.1']
+
+    df = pathobj.bulk(namespace=['dual-evpn'], source=sources, dest=dests)
+    pairs = set(zip(df.source, df.dest))
+    assert pairs == set((x, y) for x in sources for y in dests if x != y)
+
+    exp = pathobj.bulk(namespace=['dual-evpn'],
+                       pairs=[f'{x},{y}' for x, y in sorted(pairs)])
+    monkeypatch.setattr('suzieq.engines.pandas.path.PATH_PAIRS_PER_CHUNK', 2)
+    got = pathobj.bulk(namespace=['dual-evpn'],
+                       pairs=[f'{x},{y}' for x, y in sorted(pairs)],
+                       workers=2)
+    pd.testing.assert_frame_equal(got, exp)
+
+    with pytest.raises(AttributeError):
+        pathobj.bulk(namespace=['dual-evpn'], pairs=['172.16.1.101'])
@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+
+import pytest
+import pandas as pd
+from unittest.mock import Mock
+import pyarrow as pa
+
+from suzieq.poller.nodes import get_worker_for_host
+from suzieq.poller.nodes.node import AimdConcurrency
+from suzieq.poller.nodes.shell import SshShell, get_shell_profile
+from suzieq.poller.scheduler import PollScheduler
+from suzieq.poller.services.service import Service
+from suzieq.poller.writer import RecordBatchBuilder
+from suzieq.poller import sq_poller
+from tests.conftest import create_dummy_config_file
+
+
+@pytest.mark.poller
+def test_worker_for_host():
+    '''Hosts must be spread across workers and stick to their worker'''
+    hosts = [f'dc1/10.0.{x//256}.{x%256}:22' for x in range(2000)]
+
+    assign = {x: get_worker_for_host(x, 4) for x in hosts}
+    assert assign == {x: get_worker_for_host(x, 4) for x in hosts}
+    assert set(assign.values()) == set(range(4))
+    for worker in range(4):
+        assert list(assign.values()).count(worker) > 400
+
+    assert all(get_worker_for_host(x, 1) == 0 for x in hosts)
+
+    # Adding a worker only moves hosts to the new worker
+    for host in hosts:
+        new_worker = get_worker_for_host(host, 5)
+        assert new_worker in [assign[host], 4]
+
+
+@pytest.mark.poller
+def test_poller_main_workers(monkeypatch):
+    '''With workers, the poller must start the supervisor, not poll itself'''
+    calls = []
+    worker_error = None
+
+    async def start_poller(userargs, cfg):
+        calls.append(('poller', None))
+        if worker_error == 'shutdown':
+            await sq_poller.process_signal(signal.SIGTERM, None)
+        if worker_error:
+            raise RuntimeError('Event loop stopped before Future completed.')
+
+    def run_poller_supervisor(userargs, cfg, num_workers):
+        calls.append(('supervisor', num_workers))
+        if worker_error:
+            # A worker must only exit cleanly if asked to terminate, else
+            # the supervisor doesn't restart it
+            with pytest.raises(SystemExit) as exc:
+                sq_poller.run_poller_worker(userargs, cfg, 0, num_workers)
+            calls.append(('worker', exc.value.code))
+
+    monkeypatch.setattr(sq_poller, 'start_poller', start_poller)
+    monkeypatch.setattr(sq_poller, 'run_poller_supervisor',
+                        run_poller_supervisor)
+    monkeypatch.setattr(sq_poller.uvloop, 'install', lambda: None)
+    # Keep the worker from changing the test process' signals & logging
+    monkeypatch.setattr(sq_poller.signal, 'signal', lambda *args: None)
+    monkeypatch.setattr(logging.getLogger(), 'handlers',
+                        list(logging.getLogger().handlers))
+
+    cfgfile = create_dummy_config_file()
+    try:
+        for workers, worker_error, exp in [
+                ('2', None, [('supervisor', 2)]),
+                ('1', None, [('poller', None)]),
+                ('2', 'died', [('supervisor', 2), ('poller', None),
+                               ('worker', 1)]),
+                ('2', 'shutdown', [('supervisor', 2), ('poller', None),
+                                   ('worker', 0)])]:
+            calls.clear()
+            monkeypatch.setattr(sq_poller, 'shutdown_requested', False)
+            monkeypatch.setattr(sys, 'argv', [
+                'sq-poller', '-c', cfgfile, '-D', cfgfile,
+                '--workers', workers])
+            with pytest.raises(SystemExit):
+                sq_poller.poller_main()
+            assert calls == exp
+    finally:
+        os.remove(cfgfile)
+
+
+@pytest.mark.poller
+def test_poll_scheduler():
+    '''Polls must be spread across the period and capped when in flight'''
+    period = 1
+    polls = []
+
+    async def run_polls():
+        scheduler = PollScheduler(max_inflight=3, jitter=0)
+
+        def post(nodename):
+            polls.append((time.time(), nodename))
+            assert scheduler.stats()['inflight'] <= 3
+            # Complete every poll a little later
+            asyncio.get_event_loop().call_later(
+                0.05, scheduler.done, 'svc', nodename)
+            return True
+
+        nodes = [f'leaf{x:02d}' for x in range(20)]
+        start = time.time()
+        for node in nodes:
+            scheduler.schedule_first('svc', node, period, post, node)
+        await asyncio.sleep(period*1.5)
+        return start, scheduler
+
+    start, scheduler = asyncio.run(run_polls())
+    assert sorted(x[1] for x in polls) == \
+        sorted(f'leaf{x:02d}' for x in range(20))
+    # The phases are spread and not all at the start of the period
+    offsets = [x[0] - start for x in polls]
+    assert max(offsets) - min(offsets) > period/2
+    assert all(0 <= PollScheduler.get_phase(f'svc/{x[1]}', period) < period
+               for x in polls)
+    assert scheduler.stats()['inflight'] == 0
+
+
+@pytest.mark.poller
+def test_aimd_concurrency():
+    '''Concurrency must grow while fast and back off on timeouts'''
+    ctrl = AimdConcurrency(initial=4, max_limit=8)
+    for _ in range(100):
+        ctrl.update('routes', 1.0, False)
+    assert ctrl.current == 8
+
+    ctrl.update('routes', 0.001, True)
+    assert ctrl.current == 4
+    # A burst of timeouts only backs off once
+    ctrl.update('routes', 5, True)
+    assert ctrl.current == 4
+
+    # Slow compared to the fastest seen for the service is congestion
+    ctrl._last_decrease = 0
+    ctrl.update('interfaces', 0.5, False)
+    ctrl.update('interfaces', 5, False)
+    assert ctrl.current == 2
+
+    for _ in range(10):
+        ctrl.update('routes', 0.01, True)
+        ctrl._last_decrease = 0
+    assert ctrl.current == 1
+
+
+class _FakeShellProcess:
+    '''Mimics the interactive shell of a device, returning canned output'''
+
+    def __init__(self, outputs: dict, prompt: str, echo: bool):
+        self.outputs = outputs
+        self.prompt = prompt
+        self.echo = echo
+        self.stdin = self
+        self.stdout = self
+        self._pending = ['Welcome banner\r\n', prompt]
+
+    def write(self, data: str):
+        for line in data.split('\n')[:-1]:
+            if self.echo:
+                self._pending.append(f'{line}\r\n')
+            if line == 'stty -echo':
+                self.echo = False
+            elif line.startswith('export PS1'):
+                self.prompt = ''
+            elif line.startswith('echo '):
+                self._pending.append(line.split()[1].replace('$?', '0') +
+                                     '\r\n')
+            else:
+                out = self.outputs.get(line, '')
+                # Return the output in small pieces, as a device would
+                self._pending += [out[i:i+7] for i in range(0, len(out), 7)]
+            if self.prompt:
+                self._pending.append(self.prompt)
+
+    async def read(self, size: int) -> str:
+        return self._pending.pop(0) if self._pending else ''
+
+    def close(self):
+        pass
+
+
+@pytest.mark.poller
+@pytest.mark.parametrize('devtype', ['iosxe', 'cumulus'])
+def test_ssh_shell(devtype):
+    '''Pipelined commands must return each command's output'''
+    outputs = {
+        'show version': 'Cisco IOS XE Software\r\nuptime is 1 day\r\n',
+        'show ip route': ''.join(f'10.0.{x}.0/24 via 10.1.1.1\r\n'
+                                 for x in range(50)),
+        'show empty': '',
+        'show bad': '% Invalid input detected\r\n',
+    }
+    profile = get_shell_profile(devtype)
+
+    async def run_cmds():
+        proc = _FakeShellProcess(outputs, 'router#', profile.echo)
+        shell = SshShell(proc, profile)
+        await shell.run([''] + profile.init_cmds, 5)
+        return await shell.run(list(outputs.keys()), 5)
+
+    result = asyncio.run(run_cmds())
+    assert [x[1] for x in result] == [x.replace('\r', '')
+                                      for x in outputs.values()]
+    if devtype == 'iosxe':
+        assert [x[0] for x in result] == [0, 0, 0, 1]
+
+
+@pytest.mark.poller
+def test_record_batch_builder():
+    '''The builder must match converting the records via pandas'''
+    schema = pa.schema([
+        ('namespace', pa.string()), ('hostname', pa.string()),
+        ('vrf', pa.string()), ('prefix', pa.string()),
+        ('metric', pa.int64()), ('weight', pa.float32()),
+        ('active', pa.bool_()), ('timestamp', pa.int64()),
+        ('oifs', pa.list_(pa.string())),
+        ('nexthopList', pa.list_(pa.struct([('nexthop', pa.string()),
+                                            ('oif', pa.string()),
+                                            ('weight', pa.int32())]))),
+    ])
+    records = [
+        {'namespace': 'dc1', 'hostname': 'leaf01', 'vrf': 'default',
+         'prefix': f'10.0.{x}.0/24', 'metric': x, 'weight': 1.5,
+         'active': True, 'timestamp': 1620000000000 + x,
+         'oifs': ['swp1', 'swp2'],
+         'nexthopList': [{'nexthop': '10.1.1.1', 'oif': 'swp1',
+                          'weight': 1}],
+         'notInSchema': 'ignored'}
+        for x in range(10)]
+    records[3]['weight'] = float('nan')
+    records[4]['oifs'] = []
+    records[5]['metric'] = 5.0
+
+    builder = RecordBatchBuilder(schema)
+    builder.extend(records[:5])
+    for rec in records[5:]:
+        builder.append(rec)
+    assert builder.num_rows == len(records)
+
+    table = pa.Table.from_batches([builder.build()])
+    expected = pa.Table.from_pandas(pd.DataFrame.from_dict(records),
+                                    schema=schema, preserve_index=False)
+    assert table.equals(expected)
+
+
+@pytest.mark.poller
+def test_record_state_nan():
+    '''Records with NaN values mustn't be seen as changed on every poll'''
+    schema = Mock()
+    schema.get_arrow_schema.return_value = pa.schema([])
+    svc = Service('routes', {}, 60, 'state', ['vrf', 'prefix'], [], schema,
+                  None)
+
+    def get_records(weight: float) -> list:
+        # Every poll returns new NaN objects, as parsing the output would
+        return [{'vrf': 'default', 'prefix': '10.0.0.0/24',
+                 'weight': float(weight), 'oifs': ['swp1', float('nan')],
+                 'timestamp': 1}]
+
+    old = svc.get_record_state(get_records('nan'))
+    adds, dels = svc.get_diff(old, svc.get_record_state(get_records('nan')))
+    assert adds == [] and dels == []
+
+    adds, dels = svc.get_diff(old, svc.get_record_state(get_records(1)))
+    assert [x['weight'] for x in adds] == [1]
+    assert dels == []
+
+
+@pytest.mark.poller
+def test_commit_data_conversion_error():
+    '''Changes dropped as they can't be converted must be sent again'''
+    schema = Mock()
+    schema.get_arrow_schema.return_value = pa.schema([
+        ('prefix', pa.string()), ('metric', pa.int64()),
+        ('timestamp', pa.int64())])
+    queue = Mock()
+    svc = Service('routes', {}, 60, 'state', ['prefix'], [], schema, queue)
+
+    good = [{'prefix': '10.0.0.0/24', 'metric': 1, 'timestamp': 1}]
+    bad = good + [{'prefix': '10.0.1.0/24', 'metric': 'junk',
+                   'timestamp': 1}]
+    asyncio.run(svc.commit_data(good, 'dc1', 'leaf01'))
+    assert queue.put_nowait.call_count == 1
+
+    asyncio.run(svc.commit_data(bad, 'dc1', 'leaf01'))
+    assert queue.put_nowait.call_count == 1
+
+    # The next poll fixes the record, which must be written
+    fixed = good + [{'prefix': '10.0.1.0/24', 'metric': 2, 'timestamp': 2}]
+    asyncio.run(svc.commit_data(fixed, 'dc1', 'leaf01'))
+    assert queue.put_nowait.call_count == 2
+    batch = queue.put_nowait.call_args[0][0]['records']
+    assert batch.column(0).to_pylist() == ['10.0.1.0/24']
@@ -10,7 +10,7 @@ from suzieq.restServer.query import app, get_configured_api_key, API_KEY_NAME, r
 
 ENDPOINT = "http://localhost:8000/api/v2"
 
-VERBS = ['show', 'summarize', 'assert', 'lpm',
+VERBS = ['show', 'summarize', 'assert', 'lpm', 'bulk',
          'unique']  # add 'top' when it's supported
 
 #
@@ -34,6 +34,9 @@ FILTERS = ['',  # for vanilla commands without any filter
            'namespace=ospf-ibgp&namespace=ospf-single',
            'address=10.0.0.11',
            'dest=172.16.2.104&src=172.16.1.101&namespace=ospf-ibgp',
+           'dest=172.16.2.104&src=172.16.1.101&src=172.16.1.104'
+           '&namespace=dual-evpn',
+           'pairs=172.16.1.101,172.16.2.104&namespace=dual-evpn',
            'columns=namespace',
            'view=latest',
            'address=10.0.0.11&view=all',
@@ -101,7 +104,10 @@ GOOD_FILTERS_FOR_SERVICE_VERB = {
     'columns=namespace': ['all'],
     'hostname=leaf01': ['all'],
     'dest=172.16.2.104&src=172.16.1.101&namespace=ospf-ibgp':
-    ['path/show', 'path/summarize'],
+    ['path/show', 'path/summarize', 'path/bulk'],
+    'dest=172.16.2.104&src=172.16.1.101&src=172.16.1.104'
+    '&namespace=dual-evpn': ['path/bulk'],
+    'pairs=172.16.1.101,172.16.2.104&namespace=dual-evpn': ['path/bulk'],
     'ifname=swp1': ['interface/show', 'interface/assert',
                     'lldp/show', 'ospf/show', 'ospf/assert'],
     'ipAddress=10.0.0.11': ['arpnd/show'],
@@ -112,7 +118,7 @@ GOOD_FILTERS_FOR_SERVICE_VERB = {
     'oif=eth1.4': ['arpnd/show'],
     'peer=eth1.2': ['bgp/show'],
     'polled=True': ['topology/show'],
-    'prefix=10.0.0.101/32': ['route/show'],
+    'prefix=10.0.0.101/32': ['route/show', 'address/show'],
     'prefixlen=24': ['route/show'],
     'priVtepIp=10.0.0.112': ['evpnVni/show'],
     'protocol=bgp&protocol=ospf': ['route/show'],
@@ -275,6 +281,25 @@ def test_rest_services(app_initialize, service, verb, arg):
     get(ENDPOINT, service, verb, arg)
 
 
+def test_rest_context_reuse(app_initialize):
+    '''The context must be shared across requests and reloadable'''
+    from suzieq.restServer.query import get_app_context
+
+    get(ENDPOINT, 'device', 'show', '')
+    ctxt = get_app_context()
+    get(ENDPOINT, 'device', 'show', 'hostname=leaf01')
+    assert get_app_context() is ctxt
+
+    client = TestClient(app)
+    response = client.post(f'{ENDPOINT}/reload',
+                           headers={API_KEY_NAME: get_configured_api_key()})
+    assert response.status_code == 200
+    assert get_app_context() is not ctxt
+
+    response = client.post(f'{ENDPOINT}/reload')
+    assert response.status_code == 401
+
+
 @pytest.fixture()
 def app_initialize():
     from suzieq.restServer.query import app_init
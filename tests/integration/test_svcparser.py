@@ -0,0 +1,98 @@
+import os
+import json
+import timeit
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+import yaml
+
+from suzieq.utils import get_sq_install_dir
+from suzieq.poller.services.svcparser import (cons_recs_from_json_template,
+                                              compile_json_template)
+
+input_dir = '/tests/integration/parsing/input/'
+# Records extracted from the inputs by the normalize templates, as
+# extracted by the implementation before the templates were compiled
+normalized_dir = '/tests/integration/parsing/normalized/'
+
+
+def _get_normalize_templates(service):
+    '''Return the normalize templates of the service keyed by device type'''
+    svc_file = f'{get_sq_install_dir()}/config/{service}.yml'
+    with open(svc_file, 'r') as f:
+        svc_def = yaml.safe_load(f.read())
+
+    templates = {}
+    for devtype, val in svc_def['apply'].items():
+        if 'copy' in val:
+            val = svc_def['apply'].get(val['copy'], {})
+        if 'normalize' in val:
+            templates[devtype] = val['normalize']
+    return templates
+
+
+def _get_json_samples():
+    '''Return the service, template and JSON input of the parsing samples'''
+    samples = []
+    for file in sorted(Path(os.path.abspath(os.curdir) + input_dir)
+                       .glob('*.yml')):
+        service = file.stem
+        templates = _get_normalize_templates(service)
+        with open(file, 'r') as f:
+            inputs = yaml.safe_load(f.read())['input']
+        for devtype, data in inputs.items():
+            if devtype not in templates:
+                continue
+            samples.append(pytest.param(templates[devtype], json.loads(data),
+                                        _get_normalized(service, devtype),
+                                        id=f'{service}-{devtype}'))
+    return samples
+
+
+def _get_normalized(service, devtype):
+    '''Return the expected records of the service's parsing sample'''
+    file = f'{os.path.abspath(os.curdir)}{normalized_dir}' \
+        f'{service}-{devtype}.yml'
+    with open(file, 'r') as f:
+        return yaml.safe_load(f.read())
+
+
+@pytest.mark.parsing
+@pytest.mark.parametrize('template, data, expected', _get_json_samples())
+def test_compiled_json_template(template, data, expected):
+    '''The templates must extract the records in the parsing samples'''
+    assert cons_recs_from_json_template(template, deepcopy(data)) == expected
+    compiled = compile_json_template(template)
+    # Compiled templates are reused, so use it more than once
+    for _ in range(2):
+        assert cons_recs_from_json_template(compiled,
+                                            deepcopy(data)) == expected
+
+
+@pytest.mark.slow
+@pytest.mark.parsing
+def test_compiled_json_template_benchmark():
+    '''Extracting with a compiled template mustn't be slower than compiling
+    the template on every call, as was done before'''
+    samples = [x.values for x in _get_json_samples()]
+    assert samples
+
+    inputs = [x[1] for x in samples]
+    strs = [x[0] for x in samples]
+    compiled = [compile_json_template(x) for x in strs]
+
+    def run(templates, compile_every_call):
+        for tmplt, data in zip(templates, inputs):
+            if compile_every_call:
+                tmplt = compile_json_template(tmplt)
+            cons_recs_from_json_template(tmplt, deepcopy(data))
+
+    # Subtract the cost of copying the input, which the extraction mutates
+    copy_time = min(timeit.repeat(lambda: [deepcopy(x) for x in inputs],
+                                  number=20, repeat=5))
+    str_time = min(timeit.repeat(lambda: run(strs, True),
+                                 number=20, repeat=5)) - copy_time
+    compiled_time = min(timeit.repeat(lambda: run(compiled, False),
+                                      number=20, repeat=5)) - copy_time
+    assert compiled_time <= str_time